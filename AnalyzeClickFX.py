@@ -1,48 +1,14 @@
 import pandas as pd
-import zipfile
+import numpy as np
 import os
-from datetime import datetime
-import pytz
 import plotly.graph_objects as go
 import tkinter as tk
 from tkinter import simpledialog, messagebox, filedialog
 import plotly.io as pio
+from ClickData import BarStore, load_store_bars, get_available_years
 
-ENCODING = 'shift_jis'
-
-def parse_timestamp(timestamp):
-    """
-    2つの異なるフォーマットのタイムスタンプを解析する
-    フォーマット1: YYYY/MM/DD HH:MM:SS
-    フォーマット2: YYYYMMDDHHMMSS
-    """
-    if not isinstance(timestamp, str):
-        timestamp = str(timestamp)
-        
-    timestamp = timestamp.strip()
-    
-    try:
-        if '/' in timestamp:
-            # フォーマット1: YYYY/MM/DD HH:MM:SS
-            return datetime.strptime(timestamp, '%Y/%m/%d %H:%M:%S')
-        else:
-            # フォーマット2: YYYYMMDDHHMMSS
-            return datetime.strptime(timestamp, '%Y%m%d%H%M%S')
-    except ValueError as e:
-        print(f"Error parsing timestamp: {timestamp}")
-        raise e
-
-def convert_to_ny_time(timestamp):
-    """
-    タイムスタンプを日本時間からニューヨーク時間に変換
-    """
-    if not isinstance(timestamp, datetime):
-        timestamp = parse_timestamp(timestamp)
-        
-    jst = pytz.timezone('Asia/Tokyo')
-    japan_time = jst.localize(timestamp)
-    ny_time = japan_time.astimezone(pytz.timezone('America/New_York'))
-    return ny_time.strftime('%Y-%m-%d %H:%M:%S')
+# True なら1か月分ずつ読み込んで集計する（メモリ使用量が期間の長さに比例して増えない）
+STREAMING = True
 
 def get_user_input():
     root = tk.Tk()
@@ -87,47 +53,18 @@ def get_user_input():
     return folder_path, prefix[0]
 
 def load_trade_data(folder_path, prefix, start_year, end_year):
-    all_data = []
     error_files = []
-    
-    for file_name in os.listdir(folder_path):
-        if file_name.startswith(prefix) and file_name.endswith('.zip'):
-            zip_path = os.path.join(folder_path, file_name)
-            try:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    for csv_file in zip_ref.namelist():
-                        parts = csv_file.split('/')
-                        if (len(parts) > 1 and parts[0].endswith('_EX') == False and csv_file.endswith('.csv')):
-                            try:
-                                with zip_ref.open(csv_file) as file:
-                                    df = pd.read_csv(file, 
-                                                   names=['datetime', 'bid_open', 'bid_high', 'bid_low', 'bid_close', 
-                                                         'ask_open', 'ask_high', 'ask_low', 'ask_close'],
-                                                   encoding=ENCODING, skiprows=1)
-                                    
-                                    df['datetime'] = df['datetime'].apply(convert_to_ny_time)
-                                    df['datetime'] = pd.to_datetime(df['datetime'])
-                                    
-                                    df = df[(df['datetime'].dt.year >= start_year) & 
-                                          (df['datetime'].dt.year <= end_year)]
-                                    
-                                    if not df.empty:
-                                        all_data.append(df)
-                            except Exception as e:
-                                error_files.append(f"{csv_file}: {str(e)}")
-            except Exception as e:
-                error_files.append(f"{file_name}: {str(e)}")
+
+    # 共通のデータ層（ClickData）のバイナリ保存形式からNY時間で読み込む（時刻順・重複時刻は最初の行を残す）
+    combined_df = load_store_bars(prefix, start_year, end_year, data_folder=folder_path, errors=error_files)
 
     if error_files:
         error_message = "以下のファイルの処理中にエラーが発生しました：\n" + "\n".join(error_files)
         messagebox.showwarning("警告", error_message)
 
-    if all_data:
-        combined_df = pd.concat(all_data, ignore_index=True)
-        combined_df = combined_df.sort_values(by='datetime').drop_duplicates(subset='datetime', keep='first').reset_index(drop=True)
-    else:
-        combined_df = pd.DataFrame()
-    return combined_df
+    if combined_df.empty:
+        return pd.DataFrame()
+    return combined_df.reset_index()
 
 def get_year_range(min_year, max_year):
     root = tk.Tk()
@@ -193,6 +130,67 @@ def calculate_monthly_stats_by_time_frame(df):
     monthly_stats = df.groupby(['month', 'hour'])['volatility'].agg(['mean', 'std', 'count']).reset_index()
     return monthly_stats
 
+def update_running_stats(running, df, keys):
+    """
+    キーごとの (count, mean, M2) の累積に df の volatility を合流させる（Welford 法の並列版）
+    M2 は平均からの偏差の二乗和で、最後に M2 / (count - 1) が不偏分散になる
+    """
+    grouped = df.groupby(keys)['volatility']
+    count = grouped.count()
+    batch = pd.DataFrame({'count': count, 'mean': grouped.mean(), 'M2': grouped.var(ddof=0) * count})
+    if running is None:
+        return batch
+
+    index = running.index.union(batch.index)
+    a = running.reindex(index, fill_value=0)
+    b = batch.reindex(index, fill_value=0)
+    n = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    return pd.DataFrame({
+        'count': n,
+        'mean': a['mean'] + delta * b['count'] / n,
+        'M2': a['M2'] + b['M2'] + delta ** 2 * a['count'] * b['count'] / n
+    })
+
+def finalize_running_stats(running, keys):
+    """
+    累積から calculate_*_stats_by_time_frame と同じ形（mean, std(ddof=1), count）の表を作る
+    """
+    if running is None:
+        return pd.DataFrame(columns=keys + ['mean', 'std', 'count'])
+    count = running['count'].astype('int64')
+    std = np.sqrt(running['M2'] / (count - 1)).where(count > 1)
+    return pd.DataFrame({'mean': running['mean'], 'std': std, 'count': count}).reset_index()
+
+def calculate_stats_streaming(folder_path, prefix, start_year, end_year):
+    """
+    NY時間の1か月分ずつ読み込んで6分足に変換し、年×時間・月×時間のボラティリティの統計を累積する
+    6分足の区切りは月の境目をまたがないので、全期間をまとめて変換した場合と同じ結果になる
+    バイナリ保存形式（BarStore）の更新（マニフェストの確認）は最初に1回だけ行い、各月は保存済みの行から切り出す
+    """
+    error_files = []
+    yearly_running = None
+    monthly_running = None
+    store = BarStore(prefix)
+    store.sync(folder_path, errors=error_files)
+    month_starts = pd.date_range(f'{start_year}-01-01', f'{end_year + 1}-01-01', freq='MS')
+    for month_start, month_end in zip(month_starts[:-1], month_starts[1:]):
+        month_df = store.to_frame(month_start, month_end - pd.Timedelta(1, 'ns'))
+        if month_df.empty:
+            continue
+        df = calculate_volatility(resample_to_6min(month_df.reset_index()))
+        df['hour'] = df['datetime'].dt.hour
+        df['year'] = df['datetime'].dt.year
+        df['month'] = df['datetime'].dt.month
+        yearly_running = update_running_stats(yearly_running, df, ['year', 'hour'])
+        monthly_running = update_running_stats(monthly_running, df, ['month', 'hour'])
+
+    if error_files:
+        error_message = "以下のファイルの処理中にエラーが発生しました：\n" + "\n".join(error_files)
+        messagebox.showwarning("警告", error_message)
+
+    return finalize_running_stats(yearly_running, ['year', 'hour']), finalize_running_stats(monthly_running, ['month', 'hour'])
+
 def create_yearly_line_plots(stats, base_title, filename):
     # 平均値のグラフ
     fig_mean = go.Figure()
@@ -355,15 +353,8 @@ def main():
     folder_path, prefix = get_user_input()
     
     # 利用可能な年の範囲を取得
-    all_years = set()
-    for file_name in os.listdir(folder_path):
-        if file_name.startswith(prefix) and file_name.endswith('.zip'):
-            with zipfile.ZipFile(os.path.join(folder_path, file_name), 'r') as zip_ref:
-                for csv_file in zip_ref.namelist():
-                    parts = csv_file.split('/')
-                    if (len(parts) > 1 and parts[0].endswith('_EX') == False and csv_file.endswith('.csv')):
-                        year = int(csv_file.split('_')[1][:4])
-                        all_years.add(year)
+    # zipファイル名だけで判定する（zipは開かない）
+    all_years = set(get_available_years(folder_path, prefix))
 
     if not all_years:
         messagebox.showerror("エラー", f"通貨ペア {prefix} のデータが見つかりません。")
@@ -373,20 +364,25 @@ def main():
     min_year, max_year = min(all_years), max(all_years)
     start_year, end_year = get_year_range(min_year, max_year)
     
-    #
-    trade_data_df = load_trade_data(folder_path, prefix, start_year, end_year)
-
-    if trade_data_df.empty:
-        print(f"No data available for the specified range {start_year}-{end_year}.")
+    if STREAMING:
+        # 1か月分ずつ読み込んで年ごと・月ごとの集計を累積する
+        yearly_stats, monthly_stats = calculate_stats_streaming(folder_path, prefix, start_year, end_year)
+        if yearly_stats.empty:
+            print(f"No data available for the specified range {start_year}-{end_year}.")
     else:
-        trade_data_6min_df = resample_to_6min(trade_data_df)
-        trade_data_6min_df = calculate_volatility(trade_data_6min_df)
-        
-        # 年ごとの集計
-        yearly_stats = calculate_yearly_stats_by_time_frame(trade_data_6min_df)
-        
-        # 月ごとの集計（全ての年を含む）
-        monthly_stats = calculate_monthly_stats_by_time_frame(trade_data_6min_df)
+        trade_data_df = load_trade_data(folder_path, prefix, start_year, end_year)
+
+        if trade_data_df.empty:
+            print(f"No data available for the specified range {start_year}-{end_year}.")
+        else:
+            trade_data_6min_df = resample_to_6min(trade_data_df)
+            trade_data_6min_df = calculate_volatility(trade_data_6min_df)
+
+            # 年ごとの集計
+            yearly_stats = calculate_yearly_stats_by_time_frame(trade_data_6min_df)
+
+            # 月ごとの集計（全ての年を含む）
+            monthly_stats = calculate_monthly_stats_by_time_frame(trade_data_6min_df)
 
     create_yearly_line_plots(yearly_stats, 'Average Volatility by Time Frame (Yearly)_{prefix}', 'AverageVolatility_Yearly_{prefix}')
 
@@ -0,0 +1,72 @@
+import copy
+import json
+import argparse
+import traceback
+from SearchOptimizer import SEARCH_METHODS
+
+# 定数の定義
+EXIT_OK = 0      # すべての処理が終わった
+EXIT_FAILED = 1  # 処理の途中で失敗した（例外・最適化の失敗・データがない）
+EXIT_USAGE = 2   # 引数の誤り（argparse が終了するときと同じ）
+MODES = ['Backtest', 'Optimize']
+PROCESS_MODES = ['yearly', 'all_data', 'walk_forward']
+PARAM_NAMES = ['entry_time', 'take_profit', 'stop_loss', 'close_time']
+
+def make_parser(description, pair=False):
+    """
+    バックテストのスクリプトに共通の引数。引数を1つも付けずに起動したときだけ Tk の画面を開く
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--gui', action='store_true', help='Tk の画面で設定して実行する')
+    if pair:
+        parser.add_argument('--pair', help='通貨ペア（例: USDJPY）')
+    parser.add_argument('--params', help='all_params の形式の設定ファイル（省略するとスクリプトの設定ファイル）')
+    parser.add_argument('--mode', choices=MODES, help='省略すると設定ファイルの "mode"（なければ Backtest）')
+    parser.add_argument('--process-mode', choices=PROCESS_MODES)
+    parser.add_argument('--start-year', type=int)
+    parser.add_argument('--end-year', type=int)
+    for name in PARAM_NAMES:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name,
+                            help='Backtest なら値（例: 1630）、Optimize なら候補（例: "range(1615,1645,5)"）')
+    parser.add_argument('--method', choices=SEARCH_METHODS)
+    parser.add_argument('--budget')
+    parser.add_argument('--save', action='store_true', help='引数で上書きした設定を設定ファイルに保存する')
+    return parser
+
+def load_params_file(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def apply_args(params, args, years):
+    """
+    設定（all_params の形式）に引数で指定した項目を上書きしたコピーを返す
+    entry_time などは mode が Backtest なら "backtest" に、Optimize かウォークフォワードなら "optimize" に入れる
+    年の指定がどこにもなければ years（利用可能な年）の最初と最後
+    """
+    params = copy.deepcopy(params)
+    params['mode'] = args.mode or params.get('mode', 'Backtest')
+    params['process_mode'] = args.process_mode or params.get('process_mode', 'yearly')
+    year_range = params['year_range']
+    year_range['start_year'] = args.start_year or year_range.get('start_year') or years[0]
+    year_range['end_year'] = args.end_year or year_range.get('end_year') or years[-1]
+
+    optimize = params['process_mode'] == 'walk_forward' or params['mode'] == 'Optimize'
+    section = params['optimize' if optimize else 'backtest']
+    for name in PARAM_NAMES:
+        if getattr(args, name) is not None:
+            section[name] = getattr(args, name)
+    if args.method is not None:
+        params['optimize']['method'] = args.method
+    if args.budget is not None:
+        params['optimize']['budget'] = args.budget
+    return params
+
+def run_main(main, **kwargs):
+    """
+    main(**kwargs) を実行して終了コードを返す（main が False を返すか例外なら EXIT_FAILED）
+    """
+    try:
+        return EXIT_OK if main(**kwargs) else EXIT_FAILED
+    except Exception:
+        traceback.print_exc()
+        return EXIT_FAILED
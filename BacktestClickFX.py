@@ -1,56 +1,32 @@
 import os
-from datetime import datetime
-import zipfile
+import sys
 import pandas as pd
 from backtesting import Backtest, Strategy
-from tkinter import Tk, Label, Button, StringVar, Entry, OptionMenu, Radiobutton
 import json
-import pytz
+from functools import partial
+from FixedTimeEngine import run_fixed_time_backtest
+from SparseBacktest import run_sparse_backtest
+from TensorBacktest import backtest_tensor
+from GridOptimizer import save_results, RESULT_CACHE, ENGINE_VERSION
+from ResultCache import data_fingerprint, code_version, make_key, storable_stats
+from SearchOptimizer import search, SEARCH_METHODS, DEFAULT_BUDGET, SEARCH_SEED
+from WalkForward import walk_forward
+from YearlyRunner import run_yearly
+from BacktestCLI import make_parser, load_params_file, apply_args, run_main, EXIT_OK, EXIT_FAILED
+from ClickData import load_store_bars, to_backtest_frame, to_spread_frame, get_available_years, get_available_instruments, BID_COLUMNS, FILL_COLUMNS
 
 # 定数の定義
 DATA_FOLDER = 'download_file'
-ENCODING = 'shift_jis'
 MARGIN = 0.06
 CASH = 100
 SIZE = 1
-
-def parse_timestamp(timestamp):
-    """
-    2つの異なるフォーマットのタイムスタンプを解析する
-    フォーマット1: YYYY/MM/DD HH:MM:SS
-    フォーマット2: YYYYMMDDHHMMSS
-    """
-    if not isinstance(timestamp, str):
-        timestamp = str(timestamp)
-        
-    timestamp = timestamp.strip()
-    
-    try:
-        if '/' in timestamp:
-            # フォーマット1: YYYY/MM/DD HH:MM:SS
-            return datetime.strptime(timestamp, '%Y/%m/%d %H:%M:%S')
-        else:
-            # フォーマット2: YYYYMMDDHHMMSS
-            return datetime.strptime(timestamp, '%Y%m%d%H%M%S')
-    except ValueError as e:
-        print(f"Error parsing timestamp: {timestamp}")
-        raise e
-
-def get_available_years(data_folder):
-    years = set()
-    for filename in os.listdir(data_folder):
-        if filename.endswith('.zip'):
-            year = filename.split('_')[1][:4]  # "EURJPY_202301.zip"から年を抽出
-            years.add(year)
-    return sorted(years)
-
-def get_available_currency_pairs(data_folder):
-    pairs = set()
-    for filename in os.listdir(data_folder):
-        if filename.endswith('.zip'):
-            pair = filename.split('_')[0]
-            pairs.add(pair)
-    return sorted(pairs)
+PRICE_DTYPE = 'float64'  # 'float32' にすると価格列のメモリ使用量が半分になる
+SCRIPT_VERSION = code_version(__file__)  # MyStrategy を変えたら結果のキャッシュを使わない
+FAST_ENGINE = True  # True ならバックテストと最適化を FixedTimeEngine で行う（backtesting.py と同じ結果）
+SPARSE_BARS = True  # FAST_ENGINE が False のとき、MyStrategy にはエントリーから決済までの足だけを渡す（結果は同じ）
+ASK_FILLS = False  # True なら FixedTimeEngine で新規の買いを ASK の始値で約定させる（SL/TP と決済は BID のまま。FAST_ENGINE が必要）
+# FixedTimeEngine に渡す売買条件（MyStrategy と同じ）
+ENGINE_RULES = dict(cash=CASH, margin=MARGIN, size=SIZE)
 
 def get_params_file(currency_pair):
     return f'all_params_{currency_pair}.json'
@@ -61,7 +37,7 @@ def load_params(currency_pair):
         return {
             "year_range": {"start_year": None, "end_year": None},
             "backtest": {"entry_time": "1600", "take_profit": "0.005", "stop_loss": "0.05", "close_time": "30"},
-            "optimize": {"entry_time": "range(1615,1645,5)", "take_profit": "[0.004, 0.005, 0.006]", "stop_loss": "[0.04, 0.05, 0.06]", "close_time": "[0, 30, 60]"},
+            "optimize": {"entry_time": "range(1615,1645,5)", "take_profit": "[0.004, 0.005, 0.006]", "stop_loss": "[0.04, 0.05, 0.06]", "close_time": "[0, 30, 60]", "method": "grid", "budget": "100"},
             "process_mode": "yearly"
         }
     
@@ -73,25 +49,16 @@ def save_params(params, currency_pair):
     with open(params_file, 'w') as file:
         json.dump(params, file, indent=4)
 
-def convert_to_ny_time(timestamp):
-    """
-    タイムスタンプを日本時間からニューヨーク時間に変換
-    """
-    if not isinstance(timestamp, datetime):
-        timestamp = parse_timestamp(timestamp)
-        
-    jst = pytz.timezone('Asia/Tokyo')
-    japan_time = jst.localize(timestamp)
-    ny_time = japan_time.astimezone(pytz.timezone('America/New_York'))
-    return ny_time.strftime('%Y-%m-%d %H:%M:%S')
-
 def get_user_input(years):
+    # tkinter は画面を使うときだけ読み込む（画面のないサーバーや cron では読み込まない）
+    from tkinter import Tk, Label, Button, StringVar, Entry, OptionMenu, Radiobutton
+
     root = Tk()
     root.title("Backtest or Optimize")
-    root.geometry("600x500")
+    root.geometry("600x560")
 
     # 通貨ペアの選択を追加
-    currency_pairs = get_available_currency_pairs(DATA_FOLDER)
+    currency_pairs = get_available_instruments(DATA_FOLDER)
     currency_pair_var = StringVar(value=currency_pairs[0] if currency_pairs else "EURJPY")
     
     Label(root, text="Currency Pair:").grid(row=0, column=0)
@@ -116,6 +83,7 @@ def get_user_input(years):
     Label(root, text="Process Mode:").grid(row=4, column=0)
     Radiobutton(root, text="Yearly", variable=process_mode_var, value="yearly").grid(row=4, column=1)
     Radiobutton(root, text="All Data", variable=process_mode_var, value="all_data").grid(row=4, column=2)
+    Radiobutton(root, text="Walk Forward", variable=process_mode_var, value="walk_forward").grid(row=4, column=3)
 
     Label(root, text="Backtest Entry Time (e.g., 1630):").grid(row=5, column=0)
     backtest_entry_time_entry = Entry(root)
@@ -157,6 +125,18 @@ def get_user_input(years):
     optimize_close_time_entry.insert(0, params["optimize"]["close_time"])
     optimize_close_time_entry.grid(row=12, column=1)
 
+    # グリッド以外の探索（random / bayesian / halving）は Budget 回のバックテストで打ち切る
+    optimize_method_var = StringVar(value=params["optimize"].get("method", "grid"))
+    Label(root, text="Optimize Method:").grid(row=13, column=0)
+    OptionMenu(root, optimize_method_var, *SEARCH_METHODS).grid(row=13, column=1)
+
+    Label(root, text="Optimize Budget (e.g., 100)").grid(row=14, column=0)
+    optimize_budget_entry = Entry(root)
+    optimize_budget_entry.insert(0, params["optimize"].get("budget", str(DEFAULT_BUDGET)))
+    optimize_budget_entry.grid(row=14, column=1)
+
+    selection = {}
+
     def submit():
         currency_pair = currency_pair_var.get()
         params = {
@@ -174,55 +154,37 @@ def get_user_input(years):
                 "entry_time": optimize_entry_time_entry.get(),
                 "take_profit": optimize_take_profit_entry.get(),
                 "stop_loss": optimize_stop_loss_entry.get(),
-                "close_time": optimize_close_time_entry.get()
+                "close_time": optimize_close_time_entry.get(),
+                "method": optimize_method_var.get(),
+                "budget": optimize_budget_entry.get()
             },
             "process_mode": process_mode_var.get()
         }
         save_params(params, currency_pair)
         
+        # main は画面を閉じてから呼び出し元で実行する（Tk のコールバックの中では実行しない）
+        selection.update(currency_pair=currency_pair, year_range=(int(params["year_range"]["start_year"]),
+                                     int(params["year_range"]["end_year"])),
+                         mode=mode_var.get(), backtest_params=params["backtest"],
+                         optimize_params=params["optimize"], process_mode=params["process_mode"])
         root.destroy()
-        main(currency_pair, 
-             (int(params["year_range"]["start_year"]), int(params["year_range"]["end_year"])), 
-             mode_var.get(), params["backtest"], params["optimize"], params["process_mode"])
 
-    Button(root, text="Submit", command=submit).grid(row=13, column=0, columnspan=2, pady=5)
+    Button(root, text="Submit", command=submit).grid(row=15, column=0, columnspan=2, pady=5)
     root.mainloop()
+    return selection
 
 def load_data(currency_pair, start_year, end_year, data_folder=DATA_FOLDER):
-    all_data = []
-
-    for year in range(start_year, end_year + 1):
-        year_str = str(year)
-        zip_files = [f for f in os.listdir(data_folder) if f.startswith(currency_pair) and f.endswith('.zip') and year_str in f]
-
-        for zip_file in zip_files:
-            with zipfile.ZipFile(os.path.join(data_folder, zip_file)) as z:
-                for csv_file in z.namelist():
-                    if not csv_file.endswith('.csv'):
-                        continue
-                    parts = csv_file.split('/')
-                    if len(parts) > 1 and parts[0].endswith('_EX') == False:  # "EURJPY_202301.zip/202301/EURJPY_20230102.csv" の場合確認
-                        with z.open(csv_file) as f:
-                            df = pd.read_csv(f, usecols=[0,1,2,3,4],encoding=ENCODING)
-                            df.columns = ["Datetime", "BID_Open", "BID_High", "BID_Low", "BID_Close"
-                                        #   ,"ASK_Open", "ASK_High", "ASK_Low", "ASK_Close"
-                                          ]
-                            # df['Datetime'] = pd.to_datetime(df['Datetime'], format='%Y/%m/%d %H:%M:%S')  # 新しいフォーマットで変換
-                            df['Datetime'] = df['Datetime'].apply(convert_to_ny_time)
-                            df['Datetime'] = pd.to_datetime(df['Datetime'])
-                           
-                            all_data.append(df)
-
-    all_data = pd.concat(all_data)
-    all_data.set_index('Datetime', inplace=True)
-    all_data = all_data.rename(columns={
-        'BID_Open': 'Open',
-        'BID_High': 'High',
-        'BID_Low': 'Low',
-        'BID_Close': 'Close'
-    })
-
-    return all_data
+    # 共通のデータ層（ClickData）のバイナリ保存形式からBIDのOHLCをNY時間で読み込む（ASK_FILLS なら ASK の始値も読む）
+    if ASK_FILLS and not FAST_ENGINE:
+        # MyStrategy（backtesting.py）は BID の始値で買うので、ASK の始値での約定は FixedTimeEngine でしかできない
+        raise ValueError("ASK_FILLS requires FAST_ENGINE: the backtesting.py paths always fill buys at the BID open")
+    columns = FILL_COLUMNS if ASK_FILLS else BID_COLUMNS
+    bars = load_store_bars(currency_pair, start_year, end_year, columns=columns, data_folder=data_folder,
+                           dtype=PRICE_DTYPE)
+    if ASK_FILLS:
+        # ASK は始値だけを読み、BID の始値との差（float32）の Spread 列にして持つ
+        return to_spread_frame(to_backtest_frame(bars))
+    return to_backtest_frame(bars)
 
 def process_data(currency_pair, data, mode, backtest_params, optimize_params, period):
     if not data.empty:
@@ -246,15 +208,24 @@ def process_data(currency_pair, data, mode, backtest_params, optimize_params, pe
 
         elif mode == "Optimize":
             print(f"--- Running Optimization for {currency_pair} {period} ---")
-            best_stats = optimize_strategy(
+            best_stats, results = optimize_strategy(
                 data,
                 optimize_params['entry_time'],
                 optimize_params['take_profit'],
                 optimize_params['stop_loss'],
-                optimize_params['close_time']
+                optimize_params['close_time'],
+                results_path=f'output/{currency_pair}_optimization_grid_{period}.csv',
+                method=optimize_params.get('method', 'grid'),
+                budget=optimize_params.get('budget')
             )
+            if best_stats is None:
+                return False  # エラーは optimize_strategy が表示済み
 
-            if len(best_stats) > 0:
+            if results is not None:
+                # 全組み合わせの結果を列指向のファイルで残す（GridOptimizer.py で別の指標で並べ直せる）
+                save_results(results, f'output/{currency_pair}_optimization_results_{period}.feather')
+
+            if best_stats is not None and len(best_stats) > 0:
                 with open(f'output/{currency_pair}_optimization_results_{period}.txt', 'w') as file:
                     print(f"Best result for {currency_pair} {period}:", file=file)
                     print(best_stats.to_string(), file=file)
@@ -262,6 +233,34 @@ def process_data(currency_pair, data, mode, backtest_params, optimize_params, pe
                     print(f'Optimize parameters :',file=file)
                     print(f'-----------------------------------------------------------------',file=file)
                     print(optimize_params,file=file)
+    return True
+
+def process_walk_forward(currency_pair, data, optimize_params, period):
+    if not data.empty:
+        print(f"--- Running Walk-forward Optimization for {currency_pair} {period} ---")
+        stats, folds = walk_forward_strategy(
+            data,
+            optimize_params['entry_time'],
+            optimize_params['take_profit'],
+            optimize_params['stop_loss'],
+            optimize_params['close_time'],
+            method=optimize_params.get('method', 'grid'),
+            budget=optimize_params.get('budget')
+        )
+
+        if stats is not None:
+            with open(f'output/{currency_pair}_walk_forward_results_{period}.txt', 'w') as file:
+                print(f"Walk-forward out-of-sample result for {currency_pair} {period}:", file=file)
+                print(stats.to_string(), file=file)
+                print(f'-----------------------------------------------------------------',file=file)
+                print(folds.to_string(index=False), file=file)
+
+            # 検証期間をつないだ取引・資産額と、区間ごとに選ばれたパラメータ
+            stats['_trades'].to_csv(f'output/{currency_pair}_walk_forward_trades_{period}.csv', index=False)
+            stats['_equity_curve'].to_csv(f'output/{currency_pair}_walk_forward_equity_{period}.csv')
+            folds.to_csv(f'output/{currency_pair}_walk_forward_folds_{period}.csv', index=False)
+        return stats is not None
+    return True
 
 class MyStrategy(Strategy):
     entry_time = 1630
@@ -270,71 +269,160 @@ class MyStrategy(Strategy):
     close_time = 30
 
     def init(self):
-        pass
+        # 足ごとに Timestamp を作って時・分・曜日を調べないように、判定に使う整数の配列を最初に作っておく
+        # （next では足の位置で引くだけ。Python のリストにしておくと1要素の参照が numpy の配列より速い）
+        index = self.data.index
+        hour, minute = index.hour.to_numpy(), index.minute.to_numpy()
+        self.minute_of_day = (hour * 60 + minute).tolist()
+        self.weekday = index.weekday.to_numpy().tolist()  # 0 = 月曜日, 4 = 金曜日
+        # entry_time の分が 60 以上なら、時 * 100 + 分 との比較と同じくどの足とも一致しない
+        entry_hour, entry_minute = divmod(self.entry_time, 100)
+        self.entry_minute = entry_hour * 60 + entry_minute if entry_minute < 60 else -1
+        # 決済時刻と同じ時で、分が決済時刻の前後3分未満の足
+        close_hour, close_minute = divmod(self.close_time, 100)
+        self.close_window = ((hour == close_hour) & (close_minute - 3 < minute) & (minute < close_minute + 3)).tolist()
 
     def next(self):
+        i = len(self.data) - 1
         # 金曜日（週末）には取引を行わない
-        if self.data.index[-1].weekday() == 4:  # 0 = 月曜日, 4 = 金曜日
+        if self.weekday[i] == 4:  # 0 = 月曜日, 4 = 金曜日
             return
                 
-        if len(self.data) > 0 and self.data.index[-1].hour * 100 + self.data.index[-1].minute == self.entry_time:
+        if self.minute_of_day[i] == self.entry_minute:
             entry_price = self.data.Close[-1]
             sl_price = entry_price - self.stop_loss
             tp_price = entry_price + self.take_profit
             
             if ( (sl_price < entry_price < tp_price) 
-                and self.data.index[-1].weekday() != 2 ):   # 0 = 月曜日, 4 = 金曜日
+                and self.weekday[i] != 2 ):   # 0 = 月曜日, 4 = 金曜日
                 self.buy(size=SIZE, sl=sl_price, tp=tp_price)
 
-        close_hour = self.close_time // 100
-        close_minute = self.close_time % 100
-        if self.data.index[-1].hour == close_hour:
-            if (close_minute - 3) < self.data.index[-1].minute < (close_minute + 3):
-                if self.orders:
-                    self.orders.cancel()
-                if self.position:
-                    self.position.close()
+        if self.close_window[i]:
+            # 未約定の新規・決済注文だけを取り消す（SL/TP は残す。新しい backtesting.py には orders.cancel() がない）
+            for order in self.orders:
+                if not order.is_contingent:
+                    order.cancel()
+            if self.position:
+                self.position.close()
 
-def optimize_strategy(data, entry_time_range, tp_values, sl_values, close_times):
-    bt = Backtest(data, MyStrategy, cash=CASH, margin=MARGIN, commission=0.000)
+def optimize_strategy(data, entry_time_range, tp_values, sl_values, close_times, results_path=None, method='grid',
+                      budget=None):
     try:
-        stats = bt.optimize(
+        param_grid = dict(
             entry_time=list(eval(entry_time_range)),
             take_profit=list(eval(tp_values)),
             stop_loss=list(eval(sl_values)),
-            close_time=list(eval(close_times)),
-            maximize='Win Rate [%]'
+            close_time=list(eval(close_times))
         )
-        return stats
+        if FAST_ENGINE:
+            # 組み合わせをプロセスに分けて評価し、終わったものから results_path に書き出す
+            # method が grid 以外なら budget 回のバックテストで探索する（SearchOptimizer.py）
+            stats, results, _ = search(data, param_grid, ENGINE_RULES, method=method, budget=budget,
+                                       maximize='Win Rate [%]', results_path=results_path)
+            return stats, results
+
+        bt = Backtest(data, MyStrategy, cash=CASH, margin=MARGIN, commission=0.000)
+        # backtesting.py の optimize では grid 以外は全組み合わせからのランダムサンプリングになる
+        max_tries = None if method == 'grid' else int(budget or DEFAULT_BUDGET)
+        stats, heatmap = bt.optimize(**param_grid, maximize='Win Rate [%]', max_tries=max_tries,
+                                     random_state=SEARCH_SEED, return_heatmap=True)
+        return stats, heatmap.reset_index()
     except Exception as e:
         print(f"Optimization error: {e}")
-        return None
+        return None, None
+
+def walk_forward_strategy(data, entry_time_range, tp_values, sl_values, close_times, method='grid', budget=None):
+    try:
+        param_grid = dict(
+            entry_time=list(eval(entry_time_range)),
+            take_profit=list(eval(tp_values)),
+            stop_loss=list(eval(sl_values)),
+            close_time=list(eval(close_times))
+        )
+        # 区間ごとの最適化と検証期間のバックテストは FixedTimeEngine で行う（区間はプロセスに分けて並列に処理する）
+        return walk_forward(data, param_grid, ENGINE_RULES, method=method, budget=budget, maximize='Win Rate [%]')
+    except Exception as e:
+        print(f"Walk-forward error: {e}")
+        return None, None
 
 def backtest_strategy(data, entry_time, take_profit, stop_loss, close_time):
-    MyStrategy.entry_time = int(entry_time)
-    MyStrategy.take_profit = float(take_profit)
-    MyStrategy.stop_loss = float(stop_loss)
-    MyStrategy.close_time = int(close_time)
+    # 同じデータの切り出し・パラメータ・売買条件・コードの版の結果は cache/results から読む
+    key = make_key('backtest', data_fingerprint(data), int(entry_time), float(take_profit), float(stop_loss),
+                   int(close_time), ENGINE_RULES, FAST_ENGINE, SCRIPT_VERSION, ENGINE_VERSION)
+    return RESULT_CACHE.cached(key, lambda: storable_stats(
+        run_backtest(data, entry_time, take_profit, stop_loss, close_time)))
+
+def backtest_strategies(data, entry_times, take_profits, stop_losses, close_times):
+    # パラメータの値の配列の直積をまとめて評価し、(entry_time, take_profit, stop_loss, close_time, 統計項目) の
+    # テンソルを返す（TensorBacktest.py。tensor_frame で1組1行の表にできる）
+    return backtest_tensor(data, entry_times, take_profits, stop_losses, close_times, ENGINE_RULES)
+
+def run_backtest(data, entry_time, take_profit, stop_loss, close_time):
+    if FAST_ENGINE:
+        # MyStrategy と同じ規則と約定を、判定が必要な足だけ numpy 配列上で調べて再現する
+        return run_fixed_time_backtest(data, int(entry_time), float(take_profit), float(stop_loss), int(close_time),
+                                       **ENGINE_RULES)
+    if SPARSE_BARS:
+        # 日ごとにエントリーの足から SL/TP か決済の時間帯までの足だけを backtesting.py で処理し、
+        # 統計は全部の足の資産額に戻してから計算する（SparseBacktest.py）
+        return run_sparse_backtest(data, MyStrategy, int(entry_time), float(take_profit), float(stop_loss),
+                                   int(close_time), **ENGINE_RULES)
 
     bt = Backtest(data, MyStrategy, cash=CASH, margin=MARGIN, commission=0.000)
-    stats = bt.run()
+    # パラメータは run() に渡す（MyStrategy のクラス属性を書き換えないので、同時に呼んでも互いに影響しない）
+    stats = bt.run(entry_time=int(entry_time), take_profit=float(take_profit), stop_loss=float(stop_loss),
+                   close_time=int(close_time))
     return stats
 
 def main(currency_pair, year_range, mode, backtest_params, optimize_params, process_mode):
     start_year, end_year = year_range
     data = load_data(currency_pair, start_year, end_year)
     print(data)
+    if data.empty:
+        print(f"No data for {currency_pair} {start_year}-{end_year}")
+        return False
 
     if not os.path.exists('output'):
         os.makedirs('output')
 
     if process_mode == "yearly":
-        for year in range(start_year, end_year + 1):
-            year_data = data[data.index.year == year]
-            process_data(currency_pair, year_data, mode, backtest_params, optimize_params, year)
+        # 年ごとのデータは並んだ index への二分探索で切り出し、年ごとにプロセスを分けて同時に処理する
+        failed = run_yearly(partial(process_data, currency_pair, mode=mode, backtest_params=backtest_params,
+                                    optimize_params=optimize_params), data, start_year, end_year)
+        return not failed
+    elif process_mode == "walk_forward":
+        # 学習期間と検証期間の長さは WalkForward.py の TRAIN_MONTHS / TEST_MONTHS
+        return process_walk_forward(currency_pair, data, optimize_params, f"{start_year}-{end_year}")
     else:  # all_data
-        process_data(currency_pair, data, mode, backtest_params, optimize_params, f"{start_year}-{end_year}")
+        return process_data(currency_pair, data, mode, backtest_params, optimize_params, f"{start_year}-{end_year}")
+
+def run_cli(argv):
+    """
+    引数がなければ（または --gui なら）Tk の画面で設定して実行する
+    引数があれば画面を使わずに all_params_{pair}.json（--params で別のファイル）の設定を引数で上書きして実行し、
+    終了コードを返す（cron や並列のジョブから呼べる）
+    """
+    parser = make_parser('Backtest or optimize MyStrategy on Click FX data', pair=True)
+    args = parser.parse_args(argv)
+    if not argv or args.gui:
+        available_years = [str(year) for year in get_available_years(DATA_FOLDER)]
+        selection = get_user_input(available_years)
+        return run_main(main, **selection) if selection else EXIT_OK
+
+    if not args.pair:
+        parser.error('--pair is required unless --gui is given')
+    years = get_available_years(DATA_FOLDER, args.pair)
+    if not years:
+        print(f"No data for {args.pair} in {DATA_FOLDER}")
+        return EXIT_FAILED
+    params = load_params_file(args.params) if args.params else load_params(args.pair)
+    params = apply_args(params, args, years)
+    if args.save:
+        save_params(params, args.pair)
+    return run_main(main, currency_pair=args.pair,
+                    year_range=(int(params["year_range"]["start_year"]), int(params["year_range"]["end_year"])),
+                    mode=params["mode"], backtest_params=params["backtest"], optimize_params=params["optimize"],
+                    process_mode=params["process_mode"])
 
 if __name__ == '__main__':
-    available_years = get_available_years(DATA_FOLDER)
-    get_user_input(available_years)
\ No newline at end of file
+    sys.exit(run_cli(sys.argv[1:]))
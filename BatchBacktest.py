@@ -0,0 +1,259 @@
+import os
+import re
+import sys
+import json
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from FixedTimeEngine import prepare_bars
+from GridOptimizer import share_bars, attach_bars, cached_backtest, DAY_PARAMS
+from SearchOptimizer import search, best_params, DEFAULT_BUDGET
+from YearlyRunner import year_slices
+from BacktestCLI import EXIT_OK, EXIT_FAILED
+import BacktestClickFX
+import BacktestClickFX_EURJPY
+import BacktestClickCFD_silver
+from ClickData import (load_store_bars, to_backtest_frame, to_spread_frame, get_available_instruments,
+                       get_available_years, BID_COLUMNS, FILL_COLUMNS, NY_TZ, JST_TZ, DATA_FOLDER)
+
+# 定数の定義
+BATCH_FILE = 'batch_params.json'
+PRICE_DTYPE = 'float64'  # 'float32' にすると価格列のメモリ使用量が半分になる
+WORKERS = os.cpu_count() or 1  # 同時に処理するタスク（銘柄 × パラメータセット × 期間）の数（1なら逐次）
+MAXIMIZE = 'Win Rate [%]'
+FX_PATTERN = re.compile(r'^[A-Z]{6}$')  # FX の通貨ペア（USDJPY など）
+# FX の通貨ペアの時刻と売買条件（BacktestClickFX.py の ENGINE_RULES をそのまま使う）
+FX_PROFILE = dict(tz=NY_TZ, rules=BacktestClickFX.ENGINE_RULES)
+# 専用のスクリプトがある銘柄（そのスクリプトの ENGINE_RULES をそのまま使う）。FX 以外（CFD）はここにある銘柄だけ処理する
+# 売買条件は batch_params.json の "rules" でも上書きできる
+INSTRUMENT_PROFILES = {
+    'EURJPY': dict(tz=NY_TZ, rules=BacktestClickFX_EURJPY.ENGINE_RULES),
+    BacktestClickCFD_silver.INSTRUMENT: dict(tz=JST_TZ, rules=BacktestClickCFD_silver.ENGINE_RULES),
+}
+
+# ワーカープロセス側の 銘柄 → 共有メモリから組み立てたDataFrame（使うときに初めて参照する）
+_worker = {}
+
+def get_default_batch():
+    return {
+        "year_range": {"start_year": None, "end_year": None},
+        "instruments": [],  # 空なら download_file にある全銘柄
+        "process_mode": "all_data",  # yearly なら年ごとに分けて処理する
+        "ask_fills": False,  # true なら新規の買いを ASK の始値で約定させる
+        "rules": {},
+        "parameter_sets": [
+            {"name": "backtest", "mode": "Backtest", "entry_time": "1600", "take_profit": "0.005",
+             "stop_loss": "0.05", "close_time": "30"},
+            {"name": "optimize", "mode": "Optimize", "entry_time": "range(1615,1645,5)",
+             "take_profit": "[0.004, 0.005, 0.006]", "stop_loss": "[0.04, 0.05, 0.06]", "close_time": "[0, 30, 60]",
+             "method": "grid", "budget": "100"}
+        ]
+    }
+
+def load_batch(path=BATCH_FILE):
+    if not os.path.exists(path):
+        return get_default_batch()
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def get_profile(instrument, overrides=None):
+    """
+    銘柄の (時刻のタイムゾーン, 売買条件) を返す。overrides は batch_params.json の "rules"（銘柄 → 売買条件）
+    INSTRUMENT_PROFILES にない CFD は時刻も売買条件も決められないので ValueError
+    """
+    if instrument in INSTRUMENT_PROFILES:
+        profile = INSTRUMENT_PROFILES[instrument]
+    elif FX_PATTERN.match(instrument):
+        profile = FX_PROFILE
+    else:
+        raise ValueError(f"No profile for CFD instrument {instrument}: add it to INSTRUMENT_PROFILES")
+    rules = dict(profile['rules'], **(overrides or {}).get(instrument, {}))
+    return profile['tz'], rules
+
+def load_instrument(instrument, start_year, end_year, data_folder=DATA_FOLDER, ask_fills=False):
+    tz, _ = get_profile(instrument)
+    columns = FILL_COLUMNS if ask_fills else BID_COLUMNS
+    bars = load_store_bars(instrument, start_year, end_year, columns=columns, tz=tz, data_folder=data_folder,
+                           dtype=PRICE_DTYPE)
+    if ask_fills:
+        return to_spread_frame(to_backtest_frame(bars))
+    return to_backtest_frame(bars)
+
+def parse_values(values):
+    # all_params の optimize と同じく "range(1615,1645,5)" や "[0.004, 0.005]" の文字列を評価する（リストならそのまま）
+    return list(values) if isinstance(values, list) else list(eval(values))
+
+def task_cost(task, rows):
+    """
+    タスクのおおよその重さ（足の数 × 評価する組み合わせの数）。重いタスクから先にワーカーへ渡す
+    """
+    _, start, stop, _, params, _ = task
+    count = 1
+    if params['mode'] == 'Optimize':
+        for name in DAY_PARAMS:
+            count *= len(parse_values(params[name]))
+        if params.get('method', 'grid') != 'grid':
+            count = min(count, int(params.get('budget') or DEFAULT_BUDGET))
+    return ((stop if stop is not None else rows) - (start or 0)) * count
+
+def run_task(data, task):
+    """
+    1つのタスク（銘柄・期間・パラメータセット）を処理し、統合する結果の表の1行を辞書で返す
+    Optimize なら最良の組み合わせのパラメータと stats、Backtest なら指定したパラメータの stats
+    """
+    instrument, start, stop, period, params, rules = task
+    data = data.iloc[start:stop]
+    if params['mode'] == 'Optimize':
+        maximize = params.get('maximize', MAXIMIZE)
+        param_grid = {name: parse_values(params[name]) for name in DAY_PARAMS}
+        stats, results, _ = search(data, param_grid, rules, method=params.get('method', 'grid'),
+                                   budget=params.get('budget'), maximize=maximize, workers=1)
+        chosen = dict(best_params(results, maximize, DAY_PARAMS), Evaluated=len(results))
+    else:
+        chosen = dict(entry_time=int(params['entry_time']), take_profit=float(params['take_profit']),
+                      stop_loss=float(params['stop_loss']), close_time=int(params['close_time']))
+        stats = cached_backtest(data, chosen, rules)
+    return dict(instrument=instrument, parameter_set=params['name'], mode=params['mode'], period=period, **chosen,
+                **{key: value for key, value in stats.items() if not key.startswith('_')})
+
+def error_row(task, error):
+    instrument, _, _, period, params, _ = task
+    return dict(instrument=instrument, parameter_set=params['name'], mode=params['mode'], period=period,
+                error=str(error))
+
+def timed_task(data, task):
+    """
+    run_task の (結果の行, 経過秒数) を返す。失敗したら error_row の行を返す
+    """
+    start = time.perf_counter()
+    try:
+        row = run_task(data, task)
+    except Exception as e:
+        row = error_row(task, e)
+    return row, time.perf_counter() - start
+
+def _init_worker(specs):
+    _worker.update(specs=specs, blocks={}, data={})
+
+def _run_task(task):
+    instrument = task[0]
+    if instrument not in _worker['data']:
+        blocks, _, data = attach_bars(_worker['specs'][instrument])
+        _worker['blocks'][instrument] = blocks
+        _worker['data'][instrument] = data
+    # タスクを並列に処理しているときは、最適化の進み具合は表示しない
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return timed_task(_worker['data'][instrument], task)
+
+def get_year_range(batch, data_folder=DATA_FOLDER):
+    """
+    batch_params.json の year_range（指定がなければ download_file にある最初と最後の年）
+    指定がなく download_file にzipもなければ None
+    """
+    year_range = batch.get('year_range') or {}
+    start_year, end_year = year_range.get('start_year'), year_range.get('end_year')
+    if not (start_year and end_year):
+        years = get_available_years(data_folder)
+        if not years:
+            return None
+        start_year, end_year = start_year or years[0], end_year or years[-1]
+    return int(start_year), int(end_year)
+
+def make_tasks(batch, datasets, start_year, end_year):
+    """
+    銘柄 × パラメータセット × 期間（all_data なら全期間、yearly なら年ごと）のタスクのリスト
+    パラメータセットに "instruments" があれば、その銘柄だけに使う
+    """
+    tasks = []
+    for instrument, data in datasets.items():
+        _, rules = get_profile(instrument, batch.get('rules'))
+        if batch.get('process_mode', 'all_data') == 'yearly':
+            periods = [(start, stop, str(year)) for year, start, stop in year_slices(data.index, start_year, end_year)
+                       if stop > start]
+        else:
+            periods = [(None, None, f'{start_year}-{end_year}')]
+        for params in batch['parameter_sets']:
+            if instrument not in params.get('instruments', [instrument]):
+                continue
+            tasks.extend((instrument, start, stop, period, params, rules) for start, stop, period in periods)
+    return tasks
+
+def run_batch(batch, start_year, end_year, data_folder=DATA_FOLDER, workers=None):
+    """
+    バッチの全タスクをワーカープロセスのプールで処理し、結果の表（1タスク1行、タスクの順）を返す
+    各銘柄のデータは親プロセスで1回だけ読み込み、共有メモリに置いて全ワーカーで使う
+    失敗したタスクは 'error' 列にメッセージを入れる
+    """
+    workers = WORKERS if workers is None else workers
+    instruments = batch.get('instruments') or get_available_instruments(data_folder)
+
+    datasets = {}
+    for instrument in instruments:
+        try:
+            get_profile(instrument)
+        except ValueError as e:
+            print(f"Batch: skipped {instrument}: {e}", flush=True)
+            continue
+        data = load_instrument(instrument, start_year, end_year, data_folder, batch.get('ask_fills', False))
+        print(f"Batch: loaded {instrument} ({len(data)} bars)", flush=True)
+        if not data.empty:
+            datasets[instrument] = data
+    tasks = make_tasks(batch, datasets, start_year, end_year)
+    rows = [None] * len(tasks)
+
+    def report(number, row, elapsed, done):
+        instrument, _, _, period, params, _ = tasks[number]
+        rows[number] = row
+        status = f"failed: {row['error']}" if 'error' in row else f"done in {elapsed:.1f}s"
+        print(f"Batch: {instrument} {params['name']} {period} {status} ({done}/{len(tasks)})", flush=True)
+
+    if workers <= 1 or len(tasks) <= 1:
+        for number, task in enumerate(tasks):
+            report(number, *timed_task(datasets[task[0]], task), number + 1)
+        return pd.DataFrame(rows)
+
+    blocks, specs = [], {}
+    try:
+        for instrument, data in datasets.items():
+            instrument_blocks, specs[instrument] = share_bars(prepare_bars(data))
+            blocks.extend(instrument_blocks)
+        costs = [task_cost(task, len(datasets[task[0]])) for task in tasks]
+        order = sorted(range(len(tasks)), key=lambda number: -costs[number])
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(specs,)) as executor:
+            futures = {executor.submit(_run_task, tasks[number]): number for number in order}
+            for done, future in enumerate(as_completed(futures), 1):
+                number = futures[future]
+                try:
+                    row, elapsed = future.result()
+                except Exception as e:  # ワーカープロセスが落ちたとき
+                    row, elapsed = error_row(tasks[number], e), 0.0
+                report(number, row, elapsed, done)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return pd.DataFrame(rows)
+
+def main(batch_file=BATCH_FILE):
+    """
+    バッチを実行して終了コードを返す（年の範囲が決められなければ EXIT_FAILED）
+    """
+    batch = load_batch(batch_file)
+    year_range = get_year_range(batch)
+    if year_range is None:
+        print(f"No data in {DATA_FOLDER}: add archives or set year_range in {batch_file}", file=sys.stderr)
+        return EXIT_FAILED
+    start_year, end_year = year_range
+    if not os.path.exists('output'):
+        os.makedirs('output')
+    start = time.perf_counter()
+    results = run_batch(batch, start_year, end_year)
+    path = f'output/batch_results_{start_year}-{end_year}.csv'
+    results.to_csv(path, index=False)
+    print(f"Batch: {len(results)} tasks in {time.perf_counter() - start:.1f}s -> {path}")
+    return EXIT_OK
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else BATCH_FILE))
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import pandas as pd
+from ClickData import read_archives
+
+# 定数の定義
+DATA_FOLDER = 'download_file'
+
+def list_zip_paths(data_folder, prefix):
+    return sorted(os.path.join(data_folder, f) for f in os.listdir(data_folder)
+                  if f.startswith(prefix) and f.endswith('.zip'))
+
+def time_read(zip_paths, workers, cache_folder):
+    start = time.perf_counter()
+    frames = read_archives(zip_paths, cache_folder=cache_folder, workers=workers)
+    return time.perf_counter() - start, pd.concat(frames, ignore_index=True)
+
+def benchmark_workers(zip_paths, max_workers):
+    """
+    キャッシュなしの状態からのzip読み込み時間をワーカー数 1, 2, 4, ... , max_workers で計測する
+    並列で読んだ結果が逐次で読んだ結果と完全に一致することも確認する
+    """
+    worker_counts = sorted({1, max_workers} | {2 ** i for i in range(1, max_workers.bit_length()) if 2 ** i < max_workers})
+    results = []
+    serial_df = None
+    serial_time = None
+    for workers in worker_counts:
+        cache_folder = tempfile.mkdtemp(prefix='click_bench_')
+        try:
+            elapsed, df = time_read(zip_paths, workers, cache_folder)
+            warm_elapsed, _ = time_read(zip_paths, workers, cache_folder)
+        finally:
+            shutil.rmtree(cache_folder, ignore_errors=True)
+
+        if serial_df is None:
+            serial_df, serial_time = df, elapsed
+        else:
+            pd.testing.assert_frame_equal(serial_df, df)
+        results.append({'workers': workers, 'cold [s]': elapsed, 'speedup': serial_time / elapsed,
+                        'warm [s]': warm_elapsed, 'rows': len(df)})
+    return pd.DataFrame(results)
+
+if __name__ == '__main__':
+    # 使い方: python BenchmarkClickData.py USDJPY [最大ワーカー数]
+    prefix = sys.argv[1] if len(sys.argv) > 1 else 'USDJPY'
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+
+    zip_paths = list_zip_paths(DATA_FOLDER, prefix)
+    print(f"{prefix}: {len(zip_paths)} archives")
+    print(benchmark_workers(zip_paths, max_workers).to_string(index=False))
@@ -0,0 +1,78 @@
+import sys
+import time
+import pandas as pd
+from backtesting import Backtest
+import BacktestClickFX
+from BacktestClickFX import MyStrategy, load_data, CASH, MARGIN, SIZE
+from FixedTimeEngine import run_fixed_time_backtest, prepare_bars
+from SparseBacktest import run_sparse_backtest, sparse_positions
+
+class LegacyStrategy(MyStrategy):
+    """
+    時刻の配列を作る前の MyStrategy（足ごとに self.data.index[-1] の Timestamp から時・分・曜日を調べる）
+    """
+    def init(self):
+        pass
+
+    def next(self):
+        if self.data.index[-1].weekday() == 4:
+            return
+
+        if len(self.data) > 0 and self.data.index[-1].hour * 100 + self.data.index[-1].minute == self.entry_time:
+            entry_price = self.data.Close[-1]
+            sl_price = entry_price - self.stop_loss
+            tp_price = entry_price + self.take_profit
+
+            if (sl_price < entry_price < tp_price) and self.data.index[-1].weekday() != 2:
+                self.buy(size=SIZE, sl=sl_price, tp=tp_price)
+
+        close_hour = self.close_time // 100
+        close_minute = self.close_time % 100
+        if self.data.index[-1].hour == close_hour:
+            if (close_minute - 3) < self.data.index[-1].minute < (close_minute + 3):
+                for order in self.orders:
+                    if not order.is_contingent:
+                        order.cancel()
+                if self.position:
+                    self.position.close()
+
+def time_run(data, strategy, params):
+    start = time.perf_counter()
+    stats = Backtest(data, strategy, cash=CASH, margin=MARGIN, commission=0.000).run(**params)
+    return time.perf_counter() - start, stats
+
+def benchmark_strategy(data, params):
+    """
+    同じデータとパラメータで LegacyStrategy（前）と MyStrategy（後）を Backtest.run() し、1秒あたりの足の数を比べる
+    取引が完全に一致することも確認する。MyStrategy をエントリーから決済までの足だけで実行したとき（SparseBacktest）と
+    参考に FixedTimeEngine の時間も計測する（bars/s はどれも元のデータの足の数で割る）
+    """
+    legacy_time, legacy_stats = time_run(data, LegacyStrategy, params)
+    new_time, new_stats = time_run(data, MyStrategy, params)
+    pd.testing.assert_frame_equal(legacy_stats['_trades'], new_stats['_trades'])
+
+    start = time.perf_counter()
+    sparse_stats = run_sparse_backtest(data, MyStrategy, **params, **BacktestClickFX.ENGINE_RULES)
+    sparse_time = time.perf_counter() - start
+    pd.testing.assert_frame_equal(new_stats['_trades'], sparse_stats['_trades'])
+    kept = len(sparse_positions(prepare_bars(data), **params))
+    print(f"sparse bars: {kept} of {len(data)} ({len(data) / max(kept, 1):.1f}x fewer)")
+
+    start = time.perf_counter()
+    run_fixed_time_backtest(data, **params, **BacktestClickFX.ENGINE_RULES)
+    engine_time = time.perf_counter() - start
+
+    rows = [('MyStrategy (per-bar Timestamp)', legacy_time), ('MyStrategy (init arrays)', new_time),
+            ('MyStrategy (sparse bars)', sparse_time), ('FixedTimeEngine', engine_time)]
+    return pd.DataFrame([{'run': name, 'time [s]': elapsed, 'bars/s': len(data) / elapsed,
+                          'speedup': legacy_time / elapsed} for name, elapsed in rows])
+
+if __name__ == '__main__':
+    # 使い方: python BenchmarkStrategy.py USDJPY 2023
+    currency_pair = sys.argv[1] if len(sys.argv) > 1 else 'USDJPY'
+    year = int(sys.argv[2]) if len(sys.argv) > 2 else 2023
+    params = dict(entry_time=1600, take_profit=0.005, stop_loss=0.05, close_time=30)
+
+    data = load_data(currency_pair, year, year)
+    print(f"{currency_pair} {year}: {len(data)} bars")
+    print(benchmark_strategy(data, params).to_string(index=False))
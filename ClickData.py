@@ -0,0 +1,707 @@
+import os
+import re
+import zipfile
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow がない環境ではキャッシュを使わずに毎回zipを読み、CSVは pandas で解析する
+    pa = None
+    pa_csv = None
+    feather = None
+
+# 定数の定義
+DATA_FOLDER = 'download_file'
+ENCODING = 'shift_jis'
+CACHE_FOLDER = 'cache'
+STORE_FOLDER = 'bar_store'
+CACHE_VERSION = 3  # キャッシュの形式や読み込むCSVを変えたら上げる（古いキャッシュ・マニフェスト・保存データは作り直される）
+WORKERS = os.cpu_count() or 1  # zipの並列読み込みに使うプロセス数（1なら逐次）
+JST_TZ = 'Asia/Tokyo'
+NY_TZ = 'America/New_York'
+PRICE_COLUMNS = ['bid_open', 'bid_high', 'bid_low', 'bid_close',
+                 'ask_open', 'ask_high', 'ask_low', 'ask_close']
+BID_COLUMNS = PRICE_COLUMNS[:4]
+FILL_COLUMNS = BID_COLUMNS + ['ask_open']  # 新規の買いを ASK で約定させるときに読み込む列
+SPREAD_COLUMN = 'Spread'  # ASK の始値 - BID の始値（to_spread_frame で作る列）
+SPREAD_DTYPE = 'float32'  # スプレッドは小さい値なので単精度でも誤差は 1e-9 程度
+# backtesting.py 用の列名（BIDをOHLCとして使い、ASKは元の列名で残す）
+BACKTEST_COLUMNS = {'bid_open': 'Open', 'bid_high': 'High', 'bid_low': 'Low', 'bid_close': 'Close',
+                    'ask_open': 'ASK_Open', 'ask_high': 'ASK_High', 'ask_low': 'ASK_Low', 'ask_close': 'ASK_Close'}
+# "EURJPY_202301.zip", "SPOT_SILVER_202301.zip" から銘柄名と年月を取り出す
+ARCHIVE_PATTERN = re.compile(r'^(?P<instrument>.+)_(?P<year>\d{4})(?P<month>\d{2})\d*\.zip$')
+# "202301/EURJPY_20230102.csv" から日付（日本時間）を取り出す
+MEMBER_PATTERN = re.compile(r'_(?P<date>\d{8})\.csv$')
+# "_EX" フォルダ内のCSVも価格データとして読む銘柄（元のシルバーの分析・バックテストは zip 内の全CSVを読んでいた）
+EX_MEMBER_INSTRUMENTS = {'SPOT_SILVER'}
+# 日次CSVは翌朝（日本時間7時 = NYの17時、FXの取引日の区切り）までの行を含むことがあるので、その分だけ範囲を広げる
+DAY_END_SPILL = pd.Timedelta(hours=7)
+
+def parse_timestamps(timestamps):
+    """
+    クリック証券のタイムスタンプ列をまとめて解析する（日本時間、タイムゾーンなし）
+    フォーマット1: YYYY/MM/DD HH:MM:SS (FX)
+    フォーマット2: YYYYMMDDHHMMSS (FX)
+    フォーマット3: YYYYMMDDHHMM (CFD)
+    """
+    timestamps = pd.Series(timestamps).astype(str).str.strip()
+    is_slash = timestamps.str.contains('/', regex=False)
+    is_minute = ~is_slash & (timestamps.str.len() == 12)
+    is_second = ~is_slash & ~is_minute
+
+    parsed = pd.Series(pd.NaT, index=timestamps.index, dtype='datetime64[ns]')
+    for mask, fmt in [(is_slash, '%Y/%m/%d %H:%M:%S'), (is_second, '%Y%m%d%H%M%S'), (is_minute, '%Y%m%d%H%M')]:
+        if mask.any():
+            parsed[mask] = pd.to_datetime(timestamps[mask], format=fmt)
+    return parsed
+
+def is_data_member(member_name, instrument=None):
+    """
+    zip内のファイルが価格データのCSVかどうか（"_EX" フォルダ内のファイルは除外。EX_MEMBER_INSTRUMENTS の銘柄は含める）
+    """
+    if not member_name.endswith('.csv'):
+        return False
+    if instrument in EX_MEMBER_INSTRUMENTS:
+        return True
+    parts = member_name.split('/')
+    return not (len(parts) > 1 and parts[0].endswith('_EX'))
+
+def read_member_csv(f, columns=None, dtype='float64'):
+    """
+    zip内の1日分のCSVから datetime（文字列）と columns の価格列だけを dtype で読み込む
+    pyarrow があれば高速な pyarrow のCSVパーサーを使い、なければ pandas で読む
+    """
+    columns = PRICE_COLUMNS if columns is None else list(columns)
+    names = ['datetime'] + PRICE_COLUMNS
+    usecols = ['datetime'] + columns
+    if pa_csv is not None:
+        price_type = pa.from_numpy_dtype(np.dtype(dtype))
+        table = pa_csv.read_csv(
+            f,
+            read_options=pa_csv.ReadOptions(encoding=ENCODING, skip_rows=1, column_names=names),
+            convert_options=pa_csv.ConvertOptions(include_columns=usecols,
+                                                  column_types={'datetime': pa.string(),
+                                                                **{col: price_type for col in columns}}))
+        return table.to_pandas()[usecols]
+    df = pd.read_csv(f, names=names, encoding=ENCODING, skiprows=1, usecols=usecols,
+                     dtype={'datetime': str, **{col: dtype for col in columns}})
+    return df[usecols]
+
+def get_local_span(start_jst, end_jst, tz=NY_TZ):
+    """
+    日本時間の期間 [start_jst, end_jst) のファイルに含まれうる行の範囲を tz の時刻で返す
+    """
+    bounds = pd.Series([start_jst, end_jst + DAY_END_SPILL]).dt.tz_localize(JST_TZ).dt.tz_convert(tz).dt.tz_localize(None)
+    return bounds[0], bounds[1]
+
+def archive_in_range(year, month, time_range):
+    """
+    年月のzip（日本時間の1か月分）が time_range = (開始, 終了, tz) の行を含みうるか
+    NY時間に直すと年をまたぐ月（例: 日本時間の1月1日朝 = NYの12月31日）も含める
+    """
+    start, end, tz = time_range
+    month_start = pd.Timestamp(year=year, month=month, day=1)
+    span_start, span_end = get_local_span(month_start, month_start + pd.offsets.MonthBegin(1), tz)
+    return span_start < end and start < span_end
+
+def member_in_range(member_name, time_range):
+    """
+    zip内の日次CSV（ファイル名の日付）が time_range の行を含みうるか。日付がない名前は常に True
+    """
+    match = MEMBER_PATTERN.search(member_name)
+    if match is None:
+        return True
+    start, end, tz = time_range
+    day = pd.Timestamp(match.group('date'))
+    span_start, span_end = get_local_span(day, day + pd.Timedelta(days=1), tz)
+    return span_start < end and start < span_end
+
+def decode_archive(zip_path, columns=None, dtype='float64', errors=None, time_range=None):
+    """
+    月次zipの全CSVを読み込み、datetime列をNY時間（タイムゾーン付き）に変換した1つのDataFrameを返す
+    columns を指定するとその価格列だけを dtype で解析する（省略時はBID/ASKの全8列）
+    time_range = (開始, 終了, tz) を指定すると、ファイル名の日付が範囲外のCSVは開かない
+    errors にリストを渡すと、読み込めなかったCSVはスキップしてエラー内容を追加する
+    """
+    columns = PRICE_COLUMNS if columns is None else list(columns)
+    parsed = parse_archive_name(os.path.basename(zip_path))
+    instrument = parsed[0] if parsed is not None else None
+    frames = []
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        for csv_file in z.namelist():
+            if not is_data_member(csv_file, instrument):
+                continue
+            if time_range is not None and not member_in_range(csv_file, time_range):
+                continue
+            try:
+                with z.open(csv_file) as f:
+                    df = read_member_csv(f, columns, dtype)
+                df['datetime'] = parse_timestamps(df['datetime']).dt.tz_localize(JST_TZ).dt.tz_convert(NY_TZ)
+                frames.append(df)
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors.append(f"{csv_file}: {str(e)}")
+
+    if not frames:
+        return pd.DataFrame({'datetime': pd.Series(dtype=f'datetime64[ns, {NY_TZ}]'),
+                             **{col: pd.Series(dtype=dtype) for col in columns}})
+    return pd.concat(frames, ignore_index=True)
+
+def get_cache_path(zip_path, cache_folder=CACHE_FOLDER):
+    """
+    zipファイルに対応するキャッシュファイルのパス（同名zipが別フォルダにあっても衝突しないようにパスのハッシュを付ける）
+    """
+    zip_path = os.path.abspath(zip_path)
+    stem = os.path.splitext(os.path.basename(zip_path))[0]
+    path_hash = hashlib.sha1(zip_path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_folder, f"{stem}_{path_hash}.feather")
+
+def get_cache_key(zip_path):
+    """
+    キャッシュの有効性を判定するキー（zipのパス・サイズ・更新時刻）。zipが再ダウンロードされるとキーが変わる
+    """
+    stat = os.stat(zip_path)
+    return f"v{CACHE_VERSION}|{os.path.abspath(zip_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+def read_cache(cache_path, cache_key, columns=None, dtype='float64'):
+    """
+    キーが一致するキャッシュをメモリマップで読み込む。存在しないか古い場合は None
+    columns を指定すると、その価格列だけをファイルから読む（列指向なので他の列には触れない）
+    """
+    if feather is None or not os.path.exists(cache_path):
+        return None
+    columns = PRICE_COLUMNS if columns is None else list(columns)
+    try:
+        table = feather.read_table(cache_path, columns=['datetime'] + columns, memory_map=True)
+    except Exception:
+        return None
+    metadata = table.schema.metadata or {}
+    if metadata.get(b'click_cache_key') != cache_key.encode('utf-8'):
+        return None
+    return project_columns(table.to_pandas(), columns, dtype)
+
+def project_columns(df, columns, dtype='float64'):
+    """
+    datetime と columns の価格列だけを残し、価格列を dtype に揃える
+    """
+    df = df[['datetime'] + list(columns)]
+    if any(df[col].dtype != dtype for col in columns):
+        df = df.astype({col: dtype for col in columns})
+    return df
+
+def write_cache(df, cache_path, cache_key):
+    """
+    DataFrameを列指向のFeatherファイルとして保存する（途中で中断しても壊れないよう一時ファイル経由）
+    """
+    if feather is None:
+        return
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # 行数と最初・最後の時刻もメタデータに残しておき、マニフェストはzipを読まずにここから集計する
+    stats = {'rows': len(df),
+             'min_datetime': df['datetime'].min().isoformat() if len(df) else None,
+             'max_datetime': df['datetime'].max().isoformat() if len(df) else None}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b'click_cache_key': cache_key.encode('utf-8'),
+                                           b'click_stats': json.dumps(stats).encode('utf-8')})
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    feather.write_feather(table, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+def read_cache_stats(cache_path, cache_key):
+    """
+    キャッシュのメタデータから行数・最初と最後の時刻（NY時間）を返す。キャッシュがないか古い場合は None
+    """
+    if pa is None or not os.path.exists(cache_path):
+        return None
+    try:
+        with pa.memory_map(cache_path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except Exception:
+        return None
+    if metadata.get(b'click_cache_key') != cache_key.encode('utf-8') or b'click_stats' not in metadata:
+        return None
+    return json.loads(metadata[b'click_stats'])
+
+def to_local_time(df, tz=NY_TZ):
+    """
+    タイムゾーン付きのdatetime列を tz の時刻（タイムゾーンなし）に変換する
+    """
+    df['datetime'] = df['datetime'].dt.tz_convert(tz).dt.tz_localize(None)
+    return df
+
+def load_archive(zip_path, cache_folder=CACHE_FOLDER, errors=None, columns=None, dtype='float64', time_range=None):
+    """
+    月次zipを読み込む。キャッシュが有効ならzipを開かずにキャッシュから読み、無効なら作り直す
+    キャッシュは全列（float64）で作り、返すのは columns の列だけ（dtype）。datetime列はNY時間（タイムゾーン付き）
+    """
+    columns = PRICE_COLUMNS if columns is None else list(columns)
+    if feather is None:
+        # キャッシュを使えない場合は必要な列と、time_range にかかる日のCSVだけを解析する
+        archive_errors = []
+        df = decode_archive(zip_path, columns, dtype, errors=archive_errors, time_range=time_range)
+        if archive_errors:
+            if errors is None:
+                raise ValueError("\n".join(archive_errors))
+            errors.extend(archive_errors)
+        return df
+
+    cache_path = get_cache_path(zip_path, cache_folder)
+    cache_key = get_cache_key(zip_path)
+
+    df = read_cache(cache_path, cache_key, columns, dtype)
+    if df is None:
+        archive_errors = []
+        df = decode_archive(zip_path, errors=archive_errors)
+        if archive_errors:
+            # 一部のCSVが読めなかった月はキャッシュしない（次回また読み直す）
+            if errors is None:
+                raise ValueError("\n".join(archive_errors))
+            errors.extend(archive_errors)
+        else:
+            write_cache(df, cache_path, cache_key)
+        df = project_columns(df, columns, dtype)
+    return df
+
+def read_archive(zip_path, tz=NY_TZ, cache_folder=CACHE_FOLDER, errors=None, columns=None, dtype='float64'):
+    """
+    月次zipを読み込み、datetime列を tz で指定したタイムゾーンの時刻（タイムゾーンなし）で返す
+    """
+    return to_local_time(load_archive(zip_path, cache_folder, errors, columns, dtype), tz)
+
+def _decode_archive_task(zip_path, cache_folder, columns, dtype, time_range):
+    """
+    ワーカープロセス用: zipを読み込んでキャッシュを書き、(DataFrame, エラー一覧) を返す
+    """
+    errors = []
+    try:
+        df = load_archive(zip_path, cache_folder, errors, columns, dtype, time_range)
+    except Exception as e:
+        return None, [f"{os.path.basename(zip_path)}: {str(e)}"]
+    return df, errors
+
+def read_archives(zip_paths, tz=NY_TZ, cache_folder=CACHE_FOLDER, workers=None, errors=None,
+                  columns=None, dtype='float64', time_range=None):
+    """
+    複数の月次zipを読み込み、zip_pathsと同じ順番でDataFrameのリストを返す
+    キャッシュが有効な月はこのプロセスで読み、作り直しが必要な月だけをプロセスプールで並列に読む
+    errors にリストを渡すと、読めなかったzipは None を返してエラー内容を追加する
+    """
+    workers = WORKERS if workers is None else workers
+    results = [None] * len(zip_paths)
+    pending = []
+    for i, zip_path in enumerate(zip_paths):
+        df = read_cache(get_cache_path(zip_path, cache_folder), get_cache_key(zip_path), columns, dtype)
+        if df is not None:
+            results[i] = to_local_time(df, tz)
+        else:
+            pending.append(i)
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {i: executor.submit(_decode_archive_task, zip_paths[i], cache_folder, columns, dtype, time_range) for i in pending}
+            decoded = {i: future.result() for i, future in futures.items()}
+    else:
+        decoded = {i: _decode_archive_task(zip_paths[i], cache_folder, columns, dtype, time_range) for i in pending}
+
+    for i, (df, archive_errors) in decoded.items():
+        if archive_errors:
+            if errors is None:
+                raise ValueError("\n".join(archive_errors))
+            errors.extend(archive_errors)
+        if df is not None:
+            results[i] = to_local_time(df, tz)
+    return results
+
+def parse_archive_name(file_name):
+    """
+    zipファイル名から (銘柄名, 年, 月) を返す。クリック証券の月次zipでなければ None
+    """
+    match = ARCHIVE_PATTERN.match(file_name)
+    if match is None:
+        return None
+    return match.group('instrument'), int(match.group('year')), int(match.group('month'))
+
+def get_manifest_path(data_folder=DATA_FOLDER):
+    """
+    マニフェストはダウンロードフォルダの隣に置く（例: download_file → download_file_manifest.json）
+    """
+    return os.path.normpath(data_folder) + '_manifest.json'
+
+def load_manifest(data_folder=DATA_FOLDER):
+    manifest_path = get_manifest_path(data_folder)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r') as file:
+                return json.load(file)
+        except ValueError:
+            pass  # 壊れたマニフェストは作り直す
+    return {'instruments': {}}
+
+def save_manifest(manifest, data_folder=DATA_FOLDER):
+    manifest_path = get_manifest_path(data_folder)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def make_manifest_entry(path, stat):
+    """
+    1つの月次zipのマニフェスト項目（パス・サイズ・更新時刻・内容のハッシュ・CSV一覧）を作る
+    行数と最初・最後の時刻はキャッシュができたときに fill_manifest_stats で埋める
+    """
+    instrument, year, month = parse_archive_name(os.path.basename(path))
+    with zipfile.ZipFile(path, 'r') as z:
+        members = [name for name in z.namelist() if is_data_member(name, instrument)]
+    return {'path': path, 'year': year, 'month': month, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha1': hash_file(path), 'members': members,
+            'rows': None, 'min_datetime': None, 'max_datetime': None}
+
+def fill_manifest_stats(manifest, cache_folder=CACHE_FOLDER):
+    """
+    行数・最初と最後の時刻が未記入の項目を、有効なキャッシュのメタデータから埋める。埋めた項目があれば True
+    """
+    changed = False
+    for entries in manifest['instruments'].values():
+        for entry in entries.values():
+            if entry['rows'] is not None or not os.path.exists(entry['path']):
+                continue
+            stats = read_cache_stats(get_cache_path(entry['path'], cache_folder), get_cache_key(entry['path']))
+            if stats is not None:
+                entry.update(stats)
+                changed = True
+    return changed
+
+def refresh_manifest(data_folder=DATA_FOLDER, cache_folder=CACHE_FOLDER):
+    """
+    ダウンロードフォルダのマニフェストを返す
+    毎回ディレクトリを走査し（zipの数だけ stat するだけなので軽い）、新しいzipやサイズ・更新時刻が変わったzip
+    （再ダウンロード・上書き）の項目だけを作り直す。同じ名前のzipを上書きしてもフォルダの更新時刻は変わらないので、
+    フォルダの更新時刻では判定しない
+    """
+    old_manifest = load_manifest(data_folder)
+    # 読み込むCSVの判定が変わった（CACHE_VERSION が違う）マニフェストの項目は作り直す
+    old_entries = {file_name: entry for entries in old_manifest['instruments'].values()
+                   for file_name, entry in entries.items()} if old_manifest.get('version') == CACHE_VERSION else {}
+    instruments = {}
+    with os.scandir(data_folder) as it:
+        for dir_entry in it:
+            parsed = parse_archive_name(dir_entry.name)
+            if parsed is None or not dir_entry.is_file():
+                continue
+            stat = dir_entry.stat()
+            entry = old_entries.get(dir_entry.name)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                entry = make_manifest_entry(os.path.join(data_folder, dir_entry.name), stat)
+            instruments.setdefault(parsed[0], {})[dir_entry.name] = entry
+
+    manifest = {'version': CACHE_VERSION, 'instruments': {name: dict(sorted(entries.items())) for name, entries in sorted(instruments.items())}}
+    fill_manifest_stats(manifest, cache_folder)
+    if manifest != old_manifest:
+        save_manifest(manifest, data_folder)
+    return manifest
+
+def list_archives(instrument, data_folder=DATA_FOLDER):
+    """
+    銘柄の月次zipを (年, 月, パス) のリストで年月順に返す（マニフェストから引く）
+    """
+    entries = refresh_manifest(data_folder)['instruments'].get(instrument, {})
+    return sorted((entry['year'], entry['month'], entry['path']) for entry in entries.values())
+
+def get_available_instruments(data_folder=DATA_FOLDER):
+    return sorted(refresh_manifest(data_folder)['instruments'])
+
+def get_available_years(data_folder=DATA_FOLDER, instrument=None):
+    """
+    マニフェストから利用可能な年を返す（instrument を省略すると全銘柄）
+    """
+    instruments = refresh_manifest(data_folder)['instruments']
+    if instrument is not None:
+        instruments = {instrument: instruments.get(instrument, {})}
+    return sorted({entry['year'] for entries in instruments.values() for entry in entries.values()})
+
+def get_time_range(start, end):
+    """
+    load_bars の期間指定を [開始, 終了) のTimestampに変換する
+    int は年として扱い（終了年は年末まで含む）、それ以外は pd.Timestamp に渡して終了時刻を含む
+    """
+    if isinstance(start, int):
+        start = pd.Timestamp(year=start, month=1, day=1)
+    else:
+        start = pd.Timestamp(start)
+    if isinstance(end, int):
+        end = pd.Timestamp(year=end + 1, month=1, day=1)
+    else:
+        end = pd.Timestamp(end) + pd.Timedelta(1, 'ns')
+    return start, end
+
+def load_bars(instrument, start, end, columns=None, tz=NY_TZ, data_folder=DATA_FOLDER,
+              cache_folder=CACHE_FOLDER, workers=None, errors=None, dtype='float64'):
+    """
+    銘柄の1分足を期間 start〜end（tz の時刻）で読み込む
+    FX（"EURJPY_202301.zip"）とCFD（"SPOT_SILVER_202301.zip"）のどちらの命名にも対応する
+    columns で価格列（PRICE_COLUMNS の一部）を絞り込むと、その列だけを読み込む。dtype='float32' で価格列を
+    単精度にできる。戻り値は時刻順で、重複時刻（夏時間終了時など）は最初の行を残す。インデックスは 'datetime'
+    （タイムゾーンなし）
+
+    計測例（合成1分足 USDJPY 2年分・約90万行、読み込みによるピークRSSの増分 / 結果のDataFrameのサイズ）:
+      全8列 float64、pandasで解析（従来の読み込み方）: +181MB / 65MB、6.8秒
+      BID 4列 float32、pyarrowで解析（キャッシュなし）:  +114MB / 22MB、4.6秒
+      BID 4列 float64、キャッシュから読み込み:          +123MB / 36MB、0.23秒
+      BID 4列 float32、キャッシュから読み込み:          +96MB / 22MB、0.28秒
+    """
+    columns = PRICE_COLUMNS if columns is None else list(columns)
+    start, end = get_time_range(start, end)
+
+    # ファイル名の年月だけで範囲外のzipを除外する（範囲の前後で年をまたぐ月は含める）
+    time_range = (start, end, tz)
+    zip_paths = [path for year, month, path in list_archives(instrument, data_folder)
+                 if archive_in_range(year, month, time_range)]
+
+    frames = []
+    for df in read_archives(zip_paths, tz=tz, cache_folder=cache_folder, workers=workers, errors=errors,
+                            columns=columns, dtype=dtype, time_range=time_range):
+        if df is None:
+            continue
+        df = df[(df['datetime'] >= start) & (df['datetime'] < end)]
+        frames.append(df)
+
+    # 今回キャッシュができた月の行数・時刻範囲をマニフェストに記録する
+    manifest = load_manifest(data_folder)
+    if fill_manifest_stats(manifest, cache_folder):
+        save_manifest(manifest, data_folder)
+
+    if not frames:
+        return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name='datetime'), dtype=dtype)
+    bars = pd.concat(frames, ignore_index=True)
+    bars = bars.sort_values(by='datetime', kind='stable').drop_duplicates(subset='datetime', keep='first')
+    return bars.set_index('datetime')
+
+def to_backtest_frame(bars):
+    """
+    load_bars の結果を backtesting.py 用の列名（Open/High/Low/Close、インデックスは Datetime）に変換する
+    """
+    bars = bars.rename(columns=BACKTEST_COLUMNS)
+    bars.index.name = 'Datetime'
+    return bars
+
+def to_spread_frame(frame):
+    """
+    to_backtest_frame の結果（FILL_COLUMNS を読み込んだもの）の ASK_Open を、BID の始値との差（SPREAD_DTYPE）の
+    SPREAD_COLUMN 列に置き換える。ASK の価格をそのまま持つより小さく、FixedTimeEngine は BID の始値 + この列で買う
+    """
+    spread = frame['ASK_Open'].to_numpy(dtype=np.float64) - frame['Open'].to_numpy(dtype=np.float64)
+    return frame.drop(columns='ASK_Open').assign(**{SPREAD_COLUMN: spread.astype(SPREAD_DTYPE)})
+
+class BarStore:
+    """
+    銘柄ごとの追記専用バイナリ保存形式（numpy memmap）
+    時刻は tz の時刻（タイムゾーンなし、NY時間なら「NYの壁時計」）のエポックns を int64 で、価格列は float64 で
+    列ごとに1ファイルに保存する。期間での切り出しは二分探索で行い、memmap のビュー（コピーなし）を返す
+    行数は meta.json が正で、追記の途中で止まってファイルの末尾に余分な行が残っても次の追記で切り詰める
+    """
+
+    def __init__(self, instrument, tz=NY_TZ, store_folder=STORE_FOLDER):
+        self.instrument = instrument
+        self.tz = tz
+        self.folder = os.path.join(store_folder, f"{instrument}@{tz.replace('/', '_')}")
+        self.meta_path = os.path.join(self.folder, 'meta.json')
+        self._arrays = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as file:
+                self.meta = json.load(file)
+        else:
+            self.meta = {'instrument': instrument, 'tz': tz, 'columns': PRICE_COLUMNS, 'rows': 0, 'data_folder': None}
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    def _column_path(self, column):
+        return os.path.join(self.folder, f"{column}.bin")
+
+    def _save_meta(self):
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.meta, file, indent=1)
+        os.replace(tmp_path, self.meta_path)
+
+    def arrays(self):
+        """
+        列名 → memmap（読み取り専用）の辞書。'datetime' は int64 のエポックns
+        """
+        if self._arrays is None:
+            self._arrays = {}
+            for column, dtype in [('datetime', np.int64)] + [(col, np.float64) for col in self.meta['columns']]:
+                if self.rows == 0:
+                    self._arrays[column] = np.empty(0, dtype=dtype)
+                else:
+                    self._arrays[column] = np.memmap(self._column_path(column), dtype=dtype, mode='r',
+                                                     shape=(self.rows,))
+        return self._arrays
+
+    def last_datetime(self):
+        """
+        保存済みの最後の時刻（なければ None）
+        """
+        if self.rows == 0:
+            return None
+        return pd.Timestamp(int(self.arrays()['datetime'][-1]))
+
+    def _write_from(self, position, bars):
+        """
+        position 行目以降を bars（load_bars 形式）の行で置き換える。書いた行数を返す
+        """
+        self._arrays = None  # 書き込む前に memmap を手放す
+        os.makedirs(self.folder, exist_ok=True)
+        times = bars.index.values.astype('datetime64[ns]').view(np.int64)
+        columns = [('datetime', times)] + [(col, bars[col].to_numpy(dtype=np.float64)) for col in self.meta['columns']]
+        for column, values in columns:
+            with open(self._column_path(column), 'ab') as file:
+                file.truncate(position * values.itemsize)  # 前回の中断で残った余分な行も捨てる
+                file.write(np.ascontiguousarray(values).tobytes())
+        self.meta['rows'] = position + len(bars)
+        self._save_meta()
+        return len(bars)
+
+    def append(self, bars):
+        """
+        load_bars 形式（'datetime' インデックス、時刻順）の行のうち、保存済みの最後の時刻より新しい行だけを追記する
+        追記した行数を返す
+        """
+        if self.rows > 0:
+            times = bars.index.values.astype('datetime64[ns]').view(np.int64)
+            bars = bars[times > self.arrays()['datetime'][-1]]
+        if len(bars) == 0:
+            return 0
+        return self._write_from(self.rows, bars)
+
+    def replace(self, start, end, bars):
+        """
+        時刻 [start, end) の保存済みの行を bars で置き換える。書いた行数を返す
+        end より後の行は一度メモリに読み出して書き直すので、末尾に近い範囲ほど速い
+        書き直しの途中で止まった場合に備えて、終わるまでは meta.json に dirty を立てておく
+        """
+        arrays = self.arrays()
+        i = int(np.searchsorted(arrays['datetime'], start.value, side='left'))
+        j = int(np.searchsorted(arrays['datetime'], end.value, side='left'))
+        if j < self.rows:
+            index = pd.DatetimeIndex(arrays['datetime'][j:].view('datetime64[ns]'), name='datetime')
+            tail = pd.DataFrame({col: np.array(arrays[col][j:]) for col in self.meta['columns']}, index=index)
+            bars = pd.concat([bars, tail])
+        if i < self.rows:
+            self.meta['dirty'] = True
+            self._save_meta()
+        self.meta.pop('dirty', None)
+        return self._write_from(i, bars)
+
+    def slice(self, start, end):
+        """
+        期間 start〜end（load_bars と同じ指定方法）の行位置 (i, j) を二分探索で求める
+        """
+        start, end = get_time_range(start, end)
+        times = self.arrays()['datetime']
+        i = int(np.searchsorted(times, start.value, side='left'))
+        j = int(np.searchsorted(times, end.value, side='left'))
+        return i, j
+
+    def to_frame(self, start, end, columns=None, dtype='float64'):
+        """
+        期間 start〜end の行を load_bars と同じ形のDataFrameで返す。float64 のままなら memmap のビューなのでコピーしない
+        """
+        columns = self.meta['columns'] if columns is None else list(columns)
+        arrays = self.arrays()
+        i, j = self.slice(start, end)
+        index = pd.DatetimeIndex(arrays['datetime'][i:j].view('datetime64[ns]'), name='datetime')
+        bars = pd.DataFrame({col: arrays[col][i:j] for col in columns}, index=index, copy=False)
+        if dtype != 'float64':
+            bars = bars.astype(dtype)
+        return bars
+
+    def reset(self):
+        """
+        保存済みの行をすべて捨てる（ファイルは次の追記で切り詰められる）
+        """
+        self._arrays = None
+        self.meta['rows'] = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self._save_meta()
+
+    def _build(self, data_folder, cache_folder, workers, errors):
+        """
+        全期間を読み直して保存する。メモリを抑えるため1年分ずつ読み込んで追記する
+        """
+        self.reset()
+        years = [archive[0] for archive in list_archives(self.instrument, data_folder)]
+        # 日本時間の1月のzipにはNY時間の前年12月31日の行も入っているので1年前から読む
+        written = 0
+        for year in range(min(years) - 1, max(years) + 1):
+            bars = load_bars(self.instrument, year, year,
+                             columns=self.meta['columns'], tz=self.tz, data_folder=data_folder,
+                             cache_folder=cache_folder, workers=workers, errors=errors)
+            written += self.append(bars)
+        return written
+
+    def sync(self, data_folder=DATA_FOLDER, cache_folder=CACHE_FOLDER, workers=None, errors=None):
+        """
+        前回の取り込み以降に追加・再ダウンロード・削除されたzip（マニフェストの sha1 で判定）の分だけを取り込み直す
+        変わったzipが含みうる時刻の範囲を読み直し（他の月はキャッシュから）、保存済みの同じ範囲と差し替える
+        （削除されたzipの月の行は、読み直した範囲に含まれないので取り除かれる）
+        範囲内の重複した時刻は load_bars と同じく先に読んだ行を残す。書いた行数を返す
+        別のフォルダや古い CACHE_VERSION で作った保存データ、書き直しの途中で止まった保存データは全期間を作り直す
+        """
+        entries = refresh_manifest(data_folder, cache_folder)['instruments'].get(self.instrument, {})
+        ingested = self.meta.get('archives', {})
+        if (self.meta.get('data_folder') != os.path.abspath(data_folder) or self.meta.get('dirty')
+                or self.meta.get('version') != CACHE_VERSION):
+            self.meta['data_folder'] = os.path.abspath(data_folder)
+            self.meta['version'] = CACHE_VERSION
+            ingested = {}
+            self.reset()
+        # 追加・再ダウンロードされたzipと、download_file から消えたzip（その月の行を取り除く）の年月
+        changed = [(entry['year'], entry['month']) for file_name, entry in entries.items()
+                   if ingested.get(file_name) != entry['sha1']]
+        changed += [parse_archive_name(file_name)[1:] for file_name in ingested if file_name not in entries]
+        if not changed:
+            return 0
+
+        if self.rows == 0:
+            written = self._build(data_folder, cache_folder, workers, errors) if entries else 0
+        else:
+            spans = []
+            for year, month in changed:
+                month_start = pd.Timestamp(year=year, month=month, day=1)
+                spans.extend(get_local_span(month_start, month_start + pd.offsets.MonthBegin(1), self.tz))
+            start, end = min(spans), max(spans)
+            bars = load_bars(self.instrument, start, end - pd.Timedelta(1, 'ns'), columns=self.meta['columns'],
+                             tz=self.tz, data_folder=data_folder, cache_folder=cache_folder, workers=workers,
+                             errors=errors)
+            written = self.replace(start, end, bars)
+        # 読めなかったzipも取り込み済みにする（再ダウンロードされて sha1 が変われば読み直す）
+        self.meta['archives'] = {file_name: entry['sha1'] for file_name, entry in entries.items()}
+        self._save_meta()
+        return written
+
+def load_store_bars(instrument, start, end, columns=None, tz=NY_TZ, data_folder=DATA_FOLDER,
+                    cache_folder=CACHE_FOLDER, store_folder=STORE_FOLDER, dtype='float64', errors=None):
+    """
+    バイナリ保存形式（BarStore）を追加・再ダウンロードされた月の分だけ更新してから、期間 start〜end の行を load_bars と同じ形で返す
+    毎回 pandas のDataFrameを連結し直さず、memmap のビューをそのまま渡す
+    """
+    store = BarStore(instrument, tz, store_folder)
+    store.sync(data_folder, cache_folder, errors=errors)
+    return store.to_frame(start, end, columns, dtype)
@@ -0,0 +1,126 @@
+import numpy as np
+from FixedTimeEngine import strategy_masks, fill_prices, SKIP_WEEKDAYS, NO_ENTRY_WEEKDAYS, CLOSE_WINDOW
+
+try:
+    from numba import njit  # SL/TP の到達を調べるループをコンパイルする（なければ NumPy で計算する）
+except ImportError:
+    njit = None
+
+# 定数の定義
+USE_NUMBA = njit is not None  # False にすると Numba があっても NumPy の実装を使う
+
+def day_entries(bars, entry_time, close_time, skip_weekdays=SKIP_WEEKDAYS, no_entry_weekdays=NO_ENTRY_WEEKDAYS,
+                close_window=CLOSE_WINDOW):
+    """
+    取引日ごとの (エントリー時刻の足, 約定後の最初の決済の時間帯の足（なければデータの本数）) の配列
+    約定する足がないものと、エントリー時刻の足が決済の時間帯で注文が取り消されるものは除く
+    """
+    n = len(bars['close'])
+    # TP/SL の幅を無限にすると、価格の条件を除いたエントリーの判定になる
+    entry_mask, window_mask, _, _ = strategy_masks(bars, entry_time, np.inf, np.inf, close_time, skip_weekdays,
+                                                   no_entry_weekdays, close_window)
+    entry_bars = np.flatnonzero(entry_mask & ~window_mask)
+    entry_bars = entry_bars[entry_bars + 1 < n]
+    windows = np.flatnonzero(window_mask)
+    window_bars = np.append(windows, n)[np.searchsorted(windows, entry_bars + 1)]
+    return entry_bars, window_bars
+
+def _first_reached(extremes, offsets, lengths, thresholds):
+    """
+    取引日ごとの単調な累積の最小値（または最大値の符号を反転したもの）extremes で、thresholds 以下になる
+    最初の位置（区間の中の位置。なければ区間の長さ）を、全組み合わせまとめて二分探索する
+    """
+    lo = np.zeros(thresholds.shape, dtype=np.int64)
+    hi = np.broadcast_to(lengths, thresholds.shape).copy()
+    for _ in range(int(lengths.max()).bit_length()):
+        mid = (lo + hi) // 2
+        below = extremes[offsets + np.minimum(mid, lengths - 1)] <= thresholds
+        searching = lo < hi
+        hi = np.where(searching & below, mid, hi)
+        lo = np.where(searching & ~below, mid + 1, lo)
+    return lo
+
+def _search_numpy(open_, high, low, close, entry_bars, window_bars, take_profits, stop_losses,
+                  exit_bars, exit_prices):
+    """
+    exit_search の NumPy の実装。取引日ごとに [約定の足, 決済の時間帯の足] の安値の累積最小値と高値の累積最大値を
+    1回だけ作り、SL/TP に最初に届く足を組み合わせごとに二分探索する
+    """
+    n = len(open_)
+    start = entry_bars + 1
+    lengths = np.minimum(window_bars, n - 1) - start + 1
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    lowest = np.concatenate([np.minimum.accumulate(low[s:s + length]) for s, length in zip(start, lengths)])
+    highest = np.concatenate([np.maximum.accumulate(high[s:s + length]) for s, length in zip(start, lengths)])
+
+    prices = close[entry_bars][None, :]
+    sl = prices - stop_losses[:, None]
+    tp = prices + take_profits[:, None]
+    sl_found = _first_reached(lowest, offsets, lengths, sl)
+    tp_found = _first_reached(-highest, offsets, lengths, -tp)
+    is_sl = sl_found <= tp_found  # 同じ足で両方に届いたら SL
+    found = np.minimum(sl_found, tp_found)
+    reached = found < lengths
+    bar = np.where(reached, start + found, window_bars + 1)
+    touched = open_[np.minimum(bar, n - 1)]
+    price = np.where(~reached, touched, np.where(is_sl, np.minimum(touched, sl), np.maximum(touched, tp)))
+    closed = reached | (window_bars + 1 < n)
+    exit_bars[:] = np.where(closed, bar, -1)
+    exit_prices[:] = np.where(closed, price, np.nan)
+
+def _search_loop(open_, high, low, close, entry_bars, window_bars, take_profits, stop_losses,
+                 exit_bars, exit_prices):
+    """
+    exit_search の Numba の実装（取引日ごとに足を順に調べて最初に届いたところで止める）
+    並列化はプロセスで行うので、スレッドは使わない（Numba のスレッドを起動した後に fork したプロセスは終了しないことがある）
+    """
+    n = len(open_)
+    for c in range(len(take_profits)):
+        for d in range(len(entry_bars)):
+            entry = entry_bars[d]
+            tp = close[entry] + take_profits[c]
+            sl = close[entry] - stop_losses[c]
+            stop = min(window_bars[d], n - 1)
+            exit_bars[c, d] = -1
+            exit_prices[c, d] = np.nan
+            for i in range(entry + 1, stop + 1):
+                if low[i] <= sl:
+                    exit_bars[c, d] = i
+                    exit_prices[c, d] = min(open_[i], sl)
+                    break
+                if high[i] >= tp:
+                    exit_bars[c, d] = i
+                    exit_prices[c, d] = max(open_[i], tp)
+                    break
+            if exit_bars[c, d] < 0 and window_bars[d] + 1 < n:
+                exit_bars[c, d] = window_bars[d] + 1
+                exit_prices[c, d] = open_[window_bars[d] + 1]
+
+_search_compiled = njit(cache=True)(_search_loop) if njit is not None else None
+
+def exit_search(bars, entry_bars, window_bars, take_profits, stop_losses, size=1):
+    """
+    エントリー時刻の足の終値 P から、high >= P + take_profit、low <= P - stop_loss、決済の時間帯の足の
+    どれが最初に来るかを、全取引日 × 全 TP/SL の組で1回にまとめて求める（simulate と同じ約定）
+    - 約定は次の足の始値（bars に 'spread' があれば ASK の始値）
+    - 約定した足から決済の時間帯の足までで SL/TP を BID の価格で調べる（同じ足で両方なら SL）
+    - SL は min(始値, SL)、TP は max(始値, TP)、決済の時間帯に届かなければその次の足の始値で決済
+    - 決済されないまま終わる取引（データの最後）は決済の足が -1、価格と損益が NaN
+    取引どうしの重なりや証拠金は考えない（日ごとに独立した1取引として扱う）
+    take_profits と stop_losses は同じ長さ（組み合わせの数）。entry_bars, window_bars は day_entries の結果
+    (決済の足, 決済価格, 損益) をそれぞれ（組み合わせの数, 取引日の数）の配列で返す
+    """
+    open_, high, low, close = (np.ascontiguousarray(bars[key], dtype=np.float64)
+                               for key in ('open', 'high', 'low', 'close'))
+    entry_bars = np.asarray(entry_bars, dtype=np.int64)
+    window_bars = np.asarray(window_bars, dtype=np.int64)
+    take_profits = np.asarray(take_profits, dtype=np.float64).ravel()
+    stop_losses = np.asarray(stop_losses, dtype=np.float64).ravel()
+    shape = (len(take_profits), len(entry_bars))
+    exit_bars = np.empty(shape, dtype=np.int64)
+    exit_prices = np.empty(shape, dtype=np.float64)
+    if shape[0] and shape[1]:
+        search = _search_compiled if USE_NUMBA and _search_compiled is not None else _search_numpy
+        search(open_, high, low, close, entry_bars, window_bars, take_profits, stop_losses, exit_bars, exit_prices)
+    pnl = size * (exit_prices - fill_prices(bars, entry_bars + 1)[None, :])
+    return exit_bars, exit_prices, pnl
@@ -0,0 +1,479 @@
+import numpy as np
+import pandas as pd
+from backtesting._stats import compute_stats, geometric_mean
+from backtesting._util import _data_period
+from ClickData import SPREAD_COLUMN
+
+# 定数の定義
+MINUTE_NS = 60 * 10**9
+DAY_NS = 24 * 60 * MINUTE_NS
+HIT_CHUNK_BARS = 2048  # SL/TP の到達を探すときに一度に調べる本数（見つからなければ倍にして続きを探す）
+
+# BacktestClickFX の MyStrategy の規則（0 = 月曜日, 4 = 金曜日）
+SKIP_WEEKDAYS = (4,)      # この曜日は何もしない（決済もしない）
+NO_ENTRY_WEEKDAYS = (2,)  # この曜日はエントリーしない
+CLOSE_WINDOW = 3          # 決済時刻の前後 (CLOSE_WINDOW - 1) 分を決済の時間帯にする
+
+# 取引の一覧と最終資産額だけで compute_stats と同じ値になる統計項目（日ごとの索引での最適化に使う）
+TRADE_METRICS = ['Exposure Time [%]', 'Equity Final [$]', 'Return [%]', '# Trades', 'Win Rate [%]',
+                 'Best Trade [%]', 'Worst Trade [%]', 'Avg. Trade [%]', 'Max. Trade Duration',
+                 'Avg. Trade Duration', 'Profit Factor', 'Expectancy [%]', 'SQN', 'Kelly Criterion']
+
+class _Trade:
+    __slots__ = ('size', 'entry_bar', 'entry_price', 'sl', 'tp', 'sl_order', 'tp_order',
+                 'exit_bar', 'exit_price')
+
+    def __init__(self, size, entry_bar, entry_price, sl, tp):
+        self.size = size
+        self.entry_bar = entry_bar
+        self.entry_price = entry_price
+        self.sl = sl
+        self.tp = tp
+        self.sl_order = None
+        self.tp_order = None
+        self.exit_bar = None
+        self.exit_price = None
+
+class _Order:
+    __slots__ = ('kind', 'trade', 'sl', 'tp')
+
+    def __init__(self, kind, trade=None, sl=None, tp=None):
+        self.kind = kind  # 'buy'（成行の新規）, 'close'（成行の決済）, 'sl', 'tp'
+        self.trade = trade
+        self.sl = sl
+        self.tp = tp
+
+def prepare_bars(data):
+    """
+    backtesting.py 用のDataFrame（Open/High/Low/Close、DatetimeIndex）から判定に使う配列を作る
+    同じデータで何度も実行する（最適化など）ときは1回だけ作って使い回す
+    data に SPREAD_COLUMN（ClickData.to_spread_frame）があれば 'spread' に入れ、新規の買いを ASK の始値で約定させる
+    """
+    ns = data.index.values.astype('datetime64[ns]').view(np.int64)
+    days = ns // DAY_NS
+    minute_of_day = (ns - days * DAY_NS) // MINUTE_NS
+    bars = {
+        'index': data.index,
+        'open': data['Open'].to_numpy(dtype=np.float64),
+        'high': data['High'].to_numpy(dtype=np.float64),
+        'low': data['Low'].to_numpy(dtype=np.float64),
+        'close': data['Close'].to_numpy(dtype=np.float64),
+        'hour': minute_of_day // 60,
+        'minute': minute_of_day % 60,
+        'hhmm': minute_of_day // 60 * 100 + minute_of_day % 60,
+        'weekday': (days + 3) % 7,  # 1970-01-01 は木曜日
+    }
+    if SPREAD_COLUMN in data.columns:
+        bars['spread'] = data[SPREAD_COLUMN].to_numpy()  # 単精度のまま持つ（使うときに始値に足す）
+    return bars
+
+def fill_prices(bars, fill_bars):
+    """
+    fill_bars の足で成行買いが約定する価格（'spread' があれば ASK の始値 = BID の始値 + スプレッド、なければ BID の始値）
+    SL/TP と成行決済は売りなので、判定も約定も BID の価格のまま
+    """
+    prices = bars['open'][fill_bars] * 1.0
+    if 'spread' in bars:
+        prices = prices + bars['spread'][fill_bars]
+    return prices
+
+def find_first_hit(bars, start, sl, tp):
+    """
+    start 本目以降で安値が sl 以下か高値が tp 以上になる最初の足の位置（なければデータの本数）
+    """
+    low, high = bars['low'], bars['high']
+    sl = -np.inf if sl is None else sl
+    tp = np.inf if tp is None else tp
+    chunk = HIT_CHUNK_BARS
+    while start < len(low):
+        stop = min(len(low), start + chunk)
+        hit = (low[start:stop] <= sl) | (high[start:stop] >= tp)
+        position = int(hit.argmax())
+        if hit[position]:
+            return start + position
+        start = stop
+        chunk *= 2
+    return len(low)
+
+def strategy_masks(bars, entry_time, take_profit, stop_loss, close_time, skip_weekdays=SKIP_WEEKDAYS,
+                   no_entry_weekdays=NO_ENTRY_WEEKDAYS, close_window=CLOSE_WINDOW):
+    """
+    MyStrategy が注文を出す足の判定
+    (エントリーする足のマスク, 決済の時間帯の足のマスク, 各足の終値からの SL の価格, TP の価格) を返す
+    """
+    close = bars['close']
+    # 戦略の next が呼ばれる足（backtesting.py は0本目では呼ばない）
+    active = ~np.isin(bars['weekday'], skip_weekdays)
+    active[:1] = False
+    sl_prices = close - stop_loss
+    tp_prices = close + take_profit
+    entry_mask = (active & (bars['hhmm'] == entry_time)
+                  & (sl_prices < close) & (close < tp_prices) & ~np.isin(bars['weekday'], no_entry_weekdays))
+    close_minute = close_time % 100
+    window_mask = (active & (bars['hour'] == close_time // 100)
+                   & (close_minute - close_window < bars['minute']) & (bars['minute'] < close_minute + close_window))
+    return entry_mask, window_mask, sl_prices, tp_prices
+
+def simulate(bars, entry_time, take_profit, stop_loss, close_time, cash, margin, size,
+             skip_weekdays=SKIP_WEEKDAYS, no_entry_weekdays=NO_ENTRY_WEEKDAYS, close_window=CLOSE_WINDOW):
+    """
+    MyStrategy を Backtest(..., commission=0).run() したときと同じ約定を、判定が必要な足だけ調べて再現する
+    - エントリー時刻の足の終値で判定し、次の足の始値で成行買い（証拠金が足りなければ取り消し。bars に 'spread' があれば ASK の始値）
+    - SL は min(始値, SL)、TP は max(始値, TP) で約定（同じ足で両方なら SL が先）。約定した足でも判定する
+    - 決済の時間帯の足で保有していれば、次の足の始値で成行決済
+    - 最後まで残った建玉は決済しない（backtesting.py の finalize_trades=False と同じ）
+    決済済みの取引（_Trade のリスト、決済順）と各足の資産額の配列を返す
+    """
+    open_, close, n = bars['open'], bars['close'], len(bars['close'])
+    spread = bars.get('spread')
+    leverage = 1 / margin
+
+    entry_mask, window_mask, sl_prices, tp_prices = strategy_masks(
+        bars, entry_time, take_profit, stop_loss, close_time, skip_weekdays, no_entry_weekdays, close_window)
+    strategy_bars = np.flatnonzero(entry_mask | window_mask)
+
+    orders = []  # backtesting.py の broker.orders と同じ順序で並べる
+    trades = []
+    closed_trades = []
+    # 資産額の計算用に、建玉が変わった足ごとの (現金, 建玉数量, 建値×数量の合計) を記録する
+    state_bars, state_cash, state_size, state_cost = [0], [float(cash)], [0], [0]
+
+    def close_trade(trade, price, i):
+        nonlocal cash
+        trades.remove(trade)
+        if trade.sl_order:
+            orders.remove(trade.sl_order)
+        if trade.tp_order:
+            orders.remove(trade.tp_order)
+        trade.exit_bar, trade.exit_price = i, price
+        closed_trades.append(trade)
+        cash += trade.size * (price - trade.entry_price) - 0.
+
+    def process_orders(i):
+        o, h, l = open_[i], bars['high'][i], bars['low'][i]
+        reprocess = False
+        for order in list(orders):
+            if order not in orders:
+                continue
+            trade = order.trade
+            if order.kind == 'sl':
+                if l <= trade.sl:
+                    close_trade(trade, min(o, trade.sl), i)
+            elif order.kind == 'tp':
+                if h >= trade.tp:
+                    close_trade(trade, max(o, trade.tp), i)
+            elif order.kind == 'close':
+                if trade in trades:
+                    close_trade(trade, o, i)
+                orders.remove(order)
+            else:
+                last = close[i]
+                equity = cash + (last * sum(t.size for t in trades) - sum(t.size * t.entry_price for t in trades))
+                margin_available = max(0, equity - sum(abs(t.size) * last / leverage for t in trades))
+                fill = o * 1.0 if spread is None else o + spread[i]
+                if size * fill <= margin_available * leverage:
+                    trade = _Trade(size, i, fill, order.sl, order.tp)
+                    trades.append(trade)
+                    if order.tp:
+                        trade.tp_order = _Order('tp', trade)
+                        orders.append(trade.tp_order)
+                    if order.sl:
+                        trade.sl_order = _Order('sl', trade)
+                        orders.insert(0, trade.sl_order)
+                    reprocess = reprocess or bool(order.sl or order.tp)
+                orders.remove(order)
+        if reprocess:
+            process_orders(i)
+
+    next_strategy = 0
+    hit_bars = {}  # 建玉 → SL/TP に最初に届く足
+    i = 0
+    while True:
+        candidates = [n]
+        if next_strategy < len(strategy_bars):
+            candidates.append(strategy_bars[next_strategy])
+        if any(order.kind in ('buy', 'close') for order in orders):
+            candidates.append(i + 1)
+        candidates.extend(hit_bars[trade] for trade in trades if trade in hit_bars)
+        i = int(min(candidates))
+        if i >= n:
+            break
+
+        before = len(closed_trades), len(trades)
+        if orders:
+            process_orders(i)
+        if (len(closed_trades), len(trades)) != before:
+            state_bars.append(i)
+            state_cash.append(cash)
+            state_size.append(sum(t.size for t in trades))
+            state_cost.append(sum(t.size * t.entry_price for t in trades))
+            for trade in trades:
+                if trade not in hit_bars:
+                    hit_bars[trade] = find_first_hit(bars, i + 1, trade.sl if trade.sl_order else None,
+                                                     trade.tp if trade.tp_order else None)
+
+        if next_strategy < len(strategy_bars) and strategy_bars[next_strategy] == i:
+            next_strategy += 1
+            if entry_mask[i]:
+                orders.append(_Order('buy', sl=sl_prices[i] or None, tp=tp_prices[i] or None))
+            if window_mask[i]:
+                for order in list(orders):
+                    if order.kind in ('buy', 'close'):
+                        orders.remove(order)
+                for trade in list(trades):
+                    orders.insert(0, _Order('close', trade))
+
+    # 資産額 = 現金 + 終値での含み損益（backtesting.py と同じ計算順）
+    state = np.repeat(np.arange(len(state_bars)), np.diff(state_bars + [n]))
+    equity = (np.array(state_cash)[state]
+              + (close * np.array(state_size)[state] - np.array(state_cost, dtype=np.float64)[state]))
+    equity[0] = equity[1] if n > 1 else cash
+
+    # 資産額が0以下になった足で残りの建玉を終値で決済して打ち切る（backtesting.py の資金切れ処理）
+    broke = np.flatnonzero(equity[1:] <= 0)
+    if len(broke):
+        i = int(broke[0]) + 1
+        still_open = sorted((t for t in closed_trades + trades
+                             if t.entry_bar <= i and (t.exit_bar is None or t.exit_bar > i)),
+                            key=lambda t: t.entry_bar)
+        closed_trades = [t for t in closed_trades if t.exit_bar <= i]
+        # backtesting.py は建玉のリストを回しながら削除するので、1つおきにしか決済されない
+        for trade in still_open[::2]:
+            trade.exit_bar, trade.exit_price = i, close[i]
+            closed_trades.append(trade)
+        equity[i:] = 0
+    return closed_trades, equity
+
+def make_trades_frame(bars, closed_trades):
+    """
+    決済済みの取引を backtesting.py の stats['_trades'] と同じ列のDataFrameにする
+    取引がなければ backtesting.py と同じく空のリストから作る（列の型も同じになり、取引期間の統計が NaT でなく NaN になる）
+    """
+    if not closed_trades:
+        trades_df = pd.DataFrame({column: [] for column in ['Size', 'EntryBar', 'ExitBar', 'EntryPrice', 'ExitPrice',
+                                                            'SL', 'TP', 'PnL', 'Commission', 'ReturnPct',
+                                                            'EntryTime', 'ExitTime']})
+        trades_df['Duration'] = trades_df['ExitTime'] - trades_df['EntryTime']
+        trades_df['Tag'] = []
+        return trades_df
+    index = bars['index']
+    entry_bars = np.array([t.entry_bar for t in closed_trades], dtype=np.int64)
+    exit_bars = np.array([t.exit_bar for t in closed_trades], dtype=np.int64)
+    sizes = np.array([t.size for t in closed_trades], dtype=np.int64)
+    entry_prices = np.array([t.entry_price for t in closed_trades], dtype=np.float64)
+    exit_prices = np.array([t.exit_price for t in closed_trades], dtype=np.float64)
+    trades_df = pd.DataFrame({
+        'Size': sizes,
+        'EntryBar': entry_bars,
+        'ExitBar': exit_bars,
+        'EntryPrice': entry_prices,
+        'ExitPrice': exit_prices,
+        'SL': [t.sl if t.sl_order else None for t in closed_trades],
+        'TP': [t.tp if t.tp_order else None for t in closed_trades],
+        'PnL': sizes * (exit_prices - entry_prices) - 0.,
+        'Commission': np.zeros(len(closed_trades)),
+        'ReturnPct': np.sign(sizes) * (exit_prices / entry_prices - 1) - 0.,
+        'EntryTime': index[entry_bars],
+        'ExitTime': index[exit_bars],
+    })
+    trades_df['Duration'] = trades_df['ExitTime'] - trades_df['EntryTime']
+    trades_df['Tag'] = None
+    return trades_df
+
+def run_fixed_time_backtest(data, entry_time, take_profit, stop_loss, close_time, cash, margin, size,
+                            skip_weekdays=SKIP_WEEKDAYS, no_entry_weekdays=NO_ENTRY_WEEKDAYS,
+                            close_window=CLOSE_WINDOW, bars=None, strategy_name='MyStrategy'):
+    """
+    Backtest(data, MyStrategy, cash=cash, margin=margin, commission=0).run() と同じ結果（stats）を返す
+    統計は backtesting.py の compute_stats でそのまま計算する。bars は prepare_bars(data) の結果を使い回すとき
+    """
+    if bars is None:
+        bars = prepare_bars(data)
+    closed_trades, equity = simulate(bars, entry_time, take_profit, stop_loss, close_time, cash, margin, size,
+                                     skip_weekdays, no_entry_weekdays, close_window)
+    stats = compute_stats(trades=make_trades_frame(bars, closed_trades), equity=equity, ohlc_data=data,
+                          strategy_instance=None)
+    stats['_strategy'] = (f"{strategy_name}(entry_time={entry_time},take_profit={take_profit},"
+                          f"stop_loss={stop_loss},close_time={close_time})")
+    return stats
+
+def prepare_rank_index(bars):
+    """
+    高値・安値を値の順位（整数）に置き換えた配列を bars に追加する（日ごとの索引で SL/TP の到達を調べるため）
+    - 'high_rank': 高値の昇順の順位。高値 >= TP は 順位 >= searchsorted(unique_high, TP) と同じ
+    - 'low_rank' : 安値の降順の順位。安値 <= SL は 順位 >= len(unique_low) - searchsorted(unique_low, SL, 'right') と同じ
+    順位で比べるので、価格を足し引きして比べるときのような丸め誤差が出ない
+    """
+    bars['unique_high'], high_rank = np.unique(bars['high'], return_inverse=True)
+    bars['unique_low'], low_rank = np.unique(bars['low'], return_inverse=True)
+    bars['high_rank'] = high_rank.astype(np.int64)
+    bars['low_rank'] = len(bars['unique_low']) - 1 - low_rank.astype(np.int64)
+    return bars
+
+def build_day_index(bars, entry_time, close_time, skip_weekdays=SKIP_WEEKDAYS,
+                    no_entry_weekdays=NO_ENTRY_WEEKDAYS, close_window=CLOSE_WINDOW):
+    """
+    エントリー時刻と決済時刻の組ごとに1回だけ作る、取引日ごとの索引
+    - 'entry'  : エントリー候補の足（エントリー時刻の足。約定する足がないものと決済の時間帯で取り消されるものは除く）
+    - 'start', 'end' : 約定する足から、決済の時間帯の最初の足か次の候補の約定の足までの区間（end を含む）
+    - 'window' : 約定後の最初の決済の時間帯の足（なければデータの本数）
+    - 'high', 'low' : 各区間の高値・安値の順位の累積最大に「区間番号 × 順位の数」を足して連結した配列
+      区間をまたいで単調増加なので、全区間の SL/TP の最初の到達を1回の searchsorted で求められる
+    bars には prepare_rank_index の配列が必要
+    """
+    n = len(bars['close'])
+    active = ~np.isin(bars['weekday'], skip_weekdays)
+    active[:1] = False
+    close_minute = close_time % 100
+    window_mask = (active & (bars['hour'] == close_time // 100)
+                   & (close_minute - close_window < bars['minute']) & (bars['minute'] < close_minute + close_window))
+    windows = np.flatnonzero(window_mask)
+    entry = np.flatnonzero(active & (bars['hhmm'] == entry_time) & ~np.isin(bars['weekday'], no_entry_weekdays))
+    entry = entry[(entry + 1 < n) & ~window_mask[entry]]
+
+    start = entry + 1
+    position = np.searchsorted(windows, start)
+    window = np.append(windows, n)[position]
+    end = np.minimum(window, np.append(start[1:], n - 1))
+    lengths = end - start + 1
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    segment = np.repeat(np.arange(len(entry), dtype=np.int64), lengths)
+    positions = np.arange(offsets[-1], dtype=np.int64) - offsets[segment] + start[segment]
+
+    high_count, low_count = len(bars['unique_high']), len(bars['unique_low'])
+    return {
+        'entry': entry, 'start': start, 'end': end, 'window': window, 'offsets': offsets,
+        'high': np.maximum.accumulate(bars['high_rank'][positions] + segment * high_count),
+        'low': np.maximum.accumulate(bars['low_rank'][positions] + segment * low_count),
+    }
+
+def _first_hits(day_index, cumulative, thresholds, count):
+    """
+    各区間で順位の累積最大が thresholds 以上になる最初の足（なければ -1）
+    """
+    segments = np.arange(len(thresholds), dtype=np.int64)
+    found = np.searchsorted(cumulative, segments * count + thresholds)
+    offsets = day_index['offsets']
+    return np.where(found < offsets[1:], day_index['start'] + (found - offsets[:-1]), -1)
+
+def lookup_trades(bars, day_index, take_profit, stop_loss, cash, margin, size):
+    """
+    日ごとの索引から、1組の TP/SL の取引を simulate と同じ約定で求める（区間ごとの二分探索だけで足を走査しない）
+    取引が重なる、証拠金が足りない、資産額が0以下になりうるなど索引だけで決められない場合は None を返す
+    (建玉の足, 決済の足, 建値, 決済価格の配列, 最終資産額) を返す
+    """
+    open_, close, n = bars['open'], bars['close'], len(bars['close'])
+    entry = day_index['entry']
+    sl_prices = close[entry] - stop_loss
+    tp_prices = close[entry] + take_profit
+    valid = (sl_prices < close[entry]) & (close[entry] < tp_prices)
+    if np.any(valid & (sl_prices == 0)):
+        return None  # SL が 0 の注文は SL なしになる
+
+    unique_high, unique_low = bars['unique_high'], bars['unique_low']
+    tp_bars = _first_hits(day_index, day_index['high'], np.searchsorted(unique_high, tp_prices), len(unique_high))
+    sl_bars = _first_hits(day_index, day_index['low'],
+                          len(unique_low) - np.searchsorted(unique_low, sl_prices, 'right'), len(unique_low))
+    by_sl = (sl_bars >= 0) & ((tp_bars < 0) | (sl_bars <= tp_bars))
+    by_tp = (tp_bars >= 0) & ~by_sl
+    window = day_index['window']
+    by_window = ~by_sl & ~by_tp & (window <= day_index['end'])
+    exit_bars = np.select([by_sl, by_tp, by_window], [sl_bars, tp_bars, window + 1], n)
+    stay_open = exit_bars >= n
+    # 区間の終わりまでに決済されない建玉は、最後の候補でない限り次の取引と重なる可能性がある
+    if np.any(valid[:-1] & ~by_sl[:-1] & ~by_tp[:-1] & ~by_window[:-1]):
+        return None
+
+    entry_bars, exit_bars, stay_open = entry[valid] + 1, exit_bars[valid], stay_open[valid]
+    if np.any(exit_bars[:-1] > entry_bars[1:]) or np.any(stay_open[:-1]):
+        return None
+    exit_open = open_[np.minimum(exit_bars, n - 1)]
+    exit_prices = np.select([by_sl[valid], by_tp[valid]],
+                            [np.minimum(exit_open, sl_prices[valid]), np.maximum(exit_open, tp_prices[valid])], exit_open)
+    entry_prices = fill_prices(bars, entry_bars)
+    closed = ~stay_open
+    pnl = size * (exit_prices[closed] - entry_prices[closed]) - 0.
+    cash_history = np.add.accumulate(np.concatenate(([float(cash)], pnl)))  # 各取引の前と最後の現金
+    cash_before = cash_history[:len(entry_bars)]
+    if np.any(size * entry_prices > np.maximum(0, cash_before) * (1 / margin)):
+        return None
+    # 保有中の安値の最小で評価しても資産額が正なら、資金切れの処理は起きない
+    held = np.flatnonzero(valid)
+    offsets, low_count = day_index['offsets'], len(unique_low)
+    last = offsets[held] + np.minimum(exit_bars, day_index['end'][held]) - day_index['start'][held]
+    lowest = unique_low[low_count - 1 - (day_index['low'][last] - held * low_count)]
+    equity_final = cash_history[-1]
+    if np.any(cash_before + size * (lowest - entry_prices) <= 0) or equity_final <= 0:
+        return None
+    if len(stay_open) and stay_open[-1]:
+        equity_final = equity_final + (close[-1] * size - size * entry_prices[-1])
+    return entry_bars[closed], exit_bars[closed], entry_prices[closed], exit_prices[closed], equity_final
+
+def trade_metrics(bars, entry_bars, exit_bars, entry_prices, exit_prices, sizes, equity_start, equity_final):
+    """
+    取引の一覧と最初・最後の資産額から、TRADE_METRICS の項目を compute_stats と同じ式で計算する
+    """
+    index, n = bars['index'], len(bars['close'])
+    entry_bars, exit_bars = np.asarray(entry_bars, dtype=np.int64), np.asarray(exit_bars, dtype=np.int64)
+    pl = pd.Series(sizes * (exit_prices - entry_prices) - 0.)
+    returns = pd.Series(np.sign(sizes) * (exit_prices / entry_prices - 1) - 0.)
+    # 取引がなければ compute_stats（空の取引の一覧）と同じく、取引期間の統計を NaT でなく NaN にする
+    durations = pd.Series(index[exit_bars] - index[entry_bars]) if len(entry_bars) else pd.Series([], dtype=np.float64)
+    period = _data_period(index)
+    resolution = getattr(period, 'resolution_string', None) or period.resolution
+
+    def round_timedelta(value):
+        return value if not isinstance(value, pd.Timedelta) else value.ceil(resolution)
+
+    # 保有していた足の数（取引の区間 [建玉の足, 決済の足] の和集合）
+    order = np.argsort(entry_bars, kind='stable')
+    starts, ends = entry_bars[order], exit_bars[order]
+    covered = np.concatenate(([-1], np.maximum.accumulate(ends)[:-1])) if len(ends) else ends
+    exposure = np.maximum(0, ends - np.maximum(starts, covered + 1) + 1).sum()
+
+    n_trades = len(entry_bars)
+    win_rate = np.nan if not n_trades else (pl > 0).mean()
+    return {
+        'Exposure Time [%]': exposure / n * 100,
+        'Equity Final [$]': equity_final,
+        'Return [%]': (equity_final - equity_start) / equity_start * 100,
+        '# Trades': n_trades,
+        'Win Rate [%]': win_rate * 100,
+        'Best Trade [%]': returns.max() * 100,
+        'Worst Trade [%]': returns.min() * 100,
+        'Avg. Trade [%]': geometric_mean(returns) * 100,
+        'Max. Trade Duration': round_timedelta(durations.max()),
+        'Avg. Trade Duration': round_timedelta(durations.mean()),
+        'Profit Factor': returns[returns > 0].sum() / (abs(returns[returns < 0].sum()) or np.nan),
+        'Expectancy [%]': returns.mean() * 100,
+        'SQN': np.sqrt(n_trades) * pl.mean() / (pl.std() or np.nan),
+        'Kelly Criterion': win_rate - (1 - win_rate) / (pl[pl > 0].mean() / -pl[pl < 0].mean()),
+    }
+
+def evaluate_day_grid(bars, entry_time, close_time, tp_sl_pairs, cash, margin, size,
+                      skip_weekdays=SKIP_WEEKDAYS, no_entry_weekdays=NO_ENTRY_WEEKDAYS, close_window=CLOSE_WINDOW):
+    """
+    エントリー時刻と決済時刻の組について、日ごとの索引を1回だけ作り、(TP, SL) の組を索引の参照で評価する
+    索引だけで決められない組（取引の重なり・証拠金不足・資金切れ）は simulate で評価する
+    (TP, SL, TRADE_METRICS の辞書) を tp_sl_pairs の順に返す
+    """
+    day_index = build_day_index(bars, entry_time, close_time, skip_weekdays, no_entry_weekdays, close_window)
+    results = []
+    for take_profit, stop_loss in tp_sl_pairs:
+        found = lookup_trades(bars, day_index, take_profit, stop_loss, cash, margin, size)
+        if found is not None:
+            entry_bars, exit_bars, entry_prices, exit_prices, equity_final = found
+            sizes = np.full(len(entry_bars), size, dtype=np.int64)
+            equity_start = float(cash)
+        else:
+            closed_trades, equity = simulate(bars, entry_time, take_profit, stop_loss, close_time, cash, margin,
+                                             size, skip_weekdays, no_entry_weekdays, close_window)
+            trades_df = make_trades_frame(bars, closed_trades)
+            entry_bars, exit_bars = trades_df['EntryBar'].to_numpy(), trades_df['ExitBar'].to_numpy()
+            entry_prices, exit_prices = trades_df['EntryPrice'].to_numpy(), trades_df['ExitPrice'].to_numpy()
+            sizes = trades_df['Size'].to_numpy()
+            equity_start, equity_final = equity[0], equity[-1]
+        results.append((take_profit, stop_loss,
+                        trade_metrics(bars, entry_bars, exit_bars, entry_prices, exit_prices, sizes,
+                                      equity_start, equity_final)))
+    return results
@@ -0,0 +1,269 @@
+import os
+import sys
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import FixedTimeEngine
+import SparseBacktest
+import ExitKernel
+import TensorBacktest
+from FixedTimeEngine import (TRADE_METRICS, prepare_bars, prepare_rank_index, evaluate_day_grid,
+                             run_fixed_time_backtest)
+from ResultCache import ResultCache, data_fingerprint, code_version, make_key
+from ClickData import SPREAD_COLUMN
+
+try:
+    import pyarrow  # noqa: F401  Feather での保存に使う（なければCSV）
+except ImportError:
+    pyarrow = None
+
+# 定数の定義
+WORKERS = os.cpu_count() or 1  # グリッドサーチに使うプロセス数（1なら逐次）
+BATCH_SIZE = 16  # 1回にワーカーへ渡す組み合わせの数
+SHARED_KEYS = ['open', 'high', 'low', 'close', 'hour', 'minute', 'hhmm', 'weekday', 'spread']  # 'spread' はあれば
+RANK_KEYS = ['unique_high', 'unique_low', 'high_rank', 'low_rank']  # prepare_rank_index の配列（あれば共有する）
+DAY_PARAMS = ['entry_time', 'take_profit', 'stop_loss', 'close_time']  # 日ごとの索引で評価できるパラメータ
+# 結果のキャッシュのキーに入れるコードの版（スクリプトのバックテストが使うエンジンのソースも含める）
+ENGINE_VERSION = code_version(FixedTimeEngine.__file__, SparseBacktest.__file__, ExitKernel.__file__,
+                              TensorBacktest.__file__, __file__)
+RESULT_CACHE = ResultCache()  # 組み合わせごとの結果と最良の組み合わせの stats のキャッシュ
+
+# ワーカープロセス側で共有メモリから組み立てた配列・DataFrame・売買条件
+_worker = {}
+
+def share_bars(bars):
+    """
+    prepare_bars の配列と時刻を共有メモリに置く。(共有メモリのリスト, ワーカーに渡す目録) を返す
+    ワーカーには目録（名前・型・長さ）だけを渡すので、価格配列は pickle されない
+    """
+    arrays = {key: bars[key] for key in SHARED_KEYS + RANK_KEYS if key in bars}
+    arrays['datetime'] = bars['index'].values.astype('datetime64[ns]').view(np.int64)
+    blocks, spec = [], []
+    for key, values in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+        np.ndarray(values.shape, values.dtype, buffer=shm.buf)[:] = values
+        blocks.append(shm)
+        spec.append((key, shm.name, values.dtype.str, len(values)))
+    return blocks, spec
+
+def attach_bars(spec):
+    """
+    share_bars の目録から、共有メモリを読み取り専用で参照する配列と backtesting.py 形式のDataFrameを作る
+    """
+    blocks, bars = [], {}
+    for key, name, dtype, length in spec:
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        bars[key] = np.ndarray((length,), dtype, buffer=shm.buf)
+        bars[key].flags.writeable = False
+    bars['index'] = pd.DatetimeIndex(bars.pop('datetime').view('datetime64[ns]'), name='Datetime')
+    data = pd.DataFrame({'Open': bars['open'], 'High': bars['high'], 'Low': bars['low'], 'Close': bars['close']},
+                        index=bars['index'], copy=False)
+    if 'spread' in bars:
+        data[SPREAD_COLUMN] = bars['spread']  # 親プロセスと同じ列にする（結果のキャッシュのキーが同じになる）
+    return blocks, bars, data
+
+def _init_worker(spec, rules):
+    blocks, bars, data = attach_bars(spec)
+    _worker.update(blocks=blocks, bars=bars, data=data, rules=rules)
+
+def evaluate_params(data, bars, params, rules):
+    """
+    1組のパラメータでバックテストし、パラメータと統計値（'_' で始まる項目を除く）を1行の辞書で返す
+    """
+    stats = run_fixed_time_backtest(data, **params, **rules, bars=bars)
+    return dict(params, **{key: value for key, value in stats.items() if not key.startswith('_')})
+
+def cached_backtest(data, params, rules, bars=None):
+    """
+    run_fixed_time_backtest の結果をデータの指紋・パラメータ・売買条件・コードの版をキーにキャッシュする
+    """
+    key = make_key('stats', data_fingerprint(data), params, rules, ENGINE_VERSION)
+    return RESULT_CACHE.cached(key, lambda: run_fixed_time_backtest(data, **params, **rules, bars=bars))
+
+def evaluate_batch(data, bars, param_batch, rules):
+    return [evaluate_params(data, bars, params, rules) for params in param_batch]
+
+def evaluate_day_group(data, bars, group, rules):
+    """
+    (エントリー時刻, 決済時刻, (TP, SL) のリスト) の組を日ごとの索引で評価し、行の辞書のリストを返す
+    統計は TRADE_METRICS の項目だけ
+    """
+    entry_time, close_time, tp_sl_pairs = group
+    return [dict(entry_time=entry_time, take_profit=take_profit, stop_loss=stop_loss, close_time=close_time,
+                 **metrics)
+            for take_profit, stop_loss, metrics in evaluate_day_grid(bars, entry_time, close_time, tp_sl_pairs,
+                                                                      **rules)]
+
+def _run_task(function, task):
+    return function(_worker['data'], _worker['bars'], task, _worker['rules'])
+
+def iter_results(data, bars, tasks, function, rules, workers):
+    """
+    tasks を1つずつ function(data, bars, task, rules) で評価し、終わった順に (タスク番号, 行のリスト) を返す
+    workers が2以上ならプロセスプールで並列に評価する（価格配列は共有メモリで渡す）
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        for number, task in enumerate(tasks):
+            yield number, function(data, bars, task, rules)
+        return
+
+    blocks, spec = share_bars(bars)
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(spec, rules)) as executor:
+            futures = {executor.submit(_run_task, function, task): number for number, task in enumerate(tasks)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+def make_heatmap(results, maximize, names):
+    """
+    全組み合わせの結果から Backtest.optimize(return_heatmap=True) と同じ形の Series を作る
+    （パラメータの MultiIndex、値は maximize の指標、取引のない組み合わせは NaN）
+    """
+    scores = results[maximize].where(results['# Trades'] > 0).astype(float)
+    return pd.Series(scores.to_numpy(), index=pd.MultiIndex.from_frame(results[names]), name=maximize)
+
+def rank_results(results, maximize, top=None):
+    """
+    取引のある組み合わせを maximize の大きい順に並べる（同点は組み合わせ順）。再計算はしない
+    """
+    ranked = results[results['# Trades'] > 0].sort_values(maximize, ascending=False, kind='stable')
+    return ranked if top is None else ranked.head(top)
+
+def save_results(results, path):
+    """
+    全組み合わせの結果を列指向の Feather ファイルに保存する（pyarrow がなければ拡張子を .csv にしてCSVで保存）
+    保存したパスを返す
+    """
+    if pyarrow is None:
+        path = os.path.splitext(path)[0] + '.csv'
+        results.to_csv(path, index=False)
+    else:
+        results.to_feather(path)
+    return path
+
+def load_results(path):
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    return pd.read_feather(path)
+
+def use_day_index(names, maximize):
+    """
+    日ごとの索引で評価できるか（パラメータが DAY_PARAMS で、maximize が TRADE_METRICS の項目）
+    """
+    return maximize in TRADE_METRICS and sorted(names) == sorted(DAY_PARAMS)
+
+def prepare_search_bars(data, full_stats):
+    bars = prepare_bars(data)
+    return bars if full_stats else prepare_rank_index(bars)
+
+def evaluate_combos(data, bars, combos, rules, full_stats, workers=None, results_path=None, label='Optimize',
+                    append=False, extra=None):
+    """
+    組み合わせ（パラメータ名 → 値の辞書）のリストを評価し、結果のDataFrameを combos の順で返す
+    bars は prepare_search_bars(data, full_stats) の結果
+    full_stats が False なら、エントリー時刻と決済時刻の組ごとに日ごとの索引を作り、TP/SL の組は索引の参照だけで
+    評価する（統計は TRADE_METRICS の項目だけ）
+    結果のキャッシュ（データの指紋・パラメータ・売買条件・コードの版がキー）にある組み合わせは評価しない
+    results_path を指定すると、評価が終わった組み合わせから順に1行ずつCSVに書き出す（append なら追記）
+    extra（列名 → 値）は全ての行に列として加える
+    """
+    workers = WORKERS if workers is None else workers
+    fingerprint = data_fingerprint(data)
+    keys = [make_key('row', fingerprint, params, rules, full_stats, ENGINE_VERSION) for params in combos]
+    cached = RESULT_CACHE.get_many(keys)
+    results = [cached.get(key) for key in keys]
+    missing = [position for position, row in enumerate(results) if row is None]
+    if full_stats:
+        positions = [missing[i:i + BATCH_SIZE] for i in range(0, len(missing), BATCH_SIZE)]
+        tasks = [[combos[position] for position in batch] for batch in positions]
+        function = evaluate_batch
+    else:
+        groups = {}
+        for position in missing:
+            params = combos[position]
+            groups.setdefault((params['entry_time'], params['close_time']), []).append(position)
+        positions = list(groups.values())
+        tasks = [(entry_time, close_time, [(combos[p]['take_profit'], combos[p]['stop_loss']) for p in group])
+                 for (entry_time, close_time), group in groups.items()]
+        function = evaluate_day_group
+
+    file = open(results_path, 'a' if append else 'w', newline='') if results_path else None
+    writer = None
+    done = 0
+
+    def report(rows):
+        nonlocal writer, done
+        rows = [dict(row, **extra) for row in rows] if extra else rows
+        done += len(rows)
+        if file and rows:
+            if writer is None:
+                writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+                if file.tell() == 0:
+                    writer.writeheader()
+            writer.writerows(rows)
+            file.flush()
+        print(f"\r{label}: {done}/{len(combos)}", end='', flush=True)
+
+    try:
+        if cached:
+            report([row for row in results if row is not None])
+        for number, rows in iter_results(data, bars, tasks, function, rules, workers):
+            for position, row in zip(positions[number], rows):
+                results[position] = row
+            report(rows)
+        print()
+    finally:
+        if file:
+            file.close()
+    RESULT_CACHE.put_many({keys[position]: results[position] for position in missing})
+
+    names = list(combos[0])
+    results_df = pd.DataFrame([dict(row, **extra) for row in results] if extra else results)
+    return results_df[names + [column for column in results_df.columns if column not in names]]
+
+def best_position(results, maximize, names):
+    """
+    Backtest.optimize と同じ選び方で最良の行の位置を返す（取引のない行は除き、同点なら先の行）
+    """
+    heatmap = make_heatmap(results, maximize, names)
+    return 0 if heatmap.isna().all() else int(heatmap.reset_index(drop=True).idxmax())
+
+def grid_search(data, param_grid, rules, maximize='Win Rate [%]', workers=None, results_path=None, full_stats=None):
+    """
+    param_grid（パラメータ名 → 候補のリスト）の全組み合わせを FixedTimeEngine で評価する
+    rules は run_fixed_time_backtest に渡す売買条件（cash, margin, size など）
+    results_path を指定すると、評価が終わった組み合わせから順に1行ずつCSVに書き出す
+    full_stats が False なら日ごとの索引で評価する（統計は TRADE_METRICS の項目だけ）
+    None なら use_day_index で決める
+    最良の組み合わせの選び方は Backtest.optimize と同じ（取引のない組み合わせは除き、同点なら先の組み合わせ）
+    (最良の組み合わせの stats, 全組み合わせの結果のDataFrame（組み合わせ順）, heatmap) を返す
+    """
+    names = list(param_grid)
+    combos = [dict(zip(names, values)) for values in product(*param_grid.values())]
+    if not combos:
+        raise ValueError('No parameter combinations to test')
+    if full_stats is None:
+        full_stats = not use_day_index(names, maximize)
+    bars = prepare_search_bars(data, full_stats)
+
+    results_df = evaluate_combos(data, bars, combos, rules, full_stats, workers, results_path)
+    heatmap = make_heatmap(results_df, maximize, names)
+    stats = cached_backtest(data, combos[best_position(results_df, maximize, names)], rules, bars=bars)
+    return stats, results_df, heatmap
+
+if __name__ == '__main__':
+    # 使い方: python GridOptimizer.py output/USDJPY_optimization_results_2023.feather "Return [%]" [上位件数]
+    # 保存済みの全組み合わせの結果を別の指標で並べ直して表示する
+    results = load_results(sys.argv[1])
+    maximize = sys.argv[2] if len(sys.argv) > 2 else 'Win Rate [%]'
+    top = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    print(rank_results(results, maximize, top).to_string(index=False))
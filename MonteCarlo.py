@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# 定数の定義
+PATHS = 100_000  # 作る資産額の経路の数
+# 1回にまとめて作る損益の要素の数（経路の数 × 取引の数）。経路の数は取引の数から決まり、乱数の系列もこの単位で
+# 分けるので、プロセス数を変えても結果は同じ
+CHUNK_ELEMENTS = 4_000_000
+WORKERS = os.cpu_count() or 1  # 経路の計算に使うプロセス数（1なら逐次）
+METHODS = ['bootstrap', 'shuffle']  # bootstrap: 取引を復元抽出する、shuffle: 取引の順番だけを並べ替える
+CONFIDENCE = 0.95  # 信頼区間の幅
+SEED = 0
+CASH = 100  # 取引の一覧には初期資金がないので、BacktestClickFX.py と同じ値を使う
+METRICS = ['Return [%]', 'Max. Drawdown [%]', 'Win Rate [%]']
+
+def load_trades(path):
+    """
+    バックテストで書き出した取引の一覧（stats['_trades'] の CSV）から、決済順の損益の配列を読み込む
+    """
+    trades = pd.read_csv(path)
+    return trades['PnL'].dropna().to_numpy(dtype=np.float64)
+
+def path_metrics(samples, cash):
+    """
+    損益の行列（経路の数, 取引の数）の各行を1つの経路として、METRICS の値（経路の数, 3）を返す
+    資産額は決済ごとに見るので、最大ドローダウンは保有中の含み損を含まない（stats と同じく負の値）
+    """
+    equity = cash + np.cumsum(samples, axis=1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), cash)
+    drawdown = (1 - equity / peak).max(axis=1)
+    return np.column_stack([(equity[:, -1] - cash) / cash * 100, -drawdown * 100, (samples > 0).mean(axis=1) * 100])
+
+def simulate_chunk(pnl, cash, count, method, seed):
+    """
+    count 本の経路を1回にまとめて作り、path_metrics の値を返す（seed は np.random.SeedSequence）
+    """
+    rng = np.random.default_rng(seed)
+    if method == 'bootstrap':
+        samples = pnl[rng.integers(0, len(pnl), size=(count, len(pnl)))]
+    else:
+        samples = rng.permuted(np.tile(pnl, (count, 1)), axis=1)
+    return path_metrics(samples, cash)
+
+def path_chunk(trade_count):
+    """
+    1回にまとめて作る経路の数（損益の行列が CHUNK_ELEMENTS 個に収まる数。最低1本）
+    """
+    return max(1, CHUNK_ELEMENTS // trade_count)
+
+def run_paths(pnl, cash=CASH, paths=PATHS, method='bootstrap', seed=SEED, workers=None):
+    """
+    取引の損益 pnl から paths 本の資産額の経路を作り、経路ごとの METRICS の値（paths, 3）を返す
+    取引の数に合わせて path_chunk 本ずつに分けてワーカープロセスのプールで計算する
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method} (expected one of {METHODS})")
+    if len(pnl) == 0:
+        raise ValueError("No trades to resample")
+    workers = WORKERS if workers is None else workers
+    chunk = path_chunk(len(pnl))
+    counts = [min(chunk, paths - start) for start in range(0, paths, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    tasks = [(pnl, cash, count, method, chunk_seed) for count, chunk_seed in zip(counts, seeds)]
+
+    if workers <= 1 or len(tasks) <= 1:
+        return np.concatenate([simulate_chunk(*task) for task in tasks])
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return np.concatenate(list(executor.map(simulate_chunk, *zip(*tasks))))
+
+def summarize(results, actual, confidence=CONFIDENCE):
+    """
+    経路ごとの値から、項目ごとの平均・中央値・信頼区間の下限と上限の表を作る（actual は元の順番の取引の値）
+    """
+    lower, upper = (1 - confidence) / 2, (1 + confidence) / 2
+    return pd.DataFrame({
+        'Actual': actual,
+        'Mean': results.mean(axis=0),
+        f'Lower ({lower:.1%})': np.quantile(results, lower, axis=0),
+        'Median': np.median(results, axis=0),
+        f'Upper ({upper:.1%})': np.quantile(results, upper, axis=0),
+    }, index=METRICS)
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='取引の一覧から資産額の経路を作り、リターン・最大ドローダウン・勝率の信頼区間を求める')
+    parser.add_argument('trades', help='取引の一覧の CSV（例: output/USDJPY_trades_2023.csv）')
+    parser.add_argument('--method', choices=METHODS, default='bootstrap')
+    parser.add_argument('--paths', type=int, default=PATHS)
+    parser.add_argument('--cash', type=float, default=CASH)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE)
+    args = parser.parse_args(argv)
+
+    pnl = load_trades(args.trades)
+    start = time.perf_counter()
+    results = run_paths(pnl, args.cash, args.paths, args.method, args.seed, args.workers)
+    summary = summarize(results, path_metrics(pnl[None, :], args.cash)[0], args.confidence)
+    path = f'{os.path.splitext(args.trades)[0]}_montecarlo_{args.method}.csv'
+    summary.to_csv(path)
+    print(f"Monte Carlo: {len(pnl)} trades, {args.paths} {args.method} paths in {time.perf_counter() - start:.1f}s")
+    print(summary.to_string())
+    print(f"-> {path}")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,167 @@
+import os
+import pickle
+import hashlib
+import weakref
+import backtesting
+import numpy as np
+
+# 定数の定義
+RESULT_CACHE_FOLDER = os.path.join('cache', 'results')
+RESULT_CACHE_VERSION = 1  # 保存形式を変えたら上げる（古いエントリは使われなくなり、LRU で消える）
+RESULT_CACHE_MAX_BYTES = 512 * 1024 ** 2  # キャッシュ全体の上限。超えたら最後に使った時刻の古い順に消す
+RESULT_CACHE_ENABLED = True
+
+# DataFrame（id）→ (DataFrame への弱参照, 指紋)。同じプロセスで同じデータを何度もハッシュしないための覚え
+_fingerprints = {}
+
+def data_fingerprint(data):
+    """
+    読み込んだデータの切り出しの指紋（時刻・列名・値のバイト列の sha1）
+    同じプロセスで同じ DataFrame オブジェクトを渡したときは計算し直さない
+    """
+    memo = _fingerprints.get(id(data))
+    if memo is not None and memo[0]() is data:
+        return memo[1]
+    sha1 = hashlib.sha1()
+    sha1.update(np.ascontiguousarray(data.index.values.astype('datetime64[ns]').view(np.int64)).tobytes())
+    for column in data.columns:
+        values = np.ascontiguousarray(data[column].to_numpy())
+        sha1.update(f'{column}|{values.dtype.str}'.encode('utf-8'))
+        sha1.update(values.tobytes())
+    fingerprint = sha1.hexdigest()
+    for key in [key for key, (ref, _) in _fingerprints.items() if ref() is None]:
+        del _fingerprints[key]
+    _fingerprints[id(data)] = (weakref.ref(data), fingerprint)
+    return fingerprint
+
+def code_version(*paths):
+    """
+    結果に影響するソースファイルの内容と backtesting.py のバージョンから作るコードの版
+    """
+    sha1 = hashlib.sha1(f'v{RESULT_CACHE_VERSION}|{backtesting.__version__}'.encode('utf-8'))
+    for path in paths:
+        with open(path, 'rb') as file:
+            sha1.update(file.read())
+    return sha1.hexdigest()[:16]
+
+def make_key(*parts):
+    """
+    キーの要素（文字列・数値・タプル・辞書）から内容アドレスのキー（sha1）を作る
+    """
+    def normalize(part):
+        if isinstance(part, dict):
+            return tuple(sorted((key, normalize(value)) for key, value in part.items()))
+        if isinstance(part, (list, tuple)):
+            return tuple(normalize(value) for value in part)
+        if isinstance(part, np.generic):
+            return part.item()
+        return part
+    return hashlib.sha1(repr(normalize(parts)).encode('utf-8')).hexdigest()
+
+def storable_stats(stats):
+    """
+    stats を保存できる形にする（Backtest.run() の '_strategy' は戦略のインスタンスなので文字列にする）
+    """
+    if isinstance(stats['_strategy'], str):
+        return stats
+    stats = stats.copy()
+    stats['_strategy'] = str(stats['_strategy'])
+    return stats
+
+class ResultCache:
+    """
+    バックテストの結果（stats や最適化の1行）をキーごとに pickle で保存するキャッシュ
+    読んだエントリは更新時刻を今にし（LRU）、全体が max_bytes を超えたら更新時刻の古い順に消す
+    全体の大きさは最初の書き込みで1回だけ走査し、その後は書いた分を足していく（超えたときだけ走査し直す）
+    書き込みは一時ファイルから os.replace するので、途中で止まっても壊れたエントリは残らない
+    """
+    def __init__(self, folder=RESULT_CACHE_FOLDER, max_bytes=RESULT_CACHE_MAX_BYTES, enabled=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.enabled = RESULT_CACHE_ENABLED if enabled is None else enabled
+        self._total_bytes = None  # 前回走査したときの全体の大きさ + その後に書いた分（None なら未走査）
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], f'{key}.pkl')
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            os.utime(path)
+            return value
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def get_many(self, keys):
+        """
+        見つかったエントリだけを キー → 値 の辞書で返す
+        """
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def put_many(self, items):
+        if not self.enabled or not items:
+            return
+        written = 0
+        for key, value in items.items():
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                written += file.tell()
+            try:
+                written -= os.stat(path).st_size  # 同じキーを書き直したときは前のエントリの分を引く
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        if self._total_bytes is not None:
+            self._total_bytes += written
+        # 別のプロセスが書いた分は数えていないので、上限を超えたときは走査し直して正しい大きさから消す
+        if self._total_bytes is None or self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def cached(self, key, compute):
+        """
+        キーのエントリがあればそれを返し、なければ compute() の結果を保存して返す
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def evict(self):
+        """
+        全体の大きさが max_bytes 以下になるまで、最後に使った時刻の古いエントリから消す
+        """
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith('.pkl'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue  # 別のプロセスが消したエントリ
+                    entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._total_bytes = total
@@ -0,0 +1,232 @@
+import math
+import numpy as np
+import pandas as pd
+from GridOptimizer import (grid_search, use_day_index, prepare_search_bars, evaluate_combos, make_heatmap,
+                           best_position, cached_backtest)
+
+# 定数の定義
+SEARCH_METHODS = ['grid', 'random', 'bayesian', 'halving']  # all_params_{pair}.json の optimize.method に書ける値
+DEFAULT_BUDGET = 100   # grid 以外の探索で行うバックテストの回数
+SEARCH_SEED = 0        # 乱数の種（同じ設定なら同じ組み合わせを調べる）
+SEARCH_BATCH = 8       # bayesian で1回に提案してまとめて評価する組み合わせの数
+TPE_STARTUP = 10       # bayesian で最初にランダムに調べる組み合わせの最低数
+TPE_GAMMA = 0.25       # bayesian で「良い組み合わせ」とみなす上位の割合
+TPE_CANDIDATES = 256   # bayesian で1回の提案のために良い組み合わせの分布から引く候補の数
+HALVING_ETA = 3        # halving で1段ごとに残す割合（1/ETA）と期間を広げる倍率
+
+def grid_shape(param_grid):
+    return tuple(len(values) for values in param_grid.values())
+
+def make_combos(param_grid, flat_indices):
+    """
+    直積の通し番号（param_grid の順）から組み合わせの辞書のリストを作る
+    """
+    names, values = list(param_grid), [list(v) for v in param_grid.values()]
+    positions = np.unravel_index(np.asarray(flat_indices, dtype=np.int64), grid_shape(param_grid))
+    return [{name: values[j][int(positions[j][k])] for j, name in enumerate(names)}
+            for k in range(len(flat_indices))]
+
+def sample_indices(total, count, rng, exclude=()):
+    """
+    0 〜 total-1 から exclude 以外を重複なく count 個ランダムに選ぶ（全組み合わせを並べずに選ぶ）
+    """
+    exclude = set(exclude)
+    count = min(count, total - len(exclude))
+    chosen = []
+    while len(chosen) < count:
+        draw = rng.choice(total, size=min(total, count - len(chosen) + len(exclude)), replace=False)
+        for index in draw.tolist():
+            if index not in exclude:
+                exclude.add(index)
+                chosen.append(index)
+                if len(chosen) == count:
+                    break
+    return chosen
+
+def check_budget(param_grid, budget):
+    """
+    grid 以外の探索の前に、budget が1以上で調べる組み合わせがあることを確かめる（なければ ValueError）
+    """
+    if budget < 1:
+        raise ValueError(f'Search budget must be at least 1: {budget}')
+    if math.prod(grid_shape(param_grid)) == 0:
+        raise ValueError('No parameter combinations to test')
+
+def scores_of(results, maximize):
+    """
+    maximize の値（取引のない組み合わせは -inf）の配列
+    """
+    return results[maximize].where(results['# Trades'] > 0).astype(float).fillna(-np.inf).to_numpy()
+
+def finish(data, combos, results, rules, maximize):
+    """
+    評価済みの組み合わせ（combos と同じ順の results）から最良のものを選び、grid_search と同じ形の
+    (stats, results, heatmap) を返す
+    """
+    names = list(combos[0])
+    heatmap = make_heatmap(results, maximize, names)
+    stats = cached_backtest(data, combos[best_position(results, maximize, names)], rules)
+    return stats, results, heatmap
+
+def best_params(results, maximize, names):
+    """
+    結果のDataFrameから最良の組み合わせのパラメータを辞書で返す（halving の結果は最後の段から選ぶ）
+    """
+    if 'rung' in results:
+        results = results[results['rung'] == results['rung'].max()].reset_index(drop=True)
+    position = best_position(results, maximize, names)
+    return {name: results[name].to_numpy()[position].item() for name in names}
+
+def random_search(data, param_grid, rules, budget=DEFAULT_BUDGET, maximize='Win Rate [%]', workers=None,
+                  results_path=None, full_stats=None, seed=SEARCH_SEED):
+    """
+    全組み合わせから budget 個をランダムに選んで評価する
+    """
+    check_budget(param_grid, budget)
+    names = list(param_grid)
+    full_stats = not use_day_index(names, maximize) if full_stats is None else full_stats
+    rng = np.random.default_rng(seed)
+    combos = make_combos(param_grid, sorted(sample_indices(math.prod(grid_shape(param_grid)), budget, rng)))
+    results = evaluate_combos(data, prepare_search_bars(data, full_stats), combos, rules, full_stats, workers,
+                              results_path, label='Optimize (random)')
+    return finish(data, combos, results, rules, maximize)
+
+def _tpe_density(observed, size):
+    """
+    候補の番号 0 〜 size-1 上の分布（一様分布1つと観測値ごとの正規カーネルの平均）
+    パラメータの候補は昇順に並んでいる前提で、隣の候補にも重みを分ける
+    """
+    x = np.arange(size)
+    density = np.full(size, 1.0 / size)
+    if len(observed):
+        bandwidth = max(1.0, size / (1 + len(observed)) ** 0.5 / 2)
+        kernels = np.exp(-0.5 * ((x[None, :] - np.asarray(observed)[:, None]) / bandwidth) ** 2)
+        density = density + (kernels / kernels.sum(axis=1, keepdims=True)).sum(axis=0)
+    return density / density.sum()
+
+def propose_tpe(shape, evaluated, scores, count, rng):
+    """
+    Tree-structured Parzen Estimator（TPE）で次に調べる組み合わせ（通し番号）を count 個提案する
+    上位 TPE_GAMMA の組み合わせの分布 l と残りの分布 g をパラメータごとに作り、l から引いた候補のうち
+    l / g の大きいものを選ぶ
+    """
+    evaluated = np.asarray(evaluated, dtype=np.int64)
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    n_good = max(1, math.ceil(TPE_GAMMA * len(order)))
+    positions = np.stack(np.unravel_index(evaluated, shape), axis=1)
+    good, bad = positions[order[:n_good]], positions[order[n_good:]]
+
+    candidates = np.empty((TPE_CANDIDATES, len(shape)), dtype=np.int64)
+    gain = np.zeros(TPE_CANDIDATES)
+    for j, size in enumerate(shape):
+        l, g = _tpe_density(good[:, j], size), _tpe_density(bad[:, j], size)
+        candidates[:, j] = rng.choice(size, size=TPE_CANDIDATES, p=l)
+        gain += np.log(l[candidates[:, j]]) - np.log(g[candidates[:, j]])
+
+    flat = np.ravel_multi_index(candidates.T, shape)
+    seen = set(evaluated.tolist())
+    proposed = []
+    for index in flat[np.argsort(-gain, kind='stable')].tolist():
+        if index not in seen:
+            seen.add(index)
+            proposed.append(index)
+            if len(proposed) == count:
+                return proposed
+    # 候補が調べ済みばかりなら残りはランダムに選ぶ
+    return proposed + sample_indices(math.prod(shape), count - len(proposed), rng, seen)
+
+def bayesian_search(data, param_grid, rules, budget=DEFAULT_BUDGET, maximize='Win Rate [%]', workers=None,
+                    results_path=None, full_stats=None, seed=SEARCH_SEED):
+    """
+    最初に数個をランダムに調べ、その後は TPE で良さそうな組み合わせを SEARCH_BATCH 個ずつ提案して評価する
+    合計の評価回数は budget（全組み合わせの数を超えない）
+    """
+    check_budget(param_grid, budget)
+    names, shape = list(param_grid), grid_shape(param_grid)
+    full_stats = not use_day_index(names, maximize) if full_stats is None else full_stats
+    budget = min(budget, math.prod(shape))
+    rng = np.random.default_rng(seed)
+    bars = prepare_search_bars(data, full_stats)
+
+    evaluated = sample_indices(math.prod(shape), min(budget, max(TPE_STARTUP, budget // 4)), rng)
+    results = [evaluate_combos(data, bars, make_combos(param_grid, evaluated), rules, full_stats, workers,
+                               results_path, label='Optimize (bayesian)')]
+    while len(evaluated) < budget:
+        proposed = propose_tpe(shape, evaluated, scores_of(pd.concat(results), maximize),
+                               min(SEARCH_BATCH, budget - len(evaluated)), rng)
+        results.append(evaluate_combos(data, bars, make_combos(param_grid, proposed), rules, full_stats, workers,
+                                       results_path, label=f'Optimize (bayesian {len(evaluated)}/{budget})',
+                                       append=True))
+        evaluated += proposed
+    return finish(data, make_combos(param_grid, evaluated), pd.concat(results, ignore_index=True), rules, maximize)
+
+def halving_periods(index):
+    """
+    successive halving で区切る期間（年。1年分しかなければ月）ごとの各足の番号と、期間のラベル
+    """
+    periods = index.year
+    if len(np.unique(periods)) < 2:
+        periods = index.year * 100 + index.month
+    labels, codes = np.unique(periods, return_inverse=True)
+    return codes, [str(label) for label in labels]
+
+def halving_rungs(period_count, budget, eta=HALVING_ETA):
+    """
+    各段で使う期間の数（最新の期間から数える）と評価する組み合わせの数のリスト
+    期間は1つから始めて eta 倍ずつ広げ、最後の段は全期間。組み合わせの数の合計が budget 以下になるようにする
+    """
+    spans = [1]
+    while spans[-1] < period_count:
+        spans.append(min(period_count, spans[-1] * eta))
+    first = 1
+    while sum(math.ceil((first + 1) / eta ** r) for r in range(len(spans))) <= budget:
+        first += 1
+    return [(span, math.ceil(first / eta ** r)) for r, span in enumerate(spans)]
+
+def halving_search(data, param_grid, rules, budget=DEFAULT_BUDGET, maximize='Win Rate [%]', workers=None,
+                   results_path=None, full_stats=None, seed=SEARCH_SEED, eta=HALVING_ETA):
+    """
+    successive halving: ランダムに選んだ組み合わせを最新の1年（データが1年なら1か月）で評価し、上位 1/eta を
+    eta 倍の期間で評価し直す、を全期間まで繰り返す。最後の段（全期間）の結果から最良の組み合わせを選ぶ
+    結果のDataFrameには段の番号（'rung'）と評価した期間（'period'）の列が付く
+    """
+    check_budget(param_grid, budget)
+    names, shape = list(param_grid), grid_shape(param_grid)
+    full_stats = not use_day_index(names, maximize) if full_stats is None else full_stats
+    rng = np.random.default_rng(seed)
+    codes, labels = halving_periods(data.index)
+    rungs = halving_rungs(len(labels), budget, eta)
+
+    indices = sample_indices(math.prod(shape), rungs[0][1], rng)
+    results = []
+    for rung, (span, count) in enumerate(rungs):
+        first = len(labels) - span
+        rung_data = data[codes >= first]
+        period = labels[first] if span == 1 else f'{labels[first]}-{labels[-1]}'
+        indices = indices[:count]
+        combos = make_combos(param_grid, indices)
+        rung_results = evaluate_combos(rung_data, prepare_search_bars(rung_data, full_stats), combos, rules,
+                                       full_stats, workers, results_path, label=f'Optimize (halving {period})',
+                                       append=rung > 0, extra={'rung': rung, 'period': period})
+        results.append(rung_results)
+        # 次の段へは maximize の大きい順（同点なら先の組み合わせ）に残す
+        order = np.argsort(-scores_of(rung_results, maximize), kind='stable')
+        indices = [indices[i] for i in order]
+
+    stats, _, heatmap = finish(data, combos, results[-1].drop(columns=['rung', 'period']), rules, maximize)
+    return stats, pd.concat(results, ignore_index=True), heatmap
+
+def search(data, param_grid, rules, method='grid', budget=None, maximize='Win Rate [%]', workers=None,
+           results_path=None):
+    """
+    method（SEARCH_METHODS のどれか）でパラメータを探索する。grid 以外は budget 回まで評価する
+    (最良の組み合わせの stats, 評価した組み合わせの結果のDataFrame, heatmap) を返す
+    """
+    if method not in SEARCH_METHODS:
+        raise ValueError(f'Unknown optimize method: {method}')
+    if method == 'grid':
+        return grid_search(data, param_grid, rules, maximize=maximize, workers=workers, results_path=results_path)
+    budget = DEFAULT_BUDGET if budget is None else int(budget)
+    search_function = {'random': random_search, 'bayesian': bayesian_search, 'halving': halving_search}[method]
+    return search_function(data, param_grid, rules, budget=budget, maximize=maximize, workers=workers,
+                           results_path=results_path)
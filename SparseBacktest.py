@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from backtesting import Backtest
+from backtesting._stats import compute_stats
+from FixedTimeEngine import prepare_bars, strategy_masks, SKIP_WEEKDAYS, NO_ENTRY_WEEKDAYS, CLOSE_WINDOW
+
+def sparse_positions(bars, entry_time, take_profit, stop_loss, close_time, skip_weekdays=SKIP_WEEKDAYS,
+                     no_entry_weekdays=NO_ENTRY_WEEKDAYS, close_window=CLOSE_WINDOW):
+    """
+    MyStrategy の結果に関係する足の位置（昇順の int64 配列）
+    エントリーする足ごとに、その1本前から、SL/TP に最初に届く足か、約定後の最初の決済の時間帯の足の次の足
+    （成行決済が約定する足）のどちらか早い方までを残す（backtesting.py は最初の足で next を呼ばないので1本前から）
+    それ以外の足では建玉も未約定の注文もなく、資産額は直前の足と変わらない
+    """
+    n = len(bars['close'])
+    low, high = bars['low'], bars['high']
+    entry_mask, window_mask, sl_prices, tp_prices = strategy_masks(
+        bars, entry_time, take_profit, stop_loss, close_time, skip_weekdays, no_entry_weekdays, close_window)
+    entries = np.flatnonzero(entry_mask)
+    windows = np.flatnonzero(window_mask)
+    window_after = np.append(windows, n)[np.searchsorted(windows, entries + 1)]
+
+    # 区間の始まりで +1、終わりの次で -1 して累積し、どれかの区間に入る足を残す（区間は重なってもよい）
+    depth = np.zeros(n + 1, dtype=np.int64)
+    for entry, window in zip(entries.tolist(), window_after.tolist()):
+        stop = min(window + 2, n)
+        hit = (low[entry + 1:stop] <= sl_prices[entry]) | (high[entry + 1:stop] >= tp_prices[entry])
+        end = entry + 1 + int(hit.argmax()) if hit.any() else stop - 1
+        depth[entry - 1] += 1
+        depth[end + 1] -= 1
+    return np.flatnonzero(np.cumsum(depth[:n]) > 0)
+
+def run_sparse_backtest(data, strategy, entry_time, take_profit, stop_loss, close_time, cash, margin, size=None,
+                        skip_weekdays=SKIP_WEEKDAYS, no_entry_weekdays=NO_ENTRY_WEEKDAYS, close_window=CLOSE_WINDOW,
+                        bars=None):
+    """
+    sparse_positions の足だけのデータで strategy を Backtest(..., commission=0).run() し、全部の足で実行したときと
+    同じ stats を返す。取引の足の位置を元のデータの位置に戻し、残さなかった足の資産額を直前の足の資産額で埋めて
+    （建玉がないので現金のまま）から compute_stats で計算し直す
+    size は strategy の中で決まる（ENGINE_RULES をそのまま渡せるように受け取るだけ）
+    """
+    if bars is None:
+        bars = prepare_bars(data)
+    positions = sparse_positions(bars, entry_time, take_profit, stop_loss, close_time, skip_weekdays,
+                                 no_entry_weekdays, close_window)
+    params = dict(entry_time=entry_time, take_profit=take_profit, stop_loss=stop_loss, close_time=close_time)
+    if len(positions) < 2:
+        # エントリーする足がない（全部の足で実行しても取引はなく、資産額は cash のまま）
+        stats = compute_stats(trades=[], equity=np.full(len(data), float(cash)),
+                              ohlc_data=data, strategy_instance=None)
+        stats['_strategy'] = f"{strategy.__name__}({','.join(f'{k}={v}' for k, v in params.items())})"
+        return stats
+
+    sparse_stats = Backtest(data.iloc[positions], strategy, cash=cash, margin=margin,
+                            commission=0.000).run(**params)
+    trades = sparse_stats['_trades'].copy()
+    if len(trades):
+        trades['EntryBar'] = positions[trades['EntryBar'].to_numpy()]
+        trades['ExitBar'] = positions[trades['ExitBar'].to_numpy()]
+    else:
+        trades = []  # 取引がなければ、全部の足で実行したときと同じく空の一覧から計算する
+    equity = np.full(len(data), np.nan)
+    equity[positions] = sparse_stats['_equity_curve']['Equity'].to_numpy()
+    equity = pd.Series(equity).ffill().fillna(float(cash)).to_numpy()
+    return compute_stats(trades=trades, equity=equity, ohlc_data=data, strategy_instance=sparse_stats['_strategy'])
@@ -0,0 +1,131 @@
+import itertools
+import numpy as np
+import pandas as pd
+from FixedTimeEngine import (prepare_bars, simulate, fill_prices, make_trades_frame, trade_metrics, TRADE_METRICS,
+                             SKIP_WEEKDAYS, NO_ENTRY_WEEKDAYS, CLOSE_WINDOW)
+from ExitKernel import day_entries, exit_search
+
+# 定数の定義
+# 結果のテンソルに入れる統計項目（TRADE_METRICS のうち数値のもの。取引期間の Timedelta は入れない）
+TENSOR_METRICS = [name for name in TRADE_METRICS if 'Duration' not in name]
+TENSOR_AXES = ['entry_time', 'take_profit', 'stop_loss', 'close_time']  # テンソルの軸の順（最後の軸が統計項目）
+
+def _row_metrics(exits, entry_bars, entry_prices, exit_prices, size, cash, n, last_close):
+    """
+    取引日が独立している組み合わせの統計項目を、(組み合わせの数, 取引日の数) の配列のまま trade_metrics と同じ式で計算する
+    決済されない取引（exits < 0）は最後の日だけ（最終資産額には最後の足の終値で評価して入れる）
+    """
+    closed = exits >= 0
+    count = closed.sum(axis=1)
+    pl = np.where(closed, size * (exit_prices - entry_prices) - 0., np.nan)
+    returns = np.where(closed, exit_prices / entry_prices - 1 - 0., np.nan)
+    open_pl = np.where(closed[:, -1], 0., size * (last_close - entry_prices[:, -1]))
+    equity_final = cash + np.nansum(pl, axis=1) + open_pl
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        no_trades = np.where(count > 0, count, np.nan)
+        win_rate = (pl > 0).sum(axis=1) / no_trades
+        wins = np.nansum(np.where(returns > 0, returns, 0.), axis=1)
+        losses = np.abs(np.nansum(np.where(returns < 0, returns, 0.), axis=1))
+        gross = np.nansum(np.log(np.where(closed, returns + 1, 1.)), axis=1)
+        mean_pl = np.nansum(pl, axis=1) / no_trades
+        std_pl = np.sqrt(np.nansum((pl - mean_pl[:, None]) ** 2, axis=1) / (no_trades - 1))
+        mean_win = np.nansum(np.where(pl > 0, pl, 0.), axis=1) / (pl > 0).sum(axis=1)
+        mean_loss = np.nansum(np.where(pl < 0, pl, 0.), axis=1) / (pl < 0).sum(axis=1)
+        # 約定した足から決済の足まで（前の取引の決済の足と次の取引の約定の足が同じなら1本と数える）
+        shared = (closed[:, :-1] & closed[:, 1:] & (exits[:, :-1] == entry_bars[None, 1:])).sum(axis=1)
+        exposure = np.where(closed, exits - entry_bars[None, :] + 1, 0).sum(axis=1) - shared
+        return {
+            'Exposure Time [%]': exposure / n * 100,
+            'Equity Final [$]': equity_final,
+            'Return [%]': (equity_final - cash) / cash * 100,
+            '# Trades': count,
+            'Win Rate [%]': win_rate * 100,
+            'Best Trade [%]': np.where(count > 0, np.nanmax(np.where(closed, returns, -np.inf), axis=1), np.nan) * 100,
+            'Worst Trade [%]': np.where(count > 0, np.nanmin(np.where(closed, returns, np.inf), axis=1), np.nan) * 100,
+            # geometric_mean と同じく、1 + リターンが 0 以下の取引があれば 0
+            'Avg. Trade [%]': np.where(np.any(closed & (returns + 1 <= 0), axis=1), 0.,
+                                       np.exp(gross / no_trades) - 1) * 100,
+            'Profit Factor': wins / np.where(losses > 0, losses, np.nan),
+            'Expectancy [%]': np.nansum(np.where(closed, returns, 0.), axis=1) / no_trades * 100,
+            'SQN': np.sqrt(count) * mean_pl / np.where(std_pl > 0, std_pl, np.nan),
+            'Kelly Criterion': win_rate - (1 - win_rate) / (mean_win / -mean_loss),
+        }
+
+def evaluate_time_pair(bars, entry_time, close_time, take_profits, stop_losses, cash, margin, size,
+                       skip_weekdays=SKIP_WEEKDAYS, no_entry_weekdays=NO_ENTRY_WEEKDAYS, close_window=CLOSE_WINDOW,
+                       metrics=TENSOR_METRICS):
+    """
+    エントリー時刻と決済時刻の1組について、(TP, SL) の全組を ExitKernel.exit_search の1回の呼び出しで評価し、
+    (組み合わせの数, 統計項目の数) の配列を返す（take_profits と stop_losses は組み合わせごとの値で同じ長さ）
+    取引日を独立に扱えない組（取引の重なり・証拠金不足・資金切れのおそれ）は simulate で評価する
+    """
+    low, close, n = bars['low'], bars['close'], len(bars['close'])
+    take_profits = np.asarray(take_profits, dtype=np.float64)
+    stop_losses = np.asarray(stop_losses, dtype=np.float64)
+    results = np.full((len(take_profits), len(metrics)), np.nan)
+    entries, windows = day_entries(bars, entry_time, close_time, skip_weekdays, no_entry_weekdays, close_window)
+
+    if len(entries):
+        exits, exit_prices, _ = exit_search(bars, entries, windows, take_profits, stop_losses, size)
+        prices = close[entries][None, :]
+        sl_prices = prices - stop_losses[:, None]
+        entry_bars = entries + 1
+        entry_prices = np.broadcast_to(fill_prices(bars, entry_bars), exits.shape)
+        pl = np.where(exits >= 0, size * (exit_prices - entry_prices), 0.)
+        cash_before = cash + np.cumsum(pl, axis=1) - pl
+        # 保有中の安値は、約定の足から決済の時間帯の足（なければ最後の足）までの安値の最小以上
+        lowest = np.array([low[start:stop + 1].min() for start, stop in zip(entry_bars, np.minimum(windows, n - 1))])
+        independent = (
+            np.all((sl_prices < prices) & (prices < prices + take_profits[:, None]) & (sl_prices != 0), axis=1)
+            & np.all(exits[:, :-1] >= 0, axis=1)
+            & np.all(exits[:, :-1] <= entry_bars[None, 1:], axis=1)
+            & np.all(size * entry_prices <= np.maximum(0, cash_before) / margin, axis=1)
+            & np.all(cash_before + size * (lowest[None, :] - entry_prices) > 0, axis=1))
+        rows = _row_metrics(exits, entry_bars, entry_prices, exit_prices, size, float(cash), n, close[-1])
+        independent &= rows['Equity Final [$]'] > 0
+        results[independent] = np.column_stack([rows[name] for name in metrics])[independent]
+    else:
+        independent = np.zeros(len(take_profits), dtype=bool)
+
+    for combo in np.flatnonzero(~independent):
+        closed_trades, equity = simulate(bars, entry_time, take_profits[combo], stop_losses[combo], close_time,
+                                         cash, margin, size, skip_weekdays, no_entry_weekdays, close_window)
+        trades_df = make_trades_frame(bars, closed_trades)
+        row = trade_metrics(bars, trades_df['EntryBar'].to_numpy(), trades_df['ExitBar'].to_numpy(),
+                            trades_df['EntryPrice'].to_numpy(), trades_df['ExitPrice'].to_numpy(),
+                            trades_df['Size'].to_numpy(), equity[0], equity[-1])
+        results[combo] = [row[name] for name in metrics]
+    return results
+
+def backtest_tensor(data, entry_times, take_profits, stop_losses, close_times, rules, metrics=TENSOR_METRICS,
+                    bars=None):
+    """
+    パラメータの値の配列の直積をまとめて評価し、結果のテンソル
+    （len(entry_times), len(take_profits), len(stop_losses), len(close_times), len(metrics)）を返す
+    MyStrategy のクラス属性は変えないので、複数のスレッドやプロセスから同時に呼んでもよい
+    rules は run_fixed_time_backtest と同じ売買条件（cash, margin, size など）。値は run_fixed_time_backtest の
+    stats と同じ（エントリー時刻と決済時刻の組ごとに TP × SL の全組を1回で評価する）
+    """
+    if bars is None:
+        bars = prepare_bars(data)
+    take_profits = np.asarray(take_profits, dtype=np.float64)
+    stop_losses = np.asarray(stop_losses, dtype=np.float64)
+    tp_grid, sl_grid = (grid.ravel() for grid in np.meshgrid(take_profits, stop_losses, indexing='ij'))
+    tensor = np.full((len(entry_times), len(take_profits), len(stop_losses), len(close_times), len(metrics)), np.nan)
+    for (i, entry_time), (j, close_time) in itertools.product(enumerate(entry_times), enumerate(close_times)):
+        results = evaluate_time_pair(bars, int(entry_time), int(close_time), tp_grid, sl_grid, metrics=metrics,
+                                     **rules)
+        tensor[i, :, :, j] = results.reshape(len(take_profits), len(stop_losses), len(metrics))
+    return tensor
+
+def tensor_frame(tensor, entry_times, take_profits, stop_losses, close_times, metrics=TENSOR_METRICS):
+    """
+    backtest_tensor の結果を、1組1行（TENSOR_AXES の列 + 統計項目の列）の表にする（最適化の結果と同じ形）
+    """
+    index = pd.MultiIndex.from_product([list(entry_times), list(take_profits), list(stop_losses),
+                                        list(close_times)], names=TENSOR_AXES)
+    frame = pd.DataFrame(tensor.reshape(-1, len(metrics)), index=index, columns=metrics).reset_index()
+    if '# Trades' in metrics:
+        frame['# Trades'] = frame['# Trades'].astype(np.int64)
+    return frame
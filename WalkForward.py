@@ -0,0 +1,126 @@
+import os
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from backtesting._stats import compute_stats
+from FixedTimeEngine import prepare_bars, run_fixed_time_backtest
+from GridOptimizer import share_bars, attach_bars
+from SearchOptimizer import search, best_params
+
+# 定数の定義
+TRAIN_MONTHS = 24  # 最適化に使う期間（イン・サンプル）の月数
+TEST_MONTHS = 6    # 選んだパラメータでバックテストする次の期間（アウト・オブ・サンプル）の月数。窓はこの月数ずつ進める
+WORKERS = os.cpu_count() or 1  # 同時に処理する区間（fold）の数（1なら逐次）
+
+# ワーカープロセス側で共有メモリから組み立てたDataFrame
+_worker = {}
+
+def make_folds(index, train_months=TRAIN_MONTHS, test_months=TEST_MONTHS):
+    """
+    月初で区切った (学習の開始, 検証の開始, 検証の終わり) の足の位置のリスト（終わりは含まない）
+    位置は並んだ index への二分探索で求めるので、区間ごとのデータは data.iloc の連続したスライスになる
+    """
+    if len(index) == 0:
+        return []
+    first = index[0].to_period('M').to_timestamp()
+    folds = []
+    train_start = first
+    while True:
+        test_start = train_start + pd.DateOffset(months=train_months)
+        test_end = test_start + pd.DateOffset(months=test_months)
+        if test_start > index[-1]:
+            break
+        a, b, c = index.searchsorted([train_start, test_start, test_end])
+        if b > a and c > b:
+            folds.append((int(a), int(b), int(c)))
+        train_start = train_start + pd.DateOffset(months=test_months)
+    return folds
+
+def run_fold(data, fold, param_grid, rules, method, budget, maximize, workers):
+    """
+    1つの区間で、学習期間で最適化し、最良のパラメータで検証期間をバックテストする
+    (区間の要約の辞書, 検証期間の取引のDataFrame, 検証期間の資産額の配列) を返す
+    """
+    train_start, test_start, test_end = fold
+    train, test = data.iloc[train_start:test_start], data.iloc[test_start:test_end]
+    _, results, _ = search(train, param_grid, rules, method=method, budget=budget, maximize=maximize,
+                           workers=workers)
+    params = best_params(results, maximize, list(param_grid))
+    in_sample = run_fixed_time_backtest(train, **params, **rules)
+    stats = run_fixed_time_backtest(test, **params, **rules)
+
+    trades = stats['_trades'].copy()
+    trades['EntryBar'] += test_start
+    trades['ExitBar'] += test_start
+    summary = dict(train_start=train.index[0], train_end=train.index[-1],
+                   test_start=test.index[0], test_end=test.index[-1], **params,
+                   **{f'IS {maximize}': in_sample[maximize], 'IS # Trades': in_sample['# Trades'],
+                      'OOS # Trades': stats['# Trades'], 'OOS Win Rate [%]': stats['Win Rate [%]'],
+                      'OOS Return [%]': stats['Return [%]']})
+    return summary, trades, stats['_equity_curve']['Equity'].to_numpy()
+
+def _init_worker(spec):
+    blocks, _, data = attach_bars(spec)
+    _worker.update(blocks=blocks, data=data)
+
+def _run_fold(fold, param_grid, rules, method, budget, maximize):
+    # 区間を並列に処理しているときは、区間の中の最適化の進み具合は表示しない
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return run_fold(_worker['data'], fold, param_grid, rules, method, budget, maximize, workers=1)
+
+def stitch_equity(equities, cash):
+    """
+    区間ごとの資産額（それぞれ cash から始まる）を、前の区間の最後の資産額に損益を足す形でつなぐ
+    """
+    stitched, offset = [], 0.0
+    for equity in equities:
+        stitched.append(equity + offset)
+        offset = stitched[-1][-1] - cash
+    return np.concatenate(stitched)
+
+def walk_forward(data, param_grid, rules, method='grid', budget=None, maximize='Win Rate [%]',
+                 train_months=TRAIN_MONTHS, test_months=TEST_MONTHS, workers=None):
+    """
+    ウォークフォワード最適化: train_months の期間で最適化し、次の test_months をそのパラメータでバックテストする、
+    を test_months ずつずらして繰り返す。区間は workers 個のプロセスで並列に処理する（データは共有メモリで渡す）
+    検証期間をつないだ取引と資産額から compute_stats で統計を計算し、(stats, 区間ごとの要約のDataFrame) を返す
+    """
+    workers = WORKERS if workers is None else workers
+    folds = make_folds(data.index, train_months, test_months)
+    if not folds:
+        raise ValueError('Not enough data for a walk-forward fold')
+
+    outputs = [None] * len(folds)
+    if workers <= 1 or len(folds) <= 1:
+        for number, fold in enumerate(folds):
+            print(f"--- Walk-forward fold {number + 1}/{len(folds)} ---")
+            outputs[number] = run_fold(data, fold, param_grid, rules, method, budget, maximize, workers=None)
+    else:
+        blocks, spec = share_bars(prepare_bars(data))
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(folds)), initializer=_init_worker,
+                                     initargs=(spec,)) as executor:
+                futures = {executor.submit(_run_fold, fold, param_grid, rules, method, budget, maximize): number
+                           for number, fold in enumerate(folds)}
+                for done, future in enumerate(as_completed(futures), 1):
+                    outputs[futures[future]] = future.result()
+                    print(f"\rWalk-forward: {done}/{len(folds)} folds", end='', flush=True)
+            print()
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    summaries, trades, equities = zip(*outputs)
+    first, last = folds[0][1], folds[-1][2]
+    trades = pd.concat([fold_trades.assign(Fold=number) for number, fold_trades in enumerate(trades)],
+                       ignore_index=True)
+    trades['EntryBar'] -= first
+    trades['ExitBar'] -= first
+    equity = stitch_equity(equities, float(rules['cash']))
+    stats = compute_stats(trades=trades, equity=equity, ohlc_data=data.iloc[first:last], strategy_instance=None)
+    stats['_strategy'] = f"WalkForward(train_months={train_months},test_months={test_months},method={method})"
+    folds_df = pd.DataFrame(summaries)
+    folds_df.index.name = 'fold'
+    return stats, folds_df.reset_index()
@@ -0,0 +1,80 @@
+import os
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import GridOptimizer
+from FixedTimeEngine import prepare_bars
+
+# 定数の定義
+WORKERS = os.cpu_count() or 1  # 同時に処理する年の数（1なら逐次）
+
+# ワーカープロセス側で共有メモリから組み立てた全期間のDataFrame
+_worker = {}
+
+def year_slices(index, start_year, end_year):
+    """
+    年ごとの (年, 開始位置, 終了位置) のリスト（終了位置は含まない）
+    並んだ index への二分探索で求めるので、年ごとの全体のマスクは作らない
+    """
+    years = list(range(start_year, end_year + 1))
+    bounds = index.searchsorted(pd.to_datetime([f'{year}-01-01' for year in years + [end_year + 1]]))
+    return [(year, int(bounds[k]), int(bounds[k + 1])) for k, year in enumerate(years)]
+
+def _init_worker(spec, dtypes):
+    # 年を並列に処理しているときは、年の中の最適化はプロセスを増やさず逐次に評価する
+    GridOptimizer.WORKERS = 1
+    blocks, _, data = GridOptimizer.attach_bars(spec)
+    _worker.update(blocks=blocks, data=data, dtypes=dtypes)
+
+def _run_year(process, year, start, stop):
+    """
+    共有メモリの全期間のデータから [start, stop) の行を切り出して process に渡す
+    attach_bars の価格列は float64 なので、親プロセスと列の型が違えば戻す（年の分だけコピーする）
+    """
+    year_data = _worker['data'].iloc[start:stop]
+    dtypes = _worker['dtypes']
+    if not year_data.dtypes.equals(dtypes):
+        year_data = year_data[list(dtypes.index)].astype(dtypes.to_dict())
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ok = process(data=year_data, period=year) is not False
+    return ok, time.perf_counter() - start
+
+def run_yearly(process, data, start_year, end_year, workers=None):
+    """
+    process(data=年のデータ, period=年) を年ごとに呼ぶ。workers が2以上なら年ごとにプロセスを分けて同時に処理し、
+    終わった年から経過時間を表示する（年の中の出力は表示しない）
+    process は別プロセスに渡せる関数（モジュールの関数か、その functools.partial）
+    ワーカーには年ごとのデータを pickle して渡さず、全期間の価格配列を GridOptimizer.share_bars の共有メモリに
+    1回だけ置いて、年の開始・終了位置だけを渡す
+    失敗した年（例外か、process が False を返した年）のリストを返す
+    """
+    workers = WORKERS if workers is None else workers
+    slices = [(year, start, stop) for year, start, stop in year_slices(data.index, start_year, end_year)
+              if stop > start]
+    if workers <= 1 or len(slices) <= 1:
+        return [year for year, start, stop in slices if process(data=data.iloc[start:stop], period=year) is False]
+
+    failed = []
+    blocks, spec = GridOptimizer.share_bars(prepare_bars(data))
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(slices)), initializer=_init_worker,
+                                 initargs=(spec, data.dtypes)) as executor:
+            futures = {executor.submit(_run_year, process, year, start, stop): year for year, start, stop in slices}
+            for done, future in enumerate(as_completed(futures), 1):
+                year = futures[future]
+                try:
+                    ok, elapsed = future.result()
+                    status = f"done in {elapsed:.1f}s" if ok else f"failed after {elapsed:.1f}s"
+                    print(f"Yearly: {year} {status} ({done}/{len(slices)})", flush=True)
+                except Exception as e:
+                    ok = False
+                    print(f"Yearly: {year} failed: {e} ({done}/{len(slices)})", flush=True)
+                if not ok:
+                    failed.append(year)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return sorted(failed)
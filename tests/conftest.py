@@ -0,0 +1,27 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# リポジトリ直下のスクリプト（ClickData.py など）を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def make_minute_bars(start='2024-01-01', days=15, base=150.0, step=0.01, seed=0, gap=(2000, 2300)):
+    """
+    backtesting.py 形式の1分足（ランダムウォーク）。5% の足をランダムに抜き、gap の範囲の足もまとめて抜く
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start, periods=days * 1440, freq='min', unit='ns', name='Datetime')
+    keep = rng.random(len(index)) > 0.05
+    keep[slice(*gap)] = False
+    index = index[keep]
+    close = base + np.cumsum(rng.normal(0, step, len(index)))
+    open_ = np.concatenate(([base], close[:-1])) + rng.normal(0, step / 4, len(index))
+    high = np.maximum(open_, close) + rng.exponential(step, len(index))
+    low = np.minimum(open_, close) - rng.exponential(step, len(index))
+    return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close}, index=index)
+
+@pytest.fixture
+def minute_bars():
+    return make_minute_bars
@@ -0,0 +1,32 @@
+import pandas as pd
+import ClickData
+from AnalyzeClickFX import (calculate_stats_streaming, load_trade_data, resample_to_6min, calculate_volatility,
+                            calculate_yearly_stats_by_time_frame, calculate_monthly_stats_by_time_frame)
+from test_bar_store import write_archive
+
+def batch_stats(folder, start_year, end_year):
+    """
+    main の STREAMING = False と同じ手順（全期間を読み込んでから6分足にして集計する）
+    """
+    df = calculate_volatility(resample_to_6min(load_trade_data(folder, 'USDJPY', start_year, end_year)))
+    return calculate_yearly_stats_by_time_frame(df.copy()), calculate_monthly_stats_by_time_frame(df.copy())
+
+def test_streaming_matches_batch(tmp_path, monkeypatch):
+    # BarStore とキャッシュは作業フォルダの下に作られる
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ClickData, 'WORKERS', 1)
+    folder = str(tmp_path / 'download_file')
+    (tmp_path / 'download_file').mkdir()
+    for year, month, base in [(2022, 11, 128.0), (2022, 12, 129.5), (2023, 1, 130.0), (2023, 2, 131.0)]:
+        write_archive(folder, year, month, base)
+
+    syncs = []
+    sync = ClickData.BarStore.sync
+    monkeypatch.setattr(ClickData.BarStore, 'sync', lambda self, *args, **kwargs: syncs.append(args)
+                        or sync(self, *args, **kwargs))
+    streamed = calculate_stats_streaming(folder, 'USDJPY', 2022, 2023)
+    assert len(syncs) == 1  # 月ごとではなく最初に1回だけ更新する
+
+    for streamed_stats, expected in zip(streamed, batch_stats(folder, 2022, 2023)):
+        assert len(expected) > 0
+        pd.testing.assert_frame_equal(streamed_stats, expected, check_exact=False, rtol=1e-12, atol=1e-15)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+import BacktestClickFX
+import BacktestClickFX_EURJPY
+import BacktestClickCFD_silver
+from ClickData import to_spread_frame, SPREAD_COLUMN, SPREAD_DTYPE
+from FixedTimeEngine import run_fixed_time_backtest
+
+SPREAD = 0.004
+PARAMS = dict(entry_time=1600, take_profit=0.1, stop_loss=0.1, close_time=1700)
+
+@pytest.fixture
+def spread_frame(minute_bars):
+    # to_backtest_frame(FILL_COLUMNS) と同じ形（ASK の始値 = BID の始値 + 一定のスプレッド）から作る
+    data = minute_bars()
+    return data, to_spread_frame(data.assign(ASK_Open=data['Open'] + SPREAD))
+
+def test_spread_frame_keeps_bid_prices(spread_frame):
+    data, frame = spread_frame
+    assert list(frame.columns) == ['Open', 'High', 'Low', 'Close', SPREAD_COLUMN]
+    assert frame[SPREAD_COLUMN].dtype == np.dtype(SPREAD_DTYPE)
+    np.testing.assert_allclose(frame[SPREAD_COLUMN], SPREAD, atol=1e-6)
+    pd.testing.assert_frame_equal(frame[data.columns], data)
+
+def test_buys_fill_at_ask_and_exits_stay_on_bid(spread_frame):
+    data, frame = spread_frame
+    bid = run_fixed_time_backtest(data, **PARAMS, **BacktestClickFX.ENGINE_RULES)['_trades']
+    ask = run_fixed_time_backtest(frame, **PARAMS, **BacktestClickFX.ENGINE_RULES)['_trades']
+    assert len(ask) > 0
+    spread = frame[SPREAD_COLUMN].to_numpy()[ask['EntryBar']]
+    # 新規の買いは BID の始値 + スプレッド、SL/TP と決済の時間帯の決済は BID の価格のまま
+    np.testing.assert_array_equal(ask['EntryPrice'], data['Open'].to_numpy()[ask['EntryBar']] + spread)
+    pd.testing.assert_frame_equal(ask[['EntryBar', 'ExitBar', 'ExitPrice', 'SL', 'TP']],
+                                  bid[['EntryBar', 'ExitBar', 'ExitPrice', 'SL', 'TP']])
+    size = BacktestClickFX.ENGINE_RULES['size']
+    np.testing.assert_allclose(ask['PnL'], bid['PnL'] - size * spread, rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize('script, args', [(BacktestClickFX, ('USDJPY', 2023, 2023)),
+                                          (BacktestClickFX_EURJPY, (2023, 2023)),
+                                          (BacktestClickCFD_silver, (2023, 2023))])
+def test_ask_fills_require_fast_engine(monkeypatch, tmp_path, script, args):
+    monkeypatch.setattr(script, 'ASK_FILLS', True)
+    monkeypatch.setattr(script, 'FAST_ENGINE', False)
+    with pytest.raises(ValueError, match='FAST_ENGINE'):
+        script.load_data(*args, data_folder=str(tmp_path))
@@ -0,0 +1,73 @@
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+import ClickData
+from ClickData import BarStore, load_bars, BID_COLUMNS
+
+HEADER = "日時,始値(BID),高値(BID),安値(BID),終値(BID),始値(ASK),高値(ASK),安値(ASK),終値(ASK)\n"
+
+def write_archive(folder, year, month, base):
+    """
+    月の2〜4日の日本時間10時から30分ずつの1分足を入れたクリック証券形式のzipを作る
+    """
+    path = os.path.join(folder, f"USDJPY_{year}{month:02d}.zip")
+    with zipfile.ZipFile(path, 'w') as z:
+        for day in (2, 3, 4):
+            times = pd.date_range(pd.Timestamp(year=year, month=month, day=day, hour=10), periods=30, freq='min')
+            prices = base + np.arange(30) * 0.001
+            lines = [f"{t:%Y/%m/%d %H:%M:%S}," + ",".join(f"{p:.3f}" for p in [price] * 8)
+                     for t, price in zip(times, prices)]
+            z.writestr(f"{year}{month:02d}/USDJPY_{year}{month:02d}{day:02d}.csv",
+                       (HEADER + "\n".join(lines) + "\n").encode('shift_jis'))
+    return path
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    monkeypatch.setattr(ClickData, 'WORKERS', 1)
+    data_folder = tmp_path / 'download_file'
+    data_folder.mkdir()
+    for month, base in [(1, 130.0), (2, 131.0), (3, 132.0)]:
+        write_archive(str(data_folder), 2023, month, base)
+    return str(data_folder), str(tmp_path / 'cache'), str(tmp_path / 'bar_store')
+
+def assert_store_matches(data_folder, cache_folder, store_folder):
+    store = BarStore('USDJPY', store_folder=store_folder)
+    store.sync(data_folder, cache_folder, workers=1)
+    stored = store.to_frame(2023, 2023, BID_COLUMNS)
+    fresh = load_bars('USDJPY', 2023, 2023, columns=BID_COLUMNS, data_folder=data_folder,
+                      cache_folder=cache_folder, workers=1)
+    pd.testing.assert_frame_equal(stored, fresh, check_freq=False)
+    return stored.copy()  # memmap のビューは後の書き直しで中身が変わるのでコピーしておく
+
+def test_sync_reingests_overwritten_archive(folders):
+    data_folder, cache_folder, store_folder = folders
+    before = assert_store_matches(*folders)
+
+    # 同じ名前のzipを上書きする（フォルダの更新時刻は変わらない）
+    path = write_archive(data_folder, 2023, 2, 141.0)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    after = assert_store_matches(*folders)
+    assert len(after) == len(before)
+    assert not after['bid_open'].equals(before['bid_open'])
+
+def test_sync_removes_rows_of_deleted_archive(folders):
+    data_folder, cache_folder, store_folder = folders
+    before = assert_store_matches(*folders)
+
+    os.remove(os.path.join(data_folder, 'USDJPY_202302.zip'))
+    after = assert_store_matches(*folders)
+    assert len(after) == len(before) - 90
+    assert not ((after.index >= '2023-02-01') & (after.index < '2023-03-01')).any()
+
+@pytest.mark.parametrize('instrument, expected_rows', [('USDJPY', 1), ('SPOT_SILVER', 2)])
+def test_decode_archive_ex_members(tmp_path, instrument, expected_rows):
+    # "_EX" フォルダ内のCSVは、元のシルバーの分析と同じく EX_MEMBER_INSTRUMENTS の銘柄だけ読む
+    path = str(tmp_path / f"{instrument}_202301.zip")
+    line = "2023/01/02 10:00:00," + ",".join(["1.000"] * 8) + "\n"
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr(f"202301/{instrument}_20230102.csv", (HEADER + line).encode('shift_jis'))
+        z.writestr(f"202301_EX/{instrument}_20230102.csv", (HEADER + line.replace('10:00', '11:00')).encode('shift_jis'))
+    assert len(ClickData.decode_archive(path)) == expected_rows
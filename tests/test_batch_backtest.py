@@ -0,0 +1,38 @@
+import json
+import pytest
+import BatchBacktest
+import BacktestClickFX
+import BacktestClickFX_EURJPY
+import BacktestClickCFD_silver
+from BacktestCLI import EXIT_FAILED
+
+def test_profiles_use_script_rules():
+    # 売買条件はスクリプトの ENGINE_RULES をそのまま使う（コピーしない）
+    assert BatchBacktest.get_profile('USDJPY')[1] == BacktestClickFX.ENGINE_RULES
+    assert BatchBacktest.get_profile('EURJPY')[1] == BacktestClickFX_EURJPY.ENGINE_RULES
+    tz, rules = BatchBacktest.get_profile(BacktestClickCFD_silver.INSTRUMENT, {'SPOT_SILVER': {'cash': 500}})
+    assert tz == BatchBacktest.JST_TZ
+    assert rules == dict(BacktestClickCFD_silver.ENGINE_RULES, cash=500)
+
+def test_cfd_without_profile_is_skipped(tmp_path, capsys):
+    with pytest.raises(ValueError, match='US500'):
+        BatchBacktest.get_profile('US500')
+    batch = dict(BatchBacktest.get_default_batch(), instruments=['US500'])
+    results = BatchBacktest.run_batch(batch, 2024, 2024, data_folder=str(tmp_path), workers=1)
+    assert results.empty
+    assert 'skipped US500' in capsys.readouterr().out
+
+@pytest.mark.parametrize('year_range', [None, {}, {'start_year': 2020, 'end_year': None}])
+def test_no_years_fails_cleanly(tmp_path, monkeypatch, capsys, year_range):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(BatchBacktest, 'get_available_years', lambda data_folder: [])
+    batch_file = tmp_path / 'batch.json'
+    batch = BatchBacktest.get_default_batch()
+    if year_range is None:
+        del batch['year_range']
+    else:
+        batch['year_range'] = year_range
+    batch_file.write_text(json.dumps(batch))
+    assert BatchBacktest.main(str(batch_file)) == EXIT_FAILED
+    assert 'No data' in capsys.readouterr().err
+    assert not (tmp_path / 'output').exists()
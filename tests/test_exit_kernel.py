@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import ExitKernel
+from ExitKernel import day_entries, exit_search
+from FixedTimeEngine import prepare_bars
+
+def search_inputs(minute_bars, spread):
+    data = minute_bars(days=12, seed=4)
+    # 最後のエントリー時刻の数本後で切り、決済されない取引（決済の足 -1、価格と損益 NaN）を残す
+    last_entry = np.flatnonzero((data.index.hour == 16) & (data.index.minute == 0)
+                                & ~data.index.weekday.isin([2, 4]))[-1]
+    data = data.iloc[:last_entry + 10]
+    if spread:
+        data['Spread'] = np.full(len(data), 0.003, dtype='float32')
+    bars = prepare_bars(data)
+    rng = np.random.default_rng(5)
+    # 同じ足で SL と TP の両方に届く幅や、決済の時間帯まで届かない幅も混ぜる
+    take_profits = np.concatenate([rng.uniform(0.005, 0.3, 40), [0.01, 5.0]])
+    stop_losses = np.concatenate([rng.uniform(0.005, 0.3, 40), [0.01, 5.0]])
+    entries, windows = day_entries(bars, 1600, 1700)
+    return bars, entries, windows, take_profits, stop_losses
+
+def run_backend(monkeypatch, backend, bars, entries, windows, take_profits, stop_losses):
+    if backend == 'python':
+        # Numba でコンパイルする前の同じループを Python のまま実行したものを基準にする
+        monkeypatch.setattr(ExitKernel, '_search_compiled', ExitKernel._search_loop)
+    monkeypatch.setattr(ExitKernel, 'USE_NUMBA', backend != 'numpy')
+    return exit_search(bars, entries, windows, take_profits, stop_losses, size=2)
+
+@pytest.mark.parametrize('spread', [False, True], ids=['bid', 'ask'])
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_backends_are_identical(minute_bars, monkeypatch, backend, spread):
+    if backend == 'numba' and ExitKernel.njit is None:
+        pytest.skip('numba is not installed')
+    inputs = search_inputs(minute_bars, spread)
+    with monkeypatch.context() as patch:
+        expected = run_backend(patch, 'python', *inputs)
+    result = run_backend(monkeypatch, backend, *inputs)
+    assert (expected[0] >= 0).any() and np.isnan(expected[1]).any()
+    for name, values, reference in zip(['exit_bars', 'exit_prices', 'pnl'], result, expected):
+        assert np.array_equal(values, reference, equal_nan=True), name
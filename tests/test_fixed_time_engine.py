@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+from backtesting import Backtest
+import BacktestClickFX
+import BacktestClickFX_EURJPY
+import BacktestClickCFD_silver
+from FixedTimeEngine import run_fixed_time_backtest, prepare_bars, strategy_masks
+
+# backtesting.py が出す証拠金不足・未決済の建玉・取引なしの統計の警告は、比べる条件そのものなので表示しない
+pytestmark = pytest.mark.filterwarnings('ignore::UserWarning', 'ignore::RuntimeWarning')
+
+def run_both(data, strategy, params, rules):
+    """
+    FixedTimeEngine と Backtest(data, strategy, ...).run() の stats
+    """
+    engine = run_fixed_time_backtest(data, **params, **rules)
+    expected = Backtest(data, strategy, cash=rules['cash'], margin=rules['margin'], commission=0.000).run(**params)
+    return engine, expected
+
+def assert_same_stats(engine, expected):
+    pd.testing.assert_frame_equal(engine['_trades'], expected['_trades'])
+    keys = [key for key in expected.index if not key.startswith('_')]
+    pd.testing.assert_series_equal(engine[keys], expected[keys], check_exact=True)
+    # NaN と NaT は assert_series_equal では区別されないので型も比べる
+    assert [type(engine[key]) for key in keys] == [type(expected[key]) for key in keys]
+
+def signal_weekdays(trades):
+    """
+    取引の注文を出した足の曜日（約定は注文の次の足なので、約定の1分前で見る）
+    """
+    if not len(trades):
+        return pd.Series([], dtype=np.int64)
+    return (pd.to_datetime(trades['EntryTime']) - pd.Timedelta(minutes=1)).dt.weekday
+
+def entry_signals(data, params, rules):
+    """
+    価格の条件を除いて、MyStrategy が新規の注文を出す足の数
+    """
+    entry_mask, _, _, _ = strategy_masks(prepare_bars(data), params['entry_time'], np.inf, np.inf,
+                                         params['close_time'], **{key: value for key, value in rules.items()
+                                                                  if key not in ('cash', 'margin', 'size')})
+    return int(entry_mask.sum())
+
+@pytest.mark.parametrize('params', [
+    dict(entry_time=1600, take_profit=0.1, stop_loss=0.1, close_time=1700),
+    dict(entry_time=1615, take_profit=0.05, stop_loss=0.2, close_time=30),
+    # 決済の時間帯が日付の変わり目の前後（23時台の最後の数分と0時台の最初の数分）
+    dict(entry_time=2200, take_profit=0.5, stop_loss=0.5, close_time=2359),
+    dict(entry_time=2330, take_profit=0.5, stop_loss=0.5, close_time=0),
+    # 取引がない（取引期間の統計が NaN）
+    dict(entry_time=1231, take_profit=0.1, stop_loss=0.1, close_time=1232),
+], ids=['day', 'overnight', 'window-2359', 'window-0000', 'no-trades'])
+def test_fx_matches_backtesting(minute_bars, params):
+    data = minute_bars()
+    engine, expected = run_both(data, BacktestClickFX.MyStrategy, params, BacktestClickFX.ENGINE_RULES)
+    assert_same_stats(engine, expected)
+    # 水曜日はエントリーせず、金曜日は何もしない
+    assert not signal_weekdays(expected['_trades']).isin([2, 4]).any()
+
+def test_eurjpy_rules_match_backtesting(minute_bars):
+    params = dict(entry_time=1600, take_profit=0.1, stop_loss=0.1, close_time=1700)
+    engine, expected = run_both(minute_bars(seed=1), BacktestClickFX_EURJPY.MyStrategy, params,
+                                BacktestClickFX_EURJPY.ENGINE_RULES)
+    assert_same_stats(engine, expected)
+    assert expected['# Trades'] > 0
+
+def test_margin_rejection_matches_backtesting(minute_bars):
+    # 価格が現金の前後を動くので、証拠金が足りずに取り消される注文と約定する注文が混ざる
+    data = minute_bars(base=100.0, step=0.05, seed=2)
+    params = dict(entry_time=1600, take_profit=0.3, stop_loss=0.3, close_time=1700)
+    rules = dict(cash=100, margin=1, size=BacktestClickFX.SIZE)
+    engine, expected = run_both(data, BacktestClickFX.MyStrategy, params, rules)
+    assert_same_stats(engine, expected)
+    assert 0 < expected['# Trades'] < entry_signals(data, params, BacktestClickFX.ENGINE_RULES)
+
+def test_open_trade_at_end_matches_backtesting(minute_bars):
+    data = minute_bars(days=8)
+    # 最後のエントリー時刻の足の数本後でデータを切り、決済されない建玉を残す
+    last_entry = np.flatnonzero((data.index.hour == 16) & (data.index.minute == 0)
+                                & ~data.index.weekday.isin([2, 4]))[-1]
+    data = data.iloc[:last_entry + 5]
+    params = dict(entry_time=1600, take_profit=10.0, stop_loss=10.0, close_time=1700)
+    engine, expected = run_both(data, BacktestClickFX.MyStrategy, params, BacktestClickFX.ENGINE_RULES)
+    assert_same_stats(engine, expected)
+    closed_pnl = expected['_trades']['PnL'].sum()
+    assert expected['Equity Final [$]'] != pytest.approx(BacktestClickFX.CASH + closed_pnl)
+
+@pytest.mark.parametrize('params', [
+    dict(entry_time=1630, take_profit=0.05, stop_loss=0.05, close_time=30),
+    dict(entry_time=2345, take_profit=0.2, stop_loss=0.2, close_time=0),
+])
+def test_silver_rules_match_backtesting(minute_bars, params):
+    data = minute_bars(base=25.0, step=0.01, seed=3)
+    engine, expected = run_both(data, BacktestClickCFD_silver.MyStrategy, params,
+                                BacktestClickCFD_silver.ENGINE_RULES)
+    assert_same_stats(engine, expected)
+    # 曜日の除外がないので、水曜日と金曜日にも取引する
+    assert signal_weekdays(expected['_trades']).isin([2, 4]).any()
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+import FixedTimeEngine
+import GridOptimizer
+import BacktestClickFX
+from FixedTimeEngine import TRADE_METRICS
+from GridOptimizer import grid_search
+from ResultCache import ResultCache
+
+# 決済時刻 2599 の決済の時間帯はないので、TP/SL の幅が広いと取引が重なり、日ごとの索引では決められない
+PARAM_GRID = dict(entry_time=[1600, 1615], take_profit=[0.05, 0.2, 2.0], stop_loss=[0.05, 0.2, 2.0],
+                  close_time=[1700, 30, 2599])
+
+@pytest.fixture
+def no_result_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(GridOptimizer, 'RESULT_CACHE', ResultCache(str(tmp_path), enabled=False))
+
+@pytest.mark.parametrize('maximize', ['Win Rate [%]', 'Return [%]'])
+def test_day_index_matches_full_stats(minute_bars, monkeypatch, no_result_cache, maximize):
+    data = minute_bars()
+    lookups = []
+    lookup_trades = FixedTimeEngine.lookup_trades
+    monkeypatch.setattr(FixedTimeEngine, 'lookup_trades',
+                        lambda *args: lookups.append(lookup_trades(*args)) or lookups[-1])
+
+    day_stats, day_results, _ = grid_search(data, PARAM_GRID, BacktestClickFX.ENGINE_RULES, maximize=maximize,
+                                            workers=1, full_stats=False)
+    # 索引の参照で決めた組と、simulate で評価し直した組の両方がある
+    assert any(found is None for found in lookups) and any(found is not None for found in lookups)
+
+    full_stats, full_results, _ = grid_search(data, PARAM_GRID, BacktestClickFX.ENGINE_RULES, maximize=maximize,
+                                              workers=1, full_stats=True)
+    names = list(PARAM_GRID)
+    pd.testing.assert_frame_equal(day_results[names + TRADE_METRICS], full_results[names + TRADE_METRICS],
+                                  check_exact=True)
+    assert day_stats['_strategy'] == full_stats['_strategy']
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+import MonteCarlo
+from MonteCarlo import run_paths, path_chunk
+
+PNL = np.array([1.5, -0.7, 0.3, -1.2, 2.0, 0.4, -0.1])
+
+def test_path_chunk_bounds_elements():
+    assert path_chunk(1) == MonteCarlo.CHUNK_ELEMENTS
+    assert path_chunk(1000) * 1000 <= MonteCarlo.CHUNK_ELEMENTS
+    assert path_chunk(MonteCarlo.CHUNK_ELEMENTS * 2) == 1
+
+@pytest.mark.parametrize('method', MonteCarlo.METHODS)
+def test_run_paths_independent_of_workers(monkeypatch, method):
+    # 経路が複数のまとまりに分かれる大きさにして、プロセス数を変えても同じ結果になることを確かめる
+    monkeypatch.setattr(MonteCarlo, 'CHUNK_ELEMENTS', 7 * 40)
+    serial = run_paths(PNL, paths=300, method=method, seed=1, workers=1)
+    parallel = run_paths(PNL, paths=300, method=method, seed=1, workers=2)
+    assert serial.shape == (300, len(MonteCarlo.METRICS))
+    np.testing.assert_array_equal(serial, parallel)
+
+def test_run_paths_rejects_bad_input():
+    with pytest.raises(ValueError, match='Unknown method'):
+        run_paths(PNL, method='jackknife')
+    with pytest.raises(ValueError, match='No trades'):
+        run_paths(np.array([]))
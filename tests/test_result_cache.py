@@ -0,0 +1,23 @@
+import os
+import ResultCache as result_cache_module
+from ResultCache import ResultCache
+
+def cache_size(folder):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(folder) for name in files)
+
+def test_put_many_scans_only_when_over_limit(tmp_path, monkeypatch):
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(result_cache_module.os, 'walk', lambda folder: walks.append(folder) or walk(folder))
+    cache = ResultCache(str(tmp_path), max_bytes=20_000, enabled=True)
+
+    cache.put_many({f'{i:040x}': bytes(1000) for i in range(5)})
+    assert len(walks) == 1  # 最初の書き込みで全体の大きさを1回だけ数える
+    cache.put_many({f'{i:040x}': bytes(1000) for i in range(5, 10)})
+    assert len(walks) == 1
+
+    # 上限を超えたら走査し直して、最後に使った時刻の古いエントリから消す
+    cache.put_many({f'{i:040x}': bytes(1000) for i in range(10, 30)})
+    assert len(walks) == 2
+    assert cache_size(str(tmp_path)) <= 20_000
+    assert cache.get(f'{29:040x}') == bytes(1000)
@@ -0,0 +1,18 @@
+import pytest
+from SearchOptimizer import random_search, bayesian_search, halving_search, halving_rungs
+
+GRID = {'entry_time': [1, 2, 3], 'take_profit': [0.1, 0.2]}
+
+@pytest.mark.parametrize('search_function', [random_search, bayesian_search, halving_search])
+@pytest.mark.parametrize('param_grid, budget', [(GRID, 0), (GRID, -5), ({'entry_time': [], 'take_profit': [0.1]}, 10)])
+def test_search_rejects_empty_budget_or_grid(search_function, param_grid, budget):
+    # evaluate_combos に空の組み合わせを渡す前に ValueError にする（データは読まれない）
+    with pytest.raises(ValueError):
+        search_function(None, param_grid, {}, budget=budget)
+
+@pytest.mark.parametrize('period_count', [1, 2, 5, 10])
+@pytest.mark.parametrize('budget', [1, 2, 3, 50])
+def test_halving_rungs_keep_candidates(period_count, budget):
+    rungs = halving_rungs(period_count, budget)
+    assert rungs[-1][0] == period_count
+    assert all(count >= 1 for _, count in rungs)
@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+from backtesting import Backtest
+import BacktestClickFX
+import BacktestClickCFD_silver
+from SparseBacktest import run_sparse_backtest
+
+# backtesting.py の未決済の建玉・取引なしの統計の警告は表示しない
+pytestmark = pytest.mark.filterwarnings('ignore::UserWarning', 'ignore::RuntimeWarning')
+COMPARED = ['Equity Final [$]', 'Max. Drawdown [%]', 'Exposure Time [%]']
+
+@pytest.mark.parametrize('script, params, base', [
+    (BacktestClickFX, dict(entry_time=1600, take_profit=0.1, stop_loss=0.1, close_time=1700), 150.0),
+    (BacktestClickFX, dict(entry_time=2330, take_profit=0.5, stop_loss=0.5, close_time=0), 150.0),
+    (BacktestClickFX, dict(entry_time=1231, take_profit=0.1, stop_loss=0.1, close_time=1232), 150.0),
+    (BacktestClickCFD_silver, dict(entry_time=1630, take_profit=0.05, stop_loss=0.05, close_time=30), 25.0),
+], ids=['fx', 'fx-overnight', 'no-trades', 'silver'])
+def test_sparse_matches_full_run(minute_bars, script, params, base):
+    data = minute_bars(base=base, days=10)
+    rules = script.ENGINE_RULES
+    sparse = run_sparse_backtest(data, script.MyStrategy, **params, **rules)
+    full = Backtest(data, script.MyStrategy, cash=rules['cash'], margin=rules['margin'],
+                    commission=0.000).run(**params)
+    pd.testing.assert_frame_equal(sparse['_trades'], full['_trades'])
+    for key in COMPARED:
+        assert sparse[key] == pytest.approx(full[key], rel=1e-12, abs=1e-12), key
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import TensorBacktest
+import BacktestClickFX
+from FixedTimeEngine import run_fixed_time_backtest
+from TensorBacktest import backtest_tensor, TENSOR_METRICS
+
+ENTRY_TIMES = [1600, 1615]
+TAKE_PROFITS = [0.05, 0.2, 2.0]
+STOP_LOSSES = [0.05, 0.2, 2.0]
+
+def assert_cells_match(data, tensor, close_times):
+    for i, entry_time in enumerate(ENTRY_TIMES):
+        for j, take_profit in enumerate(TAKE_PROFITS):
+            for k, stop_loss in enumerate(STOP_LOSSES):
+                for m, close_time in enumerate(close_times):
+                    stats = run_fixed_time_backtest(data, entry_time, take_profit, stop_loss, close_time,
+                                                    **BacktestClickFX.ENGINE_RULES)
+                    expected = np.array([stats[name] for name in TENSOR_METRICS], dtype=np.float64)
+                    np.testing.assert_allclose(tensor[i, j, k, m], expected, rtol=1e-12, atol=1e-12,
+                                               err_msg=f'{entry_time} {take_profit} {stop_loss} {close_time}')
+
+def count_simulate(monkeypatch):
+    calls = []
+    simulate = TensorBacktest.simulate
+    monkeypatch.setattr(TensorBacktest, 'simulate', lambda *args: calls.append(args) or simulate(*args))
+    return calls
+
+def test_independent_days_match_engine(minute_bars, monkeypatch):
+    data = minute_bars()
+    calls = count_simulate(monkeypatch)
+    close_times = [1700, 1630]
+    tensor = backtest_tensor(data, ENTRY_TIMES, TAKE_PROFITS, STOP_LOSSES, close_times,
+                             BacktestClickFX.ENGINE_RULES)
+    assert tensor.shape == (2, 3, 3, 2, len(TENSOR_METRICS))
+    # 取引日がすべて独立しているので、simulate での評価し直しはない
+    assert not calls
+    assert_cells_match(data, tensor, close_times)
+
+def test_overlapping_combos_fall_back_to_simulate(minute_bars, monkeypatch):
+    data = minute_bars()
+    calls = count_simulate(monkeypatch)
+    # 決済時刻 2599 の決済の時間帯はないので、TP/SL の幅が広いと取引が重なる
+    close_times = [2599]
+    tensor = backtest_tensor(data, ENTRY_TIMES, TAKE_PROFITS, STOP_LOSSES, close_times,
+                             BacktestClickFX.ENGINE_RULES)
+    assert 0 < len(calls) < len(ENTRY_TIMES) * len(TAKE_PROFITS) * len(STOP_LOSSES)
+    assert_cells_match(data, tensor, close_times)
@@ -0,0 +1,54 @@
+import os
+import zipfile
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import pandas as pd
+import pytest
+import ClickData
+from ClickData import parse_timestamps, load_bars, JST_TZ, NY_TZ
+
+FORMATS = ['%Y/%m/%d %H:%M:%S', '%Y%m%d%H%M%S', '%Y%m%d%H%M']  # FX（2種類）と CFD
+HEADER = "日時,始値(BID),高値(BID),安値(BID),終値(BID),始値(ASK),高値(ASK),安値(ASK),終値(ASK)\n"
+# 米国の夏時間の開始（2023-03-12 02:00 NY = 15:00 JST）と終了（2023-11-05 02:00 NY = 15:00 JST）の週末
+TRANSITIONS = [pd.date_range('2023-03-11 00:00', '2023-03-13 23:59', freq='7min'),
+               pd.date_range('2023-11-04 00:00', '2023-11-06 23:59', freq='7min')]
+
+def reference_ny_time(text, fmt):
+    """
+    1行ずつ zoneinfo で日本時間から NY 時間（タイムゾーンなし）に変換する
+    """
+    japan_time = datetime.strptime(text, fmt).replace(tzinfo=ZoneInfo(JST_TZ))
+    return pd.Timestamp(japan_time.astimezone(ZoneInfo(NY_TZ)).replace(tzinfo=None))
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('times', TRANSITIONS, ids=['march', 'november'])
+def test_parse_and_convert_matches_row_by_row(fmt, times):
+    texts = list(times.strftime(fmt))
+    converted = parse_timestamps(texts).dt.tz_localize(JST_TZ).dt.tz_convert(NY_TZ).dt.tz_localize(None)
+    expected = [reference_ny_time(text, fmt) for text in texts]
+    assert converted.tolist() == expected
+
+def test_mixed_formats_in_one_column():
+    times = TRANSITIONS[1]
+    texts = [time.strftime(FORMATS[i % len(FORMATS)]) for i, time in enumerate(times)]
+    # 分までのフォーマットでは秒が落ちるので、参照も同じ文字列から作る
+    expected = [reference_ny_time(text, FORMATS[i % len(FORMATS)]) for i, text in enumerate(texts)]
+    converted = parse_timestamps(texts).dt.tz_localize(JST_TZ).dt.tz_convert(NY_TZ).dt.tz_localize(None)
+    assert converted.tolist() == expected
+
+@pytest.mark.parametrize('times', TRANSITIONS, ids=['march', 'november'])
+def test_load_bars_converts_across_dst(tmp_path, monkeypatch, times):
+    monkeypatch.setattr(ClickData, 'WORKERS', 1)
+    data_folder = tmp_path / 'download_file'
+    data_folder.mkdir()
+    month = f"{times[0]:%Y%m}"
+    with zipfile.ZipFile(data_folder / f"USDJPY_{month}.zip", 'w') as z:
+        for day, group in pd.Series(times, index=times).groupby(times.normalize()):
+            fmt = FORMATS[day.day % 2]  # FX の2種類のフォーマットを日ごとに使う
+            lines = [f"{time:{fmt}}," + ",".join(['130.000'] * 8) for time in group]
+            z.writestr(f"{month}/USDJPY_{day:%Y%m%d}.csv", (HEADER + "\n".join(lines) + "\n").encode('shift_jis'))
+
+    bars = load_bars('USDJPY', times[0].year, times[0].year, data_folder=str(data_folder),
+                     cache_folder=str(tmp_path / 'cache'), workers=1)
+    expected = sorted({reference_ny_time(f"{time:%Y%m%d%H%M%S}", '%Y%m%d%H%M%S') for time in times})
+    assert bars.index.tolist() == expected
@@ -0,0 +1,29 @@
+import os
+from functools import partial
+import numpy as np
+import pandas as pd
+import pytest
+from YearlyRunner import run_yearly
+
+def save_year(folder, data, period):
+    data.to_pickle(os.path.join(folder, f'{period}.pkl'))
+    return period != 2022  # 2022年は失敗した年として返す
+
+@pytest.mark.parametrize('dtype, spread', [('float64', False), ('float32', True)])
+def test_parallel_years_match_serial_slices(tmp_path, dtype, spread):
+    index = pd.date_range('2021-12-30', '2023-01-02', freq='6h', name='Datetime', unit='ns')  # ClickData と同じ ns
+    prices = 100 + np.arange(len(index)) * 0.01
+    data = pd.DataFrame({'Open': prices, 'High': prices + 0.5, 'Low': prices - 0.5, 'Close': prices + 0.1},
+                        index=index).astype(dtype)
+    if spread:
+        data['Spread'] = np.full(len(index), 0.003, dtype='float32')
+
+    serial, parallel = tmp_path / 'serial', tmp_path / 'parallel'
+    serial.mkdir()
+    parallel.mkdir()
+    assert run_yearly(partial(save_year, str(serial)), data, 2021, 2023, workers=1) == [2022]
+    # 並列では年ごとのデータを pickle せず、共有メモリの全期間から切り出す
+    assert run_yearly(partial(save_year, str(parallel)), data, 2021, 2023, workers=2) == [2022]
+    for year in (2021, 2022, 2023):
+        pd.testing.assert_frame_equal(pd.read_pickle(parallel / f'{year}.pkl'), pd.read_pickle(serial / f'{year}.pkl'),
+                                      check_freq=False)